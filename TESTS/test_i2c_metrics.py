@@ -0,0 +1,92 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import i2c
+
+from globals import *
+from utils   import *
+from log     import *
+
+# Tested classes log as they go: keep it to errors
+log_init(ERROR)
+
+
+class TestBusLoad(unittest.TestCase):
+
+    # One extender write: address, register & both output latches
+    BYTES_COUNT = 4
+    BITS_COUNT  = BYTES_COUNT * i2c.I2cMetrics.BITS_PER_BYTE + i2c.I2cMetrics.BITS_PER_TRANSACTION
+
+    def setUp(self):
+
+        self.saved_bus_clock = control.i2c_bus_clock
+        self.clock           = VirtualClock()
+        self.previous_clock  = set_clock(self.clock)
+        self.metrics         = i2c.I2cMetrics()
+
+        control.i2c_bus_clock = 100000
+
+        return
+
+    def tearDown(self):
+
+        set_clock(self.previous_clock)
+
+        control.i2c_bus_clock = self.saved_bus_clock
+
+        return
+
+    def write(self, count):
+
+        # Transactions latency does not matter: only bits on the bus do
+        for index in range(0, count):
+            self.metrics.record(1, 0x20, 0x14, self.BYTES_COUNT, self.clock.monotonic(), self.clock.monotonic() + 0.001)
+
+        return
+
+    def test_load_per_second(self):
+
+        self.write(100)
+        self.clock.sleep(1.0)
+        self.write(50)
+
+        loads = self.metrics.get_loads(1)
+
+        self.assertEqual(len(loads), 2)
+        self.assertAlmostEqual(loads[0][1], 100 * self.BITS_COUNT / 100000)
+        self.assertAlmostEqual(loads[1][1], 50 * self.BITS_COUNT / 100000)
+        self.assertAlmostEqual(self.metrics.get_peak_load(), loads[0][1])
+
+    def test_load_over_playback(self):
+
+        # Writes out of playback do not count, and playback seconds with no write do
+        self.write(100)
+
+        self.metrics.start_playback()
+        self.write(200)
+        self.clock.sleep(4.0)
+        self.metrics.stop_playback()
+
+        self.write(100)
+
+        playback_load, playback_time = self.metrics.get_playback_load(1)
+
+        self.assertAlmostEqual(playback_time, 4.0)
+        self.assertAlmostEqual(playback_load, 200 * self.BITS_COUNT / (100000 * 4.0))
+        self.assertAlmostEqual(self.metrics.get_playback_load()[0], playback_load)
+
+    def test_load_at_bus_clock(self):
+
+        control.i2c_bus_clock = 400000
+
+        self.write(100)
+
+        self.assertAlmostEqual(self.metrics.get_loads(1)[0][1], 100 * self.BITS_COUNT / 400000)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ioextender
+
+from globals import *
+from log     import *
+
+# Tested classes log as they go: keep it to errors
+log_init(ERROR)
+
+
+class FakeIoExtender:
+
+    # Output latches only, as followed by IoExtendersBatch, plus all writes done: no I2C bus needed
+    def __init__(self):
+
+        self.port_a_values  = 0
+        self.port_b_values  = 0
+        self.is_out_of_sync = False
+        self.writes         = []
+
+        return
+
+    def write_ports(self, port_a_values, port_b_values):
+
+        self.port_a_values = port_a_values
+        self.port_b_values = port_b_values
+
+        self.writes.append((time.monotonic(), port_a_values, port_b_values))
+
+        return
+
+    def resync(self):
+
+        return
+
+
+class TestIoExtendersWriter(unittest.TestCase):
+
+    # Time writer thread gets to write what was posted
+    TIMEOUT = 1.0
+
+    def setUp(self):
+
+        self.saved_control = dict(vars(control))
+
+        control.spin_time       = 0.0005
+        control.i2c_writer_miss = 0.001
+
+        self.extender = FakeIoExtender()
+        self.writer   = ioextender.IoExtendersWriter([self.extender])
+
+        return
+
+    def tearDown(self):
+
+        self.writer.stop()
+
+        vars(control).update(self.saved_control)
+
+        return
+
+    def wait_for_bursts(self, bursts_count):
+
+        timeout_time = time.monotonic() + self.TIMEOUT
+
+        while self.writer.get_stats()['bursts'] < bursts_count and time.monotonic() < timeout_time:
+            time.sleep(0.001)
+
+        return self.writer.get_stats()
+
+    def test_overdue_strike_is_written_then_released(self):
+
+        # Both strike & release are overdue once writer starts: strike must show up all the same
+        current_time = time.monotonic()
+
+        self.writer.post(current_time - 0.030, bytes([0x01, 0x00]))
+        self.writer.post(current_time - 0.010, bytes([0x00, 0x00]))
+        self.writer.start()
+
+        stats = self.wait_for_bursts(2)
+
+        self.assertEqual([(port_a_values, port_b_values) for write_time, port_a_values, port_b_values in self.extender.writes], [(0x01, 0x00), (0x00, 0x00)])
+        self.assertEqual(stats['merged'], 0)
+        self.assertEqual(stats['missed'], 2)
+
+    def test_entries_due_together_are_merged(self):
+
+        deadline = time.monotonic() + 0.020
+
+        self.writer.start()
+        self.writer.post(deadline, bytes([0x01, 0x00]))
+        self.writer.post(deadline, bytes([0x01, 0x80]))
+
+        stats = self.wait_for_bursts(1)
+
+        self.assertEqual(len(self.extender.writes), 1)
+        self.assertEqual(self.extender.writes[0][1:], (0x01, 0x80))
+        self.assertEqual(stats['merged'], 1)
+        self.assertEqual(stats['missed'], 0)
+
+    def test_release_due_together_is_not_merged(self):
+
+        # Release of a strike due on the very same deadline: strike gets written first, on its own
+        deadline = time.monotonic() + 0.020
+
+        self.writer.start()
+        self.writer.post(deadline, bytes([0x01, 0x00]))
+        self.writer.post(deadline, bytes([0x00, 0x00]))
+
+        self.wait_for_bursts(2)
+
+        self.assertEqual([(port_a_values, port_b_values) for write_time, port_a_values, port_b_values in self.extender.writes], [(0x01, 0x00), (0x00, 0x00)])
+
+    def test_entries_are_written_on_their_deadline(self):
+
+        deadline = time.monotonic() + 0.020
+
+        self.writer.start()
+        self.writer.post(deadline        , bytes([0x01, 0x00]))
+        self.writer.post(deadline + 0.020, bytes([0x00, 0x00]))
+
+        stats = self.wait_for_bursts(2)
+
+        self.assertGreaterEqual(self.extender.writes[0][0], deadline)
+        self.assertGreaterEqual(self.extender.writes[1][0], deadline + 0.020)
+        self.assertEqual(stats['bursts'], 2)
+
+    def test_callback_gets_deadline_and_write_time(self):
+
+        deadline = time.monotonic() + 0.010
+        results  = []
+
+        self.writer.start()
+        self.writer.post(deadline, bytes([0x01, 0x00]), lambda entry_deadline, write_time, skew: results.append((entry_deadline, write_time)))
+
+        self.wait_for_bursts(1)
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][0], deadline)
+        self.assertGreaterEqual(results[0][1], deadline)
+
+    def test_cleared_entries_are_not_written(self):
+
+        self.writer.start()
+        self.writer.post(time.monotonic() + 0.050, bytes([0x01, 0x00]))
+        self.writer.clear()
+
+        time.sleep(0.100)
+
+        self.assertEqual(self.extender.writes, [])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from midireader.midicache import MidiCache
+from log                  import *
+
+# Tested classes log as they go: keep it to errors
+log_init(ERROR)
+
+
+class TestMidiCache(unittest.TestCase):
+
+    FILE_DATA = {'name': 'test.mid', 'tempo': 120, 'events': [{'type': 0, 'value': [60]}]}
+
+    def setUp(self):
+
+        self.temp_dir  = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+        self.fullname  = os.path.join(self.temp_dir, 'test.mid')
+
+        with open(self.fullname, 'wb') as midi_file:
+            midi_file.write(b'MThd original content')
+
+        cache = MidiCache(self.cache_dir)
+
+        cache.store(self.fullname, cache.get_file_key(self.fullname), self.FILE_DATA)
+        cache.save ()
+
+        return
+
+    def tearDown(self):
+
+        shutil.rmtree(self.temp_dir)
+
+        return
+
+    def get_index_filename(self):
+
+        return os.path.join(self.cache_dir, MidiCache.INDEX_FILENAME)
+
+    def lookup(self):
+
+        cache = MidiCache(self.cache_dir)
+
+        return cache, cache.lookup(self.fullname, cache.get_file_key(self.fullname))
+
+    def test_hit(self):
+
+        cache, file_data = self.lookup()
+
+        self.assertEqual(file_data, {'name': 'test.mid', 'tempo': 120})
+        self.assertEqual(cache.load_events(self.fullname), self.FILE_DATA['events'])
+        self.assertEqual(cache.hits_count, 1)
+
+    def test_modified_file_is_parsed_again(self):
+
+        with open(self.fullname, 'wb') as midi_file:
+            midi_file.write(b'MThd modified content')
+
+        cache, file_data = self.lookup()
+
+        self.assertIsNone(file_data)
+
+    def test_corrupted_index_is_discarded(self):
+
+        # Flip payload's last byte: digest no longer matches
+        with open(self.get_index_filename(), 'r+b') as index_file:
+
+            index_file.seek(-1, os.SEEK_END)
+            last_byte = index_file.read(1)
+            index_file.seek(-1, os.SEEK_END)
+            index_file.write(bytes([last_byte[0] ^ 0xFF]))
+
+        cache, file_data = self.lookup()
+
+        self.assertEqual(len(cache.index), 0)
+        self.assertIsNone(file_data)
+
+    def test_other_version_is_discarded(self):
+
+        with open(self.get_index_filename(), 'r+b') as index_file:
+
+            index_file.seek(len(MidiCache.CACHE_MAGIC))
+            index_file.write(bytes([MidiCache.CACHE_VERSION + 1]))
+
+        cache, file_data = self.lookup()
+
+        self.assertEqual(len(cache.index), 0)
+        self.assertIsNone(file_data)
+
+    def test_missing_entry_file_is_forgotten(self):
+
+        cache = MidiCache(self.cache_dir)
+        key   = cache.get_file_key(self.fullname)
+
+        os.remove(os.path.join(self.cache_dir, key[2] + MidiCache.ENTRY_SUFFIX))
+
+        self.assertIsNone(cache.lookup(self.fullname, key))
+        self.assertNotIn(self.fullname, cache.index)
+        self.assertEqual(cache.is_dirty, True)
+
+    def test_invalidate(self):
+
+        cache = MidiCache(self.cache_dir)
+
+        cache.invalidate()
+
+        self.assertEqual(len(cache.index), 0)
+        self.assertEqual([filename for filename in os.listdir(self.cache_dir) if filename != MidiCache.INDEX_FILENAME], [])
+
+
+if __name__ == '__main__':
+
+    unittest.main()
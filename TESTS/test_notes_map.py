@@ -0,0 +1,89 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import xylophone
+
+from log import *
+
+# Tested classes log as they go: keep it to errors
+log_init(ERROR)
+
+
+class TestNotesMapFromSetup(unittest.TestCase):
+
+    SETUP_DATA = {
+        'I2C_BUS_NUMBER'         : 1,
+        'MCP_23017_I2C_ADDRESS_1': 32,
+        'MCP_23017_I2C_ADDRESS_2': 33,
+        'XYLOPHONE_LOWEST_NOTE'  : 60,
+        'XYLOPHONE_NOTES_COUNT'  : 20,
+    }
+
+    def from_notes_map(self, notes_map):
+
+        return xylophone.NotesMap.from_setup(dict(self.SETUP_DATA, XYLOPHONE_NOTES_MAP = notes_map))
+
+    def test_contiguous_fallback(self):
+
+        # 16 notes on first extender, then 4 on second one
+        notes_map = xylophone.NotesMap.from_setup(self.SETUP_DATA)
+
+        self.assertEqual(notes_map.extenders, [(1, 32), (1, 33)])
+        self.assertEqual(notes_map.lowest_note, 60)
+        self.assertEqual(notes_map.highest_note, 79)
+        self.assertEqual(notes_map.note_outputs, list(range(0, 20)))
+        self.assertEqual(notes_map.ports_count, 4)
+
+    def test_contiguous_fallback_stops_with_extenders(self):
+
+        notes_map = xylophone.NotesMap.from_setup(dict(self.SETUP_DATA, XYLOPHONE_NOTES_COUNT = 40))
+
+        self.assertEqual(notes_map.notes_count, 32)
+        self.assertEqual(notes_map.highest_note, 91)
+
+    def test_no_note_mapped(self):
+
+        with self.assertRaises(ValueError):
+            xylophone.NotesMap.from_setup(dict(self.SETUP_DATA, XYLOPHONE_NOTES_COUNT = 0))
+
+        with self.assertRaises(ValueError):
+            self.from_notes_map({})
+
+    def test_out_of_range_pin_is_skipped(self):
+
+        notes_map = self.from_notes_map({'60': [1, 32, 0], '61': [1, 32, 16], '62': [1, 32, -1]})
+
+        self.assertEqual(notes_map.notes_count, 1)
+        self.assertEqual(notes_map.highest_note, 60)
+
+    def test_out_of_range_pin_only(self):
+
+        with self.assertRaises(ValueError):
+            self.from_notes_map({'60': [1, 32, 16]})
+
+    def test_duplicate_pin_is_skipped(self):
+
+        # Lowest note keeps the pin
+        notes_map = self.from_notes_map({'62': [1, 32, 3], '60': [1, 32, 3], '61': [1, 32, 4]})
+
+        self.assertEqual(notes_map.notes_count, 2)
+        self.assertEqual(notes_map.note_outputs, [3, 4])
+
+    def test_extenders_ordered_by_lowest_note(self):
+
+        # Extender 33 drives lowest note: it gets outputs 0 to 15, whatever its address
+        notes_map = self.from_notes_map({'72': [1, 32, 0], '60': [1, 33, 5], '61': [0, 32, 0]})
+
+        self.assertEqual(notes_map.extenders, [(1, 33), (0, 32), (1, 32)])
+        self.assertEqual(notes_map.note_outputs[0], 5)
+        self.assertEqual(notes_map.note_outputs[1], 16)
+        self.assertEqual(notes_map.note_outputs[72 - 60], 32)
+        self.assertEqual(notes_map.ports_count, 6)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
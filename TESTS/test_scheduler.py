@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import scheduler
+
+from utils import *
+from log   import *
+
+# Tested classes log as they go: keep it to errors
+log_init(ERROR)
+
+
+class TestTempoChanges(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock          = VirtualClock()
+        self.previous_clock = set_clock(self.clock)
+        self.scheduler      = scheduler.Scheduler()
+
+        self.scheduler.start(1.0)
+
+        return
+
+    def tearDown(self):
+
+        set_clock(self.previous_clock)
+
+        return
+
+    def test_rebase_keeps_elapsed_part_of_pause(self):
+
+        # 2 s pause, tempo doubled 0.5 s in: remaining 1.5 s get played in 0.75 s
+        self.scheduler.advance(2.0)
+        self.clock.sleep(0.5)
+        self.scheduler.set_tempo_ratio(0.5)
+
+        self.assertAlmostEqual(self.scheduler.get_deadline(), 1.25)
+        self.assertEqual(self.scheduler.rebases_count, 1)
+
+    def test_later_pauses_get_rescaled(self):
+
+        self.scheduler.advance(1.0)
+        self.clock.sleep(1.0)
+        self.scheduler.set_tempo_ratio(2.0)
+        self.scheduler.advance(1.0)
+
+        self.assertAlmostEqual(self.scheduler.get_deadline(), 3.0)
+
+    def test_same_tempo_does_not_rebase(self):
+
+        self.scheduler.set_tempo_ratio(1.0)
+
+        self.assertEqual(self.scheduler.rebases_count, 0)
+
+    def test_position_time_follows_rebase(self):
+
+        self.clock.sleep(1.0)
+        self.scheduler.set_tempo_ratio(0.5)
+
+        self.assertAlmostEqual(self.scheduler.get_track_position(self.clock.monotonic()), 1.0)
+        self.assertAlmostEqual(self.scheduler.get_position_time(3.0), 2.0)
+
+    def test_sleep_until_position(self):
+
+        self.assertEqual(self.scheduler.sleep_until_position(2.0), False)
+        self.assertAlmostEqual(self.clock.monotonic(), 2.0)
+
+
+class TestSleepUntilPosition(unittest.TestCase):
+
+    # Real time, as tempo has to change while sleeping: margin covers wake up latency
+    MARGIN = 0.030
+
+    def test_tempo_change_applies_to_remaining_sleep(self):
+
+        test_scheduler = scheduler.Scheduler()
+        test_scheduler.start(1.0)
+
+        start_time = time.monotonic()
+        timer      = threading.Timer(0.100, test_scheduler.set_tempo_ratio, [0.5])
+
+        timer.start()
+
+        # 0.4 s sleep, tempo doubled 0.1 s in: remaining 0.3 s get slept in 0.15 s
+        self.assertEqual(test_scheduler.sleep_until_position(0.400), False)
+        self.assertAlmostEqual(time.monotonic() - start_time, 0.250, delta = self.MARGIN)
+
+        timer.join()
+
+    def test_interruption(self):
+
+        is_interrupted = threading.Event()
+        condition      = threading.Condition()
+        test_scheduler = scheduler.Scheduler(condition, is_interrupted.is_set)
+
+        test_scheduler.start(1.0)
+
+        def interrupt():
+
+            with condition:
+
+                is_interrupted.set()
+                condition.notify_all()
+
+        timer = threading.Timer(0.050, interrupt)
+
+        timer.start()
+
+        self.assertEqual(test_scheduler.sleep_until_position(1.0), True)
+
+        timer.join()
+
+
+if __name__ == '__main__':
+
+    unittest.main()
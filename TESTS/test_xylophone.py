@@ -0,0 +1,247 @@
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import xylophone
+
+from globals import *
+from utils   import *
+from log     import *
+
+# Tested classes log as they go: keep it to errors
+log_init(ERROR)
+
+
+class FakeIoExtender:
+
+    # Output latches only, as followed by IoExtendersBatch: no I2C bus needed
+    def __init__(self):
+
+        self.port_a_values  = 0
+        self.port_b_values  = 0
+        self.is_out_of_sync = False
+
+        return
+
+    def write_ports(self, port_a_values, port_b_values):
+
+        self.port_a_values = port_a_values
+        self.port_b_values = port_b_values
+
+        return
+
+
+class XylophoneTestCase(unittest.TestCase):
+
+    # 16 notes, from 60 to 75, on a single IO extender: 60 has its octave above wired, not below
+    LOWEST_NOTE = 60
+    NOTES_COUNT = 16
+
+    def setUp(self):
+
+        self.saved_control = dict(vars(control))
+
+        control.restrike_interval  = 0.100
+        control.restrike_intervals = {}
+        control.restrike_policy    = RESTRIKE_POLICY_DROP
+        control.stagger_window     = 0.0
+        control.stagger_coils      = 0
+
+        notes_map = xylophone.NotesMap({self.LOWEST_NOTE + pin: (1, 32, pin) for pin in range(0, self.NOTES_COUNT)})
+
+        self.xylophone         = xylophone.Xylophone(notes_map, 8, [FakeIoExtender()])
+        self.plan              = xylophone.StrikePlan(self.xylophone.ports_count)
+        self.last_strike_times = [float('-inf')] * len(self.xylophone.restrike_intervals)
+
+        return
+
+    def tearDown(self):
+
+        vars(control).update(self.saved_control)
+
+        return
+
+    def strike_at(self, note, strike_time):
+
+        self.last_strike_times[self.xylophone.__get_output__(note)] = strike_time
+
+        return
+
+
+class TestResolveRestrikes(XylophoneTestCase):
+
+    def test_ready_bar_is_struck_on_time(self):
+
+        self.strike_at(60, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([60], 0.100, 1.0, self.last_strike_times, self.plan)
+
+        self.assertEqual(resolved, [(60, 0.0)])
+        self.assertEqual(self.plan.restrike_drops_count + self.plan.restrike_delays_count + self.plan.restrike_octaves_count, 0)
+
+    def test_delay_within_tolerance_is_ignored(self):
+
+        self.strike_at(60, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([60], 0.100 - self.xylophone.RESTRIKE_TOLERANCE / 2, 1.0, self.last_strike_times, self.plan)
+
+        self.assertEqual(resolved, [(60, 0.0)])
+
+    def test_drop_policy(self):
+
+        self.strike_at(60, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([60, 64], 0.050, 1.0, self.last_strike_times, self.plan)
+
+        self.assertEqual(resolved, [(64, 0.0)])
+        self.assertEqual(self.plan.restrike_drops_count, 1)
+        self.assertEqual(self.last_strike_times[self.xylophone.__get_output__(60)], 0.0)
+
+    def test_delay_policy(self):
+
+        control.restrike_policy = RESTRIKE_POLICY_DELAY
+
+        self.strike_at(60, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([60], 0.050, 0.300, self.last_strike_times, self.plan)
+
+        self.assertEqual(len(resolved), 1)
+        self.assertEqual(resolved[0][0], 60)
+        self.assertAlmostEqual(resolved[0][1], 0.050)
+        self.assertEqual(self.plan.restrike_delays_count, 1)
+        self.assertAlmostEqual(self.last_strike_times[self.xylophone.__get_output__(60)], 0.100)
+
+    def test_delay_policy_never_passes_next_notes(self):
+
+        # Delay would reach next notes: octave above is struck on time instead
+        control.restrike_policy = RESTRIKE_POLICY_DELAY
+
+        self.strike_at(60, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([60], 0.050, 0.100, self.last_strike_times, self.plan)
+
+        self.assertEqual(resolved, [(72, 0.0)])
+        self.assertEqual(self.plan.restrike_delays_count, 0)
+        self.assertEqual(self.plan.restrike_octaves_count, 1)
+
+    def test_delay_policy_falls_back_to_drop(self):
+
+        # No octave of 70 is wired: too long a delay drops it
+        control.restrike_policy = RESTRIKE_POLICY_DELAY
+
+        self.strike_at(70, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([70], 0.050, 0.080, self.last_strike_times, self.plan)
+
+        self.assertEqual(resolved, [])
+        self.assertEqual(self.plan.restrike_drops_count, 1)
+
+    def test_delay_policy_keeps_room_for_staggering(self):
+
+        control.restrike_policy = RESTRIKE_POLICY_DELAY
+        control.stagger_window  = 0.010
+        control.stagger_coils   = 1
+
+        self.strike_at(70, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([70], 0.050, 0.105, self.last_strike_times, self.plan)
+
+        self.assertEqual(resolved, [])
+        self.assertEqual(self.plan.restrike_drops_count, 1)
+
+    def test_octave_policy(self):
+
+        control.restrike_policy = RESTRIKE_POLICY_OCTAVE
+
+        self.strike_at(60, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([60], 0.050, 1.0, self.last_strike_times, self.plan)
+
+        self.assertEqual(resolved, [(72, 0.0)])
+        self.assertEqual(self.plan.restrike_octaves_count, 1)
+        self.assertEqual(self.last_strike_times[self.xylophone.__get_output__(72)], 0.050)
+
+    def test_octave_policy_never_doubles_a_note(self):
+
+        control.restrike_policy = RESTRIKE_POLICY_OCTAVE
+
+        self.strike_at(60, 0.0)
+
+        resolved = self.xylophone.__resolve_restrikes__([60, 72], 0.050, 1.0, self.last_strike_times, self.plan)
+
+        self.assertEqual(resolved, [(72, 0.0)])
+        self.assertEqual(self.plan.restrike_drops_count, 1)
+
+
+class TestBudgetNotes(XylophoneTestCase):
+
+    def test_group_within_budget_is_kept(self):
+
+        control.stagger_window = 0.002
+        control.stagger_coils  = 2
+
+        self.assertEqual(self.xylophone.__budget_notes__([(0.0, [60, 64])]), [(0.0, [60, 64])])
+
+    def test_chord_is_spread_over_window(self):
+
+        control.stagger_window = 0.002
+        control.stagger_coils  = 2
+
+        budgeted_groups = self.xylophone.__budget_notes__([(0.0, [60, 64, 67, 70, 72])])
+
+        self.assertEqual([notes for offset, notes in budgeted_groups], [[60, 64], [67, 70], [72]])
+        self.assertEqual([offset for offset, notes in budgeted_groups], [0.0, 0.001, 0.002])
+
+    def test_delayed_group_is_spread_from_its_offset(self):
+
+        control.stagger_window = 0.002
+        control.stagger_coils  = 1
+
+        budgeted_groups = self.xylophone.__budget_notes__([(0.050, [60, 64]), (0.0, [67])])
+
+        self.assertEqual([notes for offset, notes in budgeted_groups], [[67], [60], [64]])
+
+        for (offset, notes), expected_offset in zip(budgeted_groups, [0.0, 0.050, 0.052]):
+            self.assertAlmostEqual(offset, expected_offset)
+
+    def test_no_note_is_dropped(self):
+
+        control.stagger_window = 0.002
+        control.stagger_coils  = 1
+
+        notes = [self.LOWEST_NOTE + pin for pin in range(0, self.NOTES_COUNT)]
+        plan  = xylophone.StrikePlan(self.xylophone.ports_count)
+
+        self.xylophone.__compile_notes__(notes, plan, 0.0, self.last_strike_times)
+
+        self.assertEqual(plan.notes_counts[0], self.NOTES_COUNT)
+        self.assertEqual(plan.groups_counts[0], self.NOTES_COUNT)
+        self.assertEqual(plan.staggered_count, 1)
+        self.assertEqual(plan.truncations_count, 0)
+
+
+class TestCompileEvents(XylophoneTestCase):
+
+    def test_delayed_trill_keeps_rhythm(self):
+
+        # Note 60 every 50 ms cannot be delayed by 50 ms without passing next notes: all strikes stay on time
+        control.restrike_policy = RESTRIKE_POLICY_DELAY
+
+        events = []
+
+        for repeat in range(0, 10):
+            events += [{'type': IS_NOTES, 'value': [60]}, {'type': IS_PAUSE, 'value': 0.050}]
+
+        plan = self.xylophone.compile_events(MidiEvents.from_list(events))
+
+        self.assertEqual(plan.restrike_delays_count, 0)
+        self.assertEqual(plan.restrike_octaves_count, 5)
+        self.assertEqual(sum(plan.groups_counts), 0)
+        self.assertEqual(plan.strikes_count, 10)
+
+
+if __name__ == '__main__':
+
+    unittest.main()
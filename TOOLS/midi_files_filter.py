@@ -396,11 +396,11 @@ def analyze_file(input_midi_data, input_filename, criteria, output_midi_data):
             is_file_too_short = True
 
         # Start browsing file events
-        for event in events:
+        for event_index in range(0, len(events)):
 
-            if event['type'] == IS_PAUSE:
+            if events.get_kind(event_index) == IS_PAUSE:
 
-                pause = event['value']
+                pause = events.get_pause(event_index)
 
                 summed_length += pause
 
@@ -414,7 +414,7 @@ def analyze_file(input_midi_data, input_filename, criteria, output_midi_data):
 
             else:
 
-                notes = event['value']
+                notes = events.get_notes(event_index)
 
                 if len(notes) > criteria['max_sim_notes']:
 
@@ -1,4 +1,9 @@
 import time
+import asyncio
+import threading
+import collections
+import scheduler
+import i2c
 
 from log     import *
 from globals import *
@@ -7,11 +12,25 @@ from utils   import *
 
 class Controller:
 
-    STATE_IDLE           = 0
-    STATE_PLAYING_TRACK  = 1
-    STATE_STOPPING_TRACK = 2
+    STATE_IDLE          = 0
+    STATE_PLAYING_TRACK = 1
 
-    WELCOME_SOUND = [
+    COMMAND_PLAY    = 0
+    COMMAND_STOP    = 1
+    COMMAND_WELCOME = 2
+    COMMAND_NOTES   = 3
+
+    # Only play & stop commands interrupt playing: welcome sound & console notes wait for the current track(s) to end
+    INTERRUPTING_COMMANDS = [COMMAND_PLAY, COMMAND_STOP]
+
+    # Playing code yields what it waits for, as steps, so that the very same code gets driven either by
+    # the file player thread, blocking on each step, or by the file player task, awaiting each step:
+    # wait until a deadline, sleep for a duration or call a blocking function (with its arguments).
+    STEP_WAIT_UNTIL = 0
+    STEP_SLEEP      = 1
+    STEP_CALL       = 2
+
+    WELCOME_SOUND = MidiEvents.from_list([
         {'type': IS_NOTES, 'value': [55]},
         {'type': IS_PAUSE, 'value': 0.3 },
         {'type': IS_NOTES, 'value': [62]},
@@ -21,7 +40,7 @@ class Controller:
         {'type': IS_NOTES, 'value': [74]},
         {'type': IS_PAUSE, 'value': 0.5},
         {'type': IS_NOTES, 'value': [67, 71, 74, 79, 83]},
-    ]
+    ])
 
     WELCOME_SOUND_TEMPO = 60
 
@@ -35,13 +54,21 @@ class Controller:
         self.xylophone        = xylophone
         self.midi_reader      = midi_reader
         self.display          = display
-        self.auto_mode_change = False
+        self.auto_mode_change = threading.Event()
+
+        # Commands to the file player thread, and lock & condition protecting them, as well as state & tempos
+        self.commands  = collections.deque()
+        self.condition = threading.Condition()
+        self.scheduler = scheduler.Scheduler(self.condition, self.__is_interrupted__)
+
+        # Event loop & events waking up file player & buttons reader tasks, when run by asyncio runtime
+        self.loop            = None
+        self.player_wake_up  = None
+        self.buttons_wake_up = None
 
         self.mode        = DEFAULT_MODE
         self.track_index = DEFAULT_TRACK
-        self.__set_track_tempo__(self.midi_reader.get_file_tempo(self.track_index))
-        self.__set_play_tempo__ (self.track_tempo)
-        self.__set_tempo_ratio__()
+        self.__set_tempos__(self.midi_reader.get_file_tempo(self.track_index))
 
         self.mode_button.set_state (self.mode       )
         self.track_button.set_state(self.track_index)
@@ -49,139 +76,526 @@ class Controller:
 
         self.tracks_count = midi_reader.get_files_count()
         self.state        = self.STATE_IDLE
+        self.welcome_plan = self.xylophone.compile_events(self.WELCOME_SOUND)
+
+        self.jitter        = scheduler.JitterRecorder(control.jitter_dump_dir)
+        self.player_engine = control.player_engine
+
+        # With a writer thread, strikes get posted that much ahead of their deadline, and jitter is only
+        # known once they are actually written
+        if self.xylophone.writer is not None:
+            self.write_lead = control.i2c_writer_lead
+        else:
+            self.write_lead = 0.0
+
+        # Writer thread busy waits for deadlines itself: player busy waiting as well would only compete for the CPU
+        self.scheduler.set_busy_waiting(self.xylophone.writer is None)
+
+        self.xylophone.strike_callback = self.jitter.record
+        self.writer_stats_start        = None
+
+        self.realtime_status = None
+
+        # Time last play or stop command was posted, to measure how long it takes to stop playing
+        self.interrupt_time   = 0.0
+        self.stop_latency     = None
+
+        # Time spent waiting for commands, and CPU time the whole process used meanwhile (see __set_idle__())
+        self.idle_start_times = None
+        self.idle_time        = 0.0
+        self.idle_cpu_time    = 0.0
+        self.stop_latency_max = 0.0
+
+        # Strikes affected by minimum re-strike interval, on last played track
+        self.restrikes_report     = None
+        self.restrike_drops_start = 0
+
+        # Strike plan of last played track, e.g. to report on a dry run
+        self.played_plan = None
+
+        # Next file to play, loaded & compiled on a background thread: (index, tempo ratio, events, plan)
+        self.prepared_file  = None
+        self.prepare_thread = None
+        self.prepare_index  = None
 
         return
 
-    def __set_track_tempo__(self, tempo):
+    def __set_tempos__(self, track_tempo, play_tempo = None):
+
+        # Track tempo, play tempo & their ratio always change together, as seen from the file player thread
+        if play_tempo is None:
+            play_tempo = track_tempo
+
+        with self.condition:
+
+            self.track_tempo = track_tempo
+            self.play_tempo  = play_tempo
+            self.tempo_ratio = self.track_tempo / self.play_tempo
 
-        self.track_tempo = tempo
+            # Rebase schedule right away, even in the middle of a pause, rather than on next notes event
+            self.scheduler.set_tempo_ratio(self.tempo_ratio)
+
+            self.condition.notify_all()
+
+        self.__wake_up_task__(self.player_wake_up)
 
         return
 
-    def __set_play_tempo__(self, tempo):
+    def __wake_up_task__(self, wake_up):
 
-        self.play_tempo = tempo
+        # Asyncio events are not thread safe: have them set by the event loop, whatever the calling thread
+        if self.loop is not None and wake_up is not None:
+            self.loop.call_soon_threadsafe(wake_up.set)
 
         return
 
-    def __set_tempo_ratio__(self):
+    def __post_command__(self, command, *arguments):
+
+        log(DEBUG, 'Posting command {} {}'.format(command, arguments))
+
+        with self.condition:
+
+            # A new play or stop request supersedes any pending one, and interrupts playing
+            if command in self.INTERRUPTING_COMMANDS:
 
-        self.tempo_ratio = self.track_tempo / self.play_tempo
+                self.commands       = collections.deque(pending for pending in self.commands if pending[0] not in self.INTERRUPTING_COMMANDS)
+                self.interrupt_time = time.monotonic()
+
+            self.commands.append((command, arguments))
+            self.condition.notify_all()
+
+        self.__wake_up_task__(self.player_wake_up)
 
         return
 
-    def __play_event__(self, event):
+    def __get_command__(self):
+
+        # Block until a command comes in: no polling, so that an idle player costs nothing
+        with self.condition:
+
+            while len(self.commands) == 0:
+                self.condition.wait()
+
+            return self.commands.popleft()
+
+    async def __get_command_async__(self):
+
+        while True:
+
+            with self.condition:
+
+                if len(self.commands) != 0:
+                    return self.commands.popleft()
+
+                self.player_wake_up.clear()
+
+            await self.player_wake_up.wait()
+
+    def __is_interrupted__(self):
 
-        if event['type'] == IS_PAUSE:
+        # Commands get posted from other threads: only look at them holding the lock
+        with self.condition:
 
-            pause_duration = event['value'] * self.tempo_ratio
+            for command, arguments in self.commands:
+                if command in self.INTERRUPTING_COMMANDS:
+                    return True
 
-            self.xylophone.pause(pause_duration)
+            return False
 
+    def __record_stop_latency__(self):
+
+        self.stop_latency     = time.monotonic() - self.interrupt_time
+        self.stop_latency_max = max(self.stop_latency_max, self.stop_latency)
+
+        log(INFO, 'Stopped playing in {:.3f} ms'.format(self.stop_latency * 1000))
+
+        return
+
+    def __set_idle__(self, is_idle):
+
+        # Follow how much CPU the whole process uses while file player waits for commands, that is when
+        # nothing plays: runtimes are told apart on that (see print_status()), as on strikes jitter
+        with self.condition:
+
+            current_times = (time.monotonic(), time.process_time())
+
+            if is_idle == True:
+
+                self.idle_start_times = current_times
+
+            elif self.idle_start_times is not None:
+
+                self.idle_time       += current_times[0] - self.idle_start_times[0]
+                self.idle_cpu_time   += current_times[1] - self.idle_start_times[1]
+                self.idle_start_times = None
+
+        return
+
+    def __get_idle_cpu_load__(self):
+
+        # Return idle CPU load, in percent, and idle time it was measured over, current idle period included
+        with self.condition:
+
+            idle_time     = self.idle_time
+            idle_cpu_time = self.idle_cpu_time
+
+            if self.idle_start_times is not None:
+
+                idle_time     += time.monotonic()    - self.idle_start_times[0]
+                idle_cpu_time += time.process_time() - self.idle_start_times[1]
+
+        if idle_time == 0:
+            return None, 0.0
+
+        return idle_cpu_time / idle_time * 100, idle_time
+
+    def __set_state__(self, state):
+
+        with self.condition:
+
+            self.state = state
+            self.condition.notify_all()
+
+        return
+
+    def __start_events__(self, name, plan, start_time = None):
+
+        # Player engine can be changed from console, but only applies from next track start. Relative
+        # engine blocks on each strike & pause, so that file player task only plays with deadline engine.
+        if self.loop is None:
+            self.player_engine = control.player_engine
         else:
+            self.player_engine = PLAYER_ENGINE_DEADLINE
 
-            self.xylophone.play_notes(event['value'])
+        # Track position is followed whatever the engine, to measure strikes timing
+        self.restrike_drops_start = self.xylophone.restrike_drops
+
+        self.scheduler.start(self.tempo_ratio, start_time)
+        self.jitter.start   (name, PLAYER_ENGINE_NAMES[self.player_engine], plan.strikes_count)
+
+        # Bus load gets measured per second of playback
+        i2c.get_metrics().start_playback()
+
+        if self.xylophone.writer is not None:
+            self.writer_stats_start = self.xylophone.writer.get_stats()
 
         return
 
-    def play_all_from_console(self):
+    def __get_write_deadline__(self, deadline):
+
+        # Writes only get a deadline when posted ahead to a writer thread; they are done right away otherwise
+        if self.xylophone.writer is None:
+            return None
+
+        return deadline
+
+    def __wait_for_deadline__(self, deadline = None):
+
+        # Release notes held by previous strikes right on time, while waiting for next strike deadline.
+        # With no deadline given, wait for the current notes event deadline, which a tempo change may
+        # move at any time: it's thus computed again on each wake up. With a writer thread, only wait
+        # until write lead time before, writer then waiting for the deadline itself. IO extenders which
+        # failed a write, e.g. a release, get their outputs pushed again meanwhile, until back in sync.
+        while self.__is_interrupted__() == False:
+
+            self.xylophone.resync()
 
-        # Force track change to 1st track
-        self.track_button.set_state(0)
+            target_time  = deadline if deadline is not None else self.scheduler.get_deadline()
+            release_time = self.xylophone.get_next_release_time()
+            resync_time  = get_clock().monotonic() + IO_EXTENDERS_RESYNC_PERIOD if self.xylophone.needs_resync() == True else None
 
-        # Force tempo change to play that file at its default pace
-        self.__set_track_tempo__(self.midi_reader.get_file_tempo(0))
-        self.__set_play_tempo__ (self.track_tempo)
-        self.__set_tempo_ratio__()
+            if (release_time is not None) and (release_time <= target_time):
 
-        # Force mode change
-        self.mode = MODE.PLAY_ALL_TRACKS
-        self.mode_button.set_state(self.mode)
+                if (resync_time is not None) and (resync_time < release_time - self.write_lead):
+                    yield self.STEP_WAIT_UNTIL, resync_time
+                elif (yield self.STEP_WAIT_UNTIL, release_time - self.write_lead) is not None:
+                    self.xylophone.release(release_time)
 
-        # Sleep a bit to make sure that buttons reader thread had time to update
-        time.sleep(BUTTONS_READER_THREAD_SLEEP_TIME * 2)
+            elif (resync_time is not None) and (resync_time < target_time - self.write_lead):
+                yield self.STEP_WAIT_UNTIL, resync_time
 
-        self.play_track()
+            elif (yield self.STEP_WAIT_UNTIL, target_time - self.write_lead) is not None:
+                return
+
+        # In case of interruption, held notes get released by the caller, all at once
+        return
+
+    def __sleep_and_resync__(self, duration):
+
+        # Return True if sleep was interrupted, False if full duration elapsed. Duration is at current tempo:
+        # sleep lasts until the matching track position, so that a tempo change meanwhile applies right away.
+        # Last notes release may have failed: do not wait for next notes to push it again, but retry on each
+        # resync period meanwhile.
+        wake_up_position = self.scheduler.get_track_position(get_clock().monotonic()) + duration / self.scheduler.tempo_ratio
+
+        self.xylophone.resync()
+
+        while self.xylophone.needs_resync() == True and self.scheduler.get_position_time(wake_up_position) - get_clock().monotonic() > IO_EXTENDERS_RESYNC_PERIOD:
+
+            if self.scheduler.sleep(IO_EXTENDERS_RESYNC_PERIOD) == True:
+                return True
+
+            self.xylophone.resync()
+
+        return self.scheduler.sleep_until_position(wake_up_position)
+
+    def __end_events__(self, is_stopped, is_continued = False):
+
+        # When next track continues the timeline, final pause elapses while waiting for its first notes,
+        # and last notes get released meanwhile: do not wait for them here
+        if self.player_engine == PLAYER_ENGINE_DEADLINE and (is_stopped == True or is_continued == False):
+
+            release_deadline = None
+
+            if is_stopped == False:
+
+                # Let the final pause elapse, as the relative engine does, then release last notes
+                yield from self.__wait_for_deadline__()
+
+                release_deadline  = self.scheduler.get_deadline()
+                last_release_time = self.xylophone.get_last_release_time()
+
+                if last_release_time is not None:
+
+                    yield from self.__wait_for_deadline__(last_release_time)
+
+                    release_deadline = max(release_deadline, last_release_time)
+
+            # Make sure no solenoid is left energised, also when interrupted while waiting for last releases;
+            # when interrupted, whatever was posted to writer thread but not written yet gets dropped
+            if self.__is_interrupted__() == True:
+                release_deadline = None
+
+            self.xylophone.release_all(self.__get_write_deadline__(release_deadline))
+
+        # Make sure no failed write, e.g. a release, is left for next track to push again
+        self.xylophone.resync()
+
+        self.jitter.stop()
+
+        i2c.get_metrics().stop_playback()
+
+        if self.writer_stats_start is not None:
+            self.__report_writer__()
+
+        return
+
+    def __press_groups__(self, events, plan, index):
+
+        # Press each group of a staggered or delayed chord on its own deadline, on the timeline: its offset
+        # from the notes event deadline. Groups were compiled to be struck before next notes event, but a
+        # tempo change may since have moved it closer: groups which would pass it get dropped, so that they
+        # never push next notes back. Return the time the first group actually got struck, minus its offset,
+        # that is when the chord as a whole got struck.
+        chord_time = None
+
+        if index + 1 < len(events) and events.kinds[index + 1] == IS_PAUSE:
+            next_deadline = self.scheduler.get_deadline() + events.pauses[index + 1] * self.tempo_ratio
+        else:
+            next_deadline = float('inf')
+
+        for group in range(0, plan.groups_counts[index]):
+
+            group_offset, masks_offset = plan.get_group(index, group)
+            group_deadline             = self.scheduler.get_deadline() + group_offset
+
+            if group_deadline >= next_deadline:
+
+                log(DEBUG, 'Dropping {} group(s) of staggered or delayed notes, passing next notes'.format(plan.groups_counts[index] - group))
+                break
+
+            if group_offset > 0:
+                yield from self.__wait_for_deadline__(group_deadline)
+
+            if self.__is_interrupted__() == True:
+                break
+
+            strike_time = self.xylophone.press(plan, index, group, self.__get_write_deadline__(group_deadline))
+
+            if chord_time is None:
+                chord_time = strike_time - group_offset
+
+        return chord_time
+
+    def __play_event__(self, events, plan, index):
+
+        if events.kinds[index] == IS_PAUSE:
+
+            self.scheduler.advance(events.pauses[index])
+
+            if self.player_engine == PLAYER_ENGINE_RELATIVE:
+
+                self.xylophone.pause(events.pauses[index] * self.tempo_ratio, self.__sleep_and_resync__)
+
+        else:
+
+            # Notes were compiled at track load: just write ready to use output latches values
+            if self.player_engine == PLAYER_ENGINE_DEADLINE:
+
+                # Strike on the notes absolute deadline, whatever time was spent since the previous strike,
+                # and without waiting for notes release, so that notes closer than note length keep rhythm
+                yield from self.__wait_for_deadline__()
+
+                # Do not strike anything more once interrupted, not even late
+                if self.__is_interrupted__() == True:
+                    return
+
+                if plan.groups_counts[index] == 0:
+                    strike_time = self.xylophone.press(plan, index, 0, self.__get_write_deadline__(self.scheduler.get_deadline()))
+                else:
+                    strike_time = yield from self.__press_groups__(events, plan, index)
+
+            else:
+
+                strike_time = self.xylophone.strike(plan, index, self.scheduler.get_deadline())
+
+            # Writer thread records jitter itself, once strikes actually got written
+            if strike_time is not None and self.xylophone.writer is None:
+
+                self.jitter.record(self.scheduler.get_deadline(), strike_time, self.xylophone.strike_skew)
+
+        return
+
+    def play_all_from_console(self):
+
+        self.__post_command__(self.COMMAND_PLAY, MODE.PLAY_ALL_TRACKS, 0)
+
+        return
 
     def play_welcome_sound(self):
 
+        self.__post_command__(self.COMMAND_WELCOME)
+
+        return
+
+    def __play_welcome_sound__(self):
+
         log(INFO, 'Playing welcome sound')
 
-        # Save tempo of the currently selected track
-        saved_tempo = self.track_tempo
+        # Save tempos of the currently selected track
+        saved_track_tempo = self.track_tempo
+        saved_play_tempo  = self.play_tempo
+
+        self.__set_tempos__(self.WELCOME_SOUND_TEMPO)
+
+        self.__start_events__('Welcome sound', self.welcome_plan)
 
-        self.__set_track_tempo__(self.WELCOME_SOUND_TEMPO)
-        self.__set_play_tempo__ (self.WELCOME_SOUND_TEMPO)
-        self.__set_tempo_ratio__()
+        for index in range(0, len(self.WELCOME_SOUND)):
 
-        for event in self.WELCOME_SOUND:
+            yield from self.__play_event__(self.WELCOME_SOUND, self.welcome_plan, index)
 
-            self.__play_event__(event)
+        yield from self.__end_events__(False)
 
-        # Restore saved tempo
-        self.__set_track_tempo__(saved_tempo)
-        self.__set_play_tempo__ (saved_tempo)
-        self.__set_tempo_ratio__()
+        # Restore saved tempos
+        self.__set_tempos__(saved_track_tempo, saved_play_tempo)
 
         return
 
     def play_note_from_console(self, note):
 
-        self.xylophone.play_note(note)
+        # Played by file player thread, as any other write, rather than concurrently with it
+        self.__post_command__(self.COMMAND_NOTES, self.xylophone.play_note, note)
 
         return
 
     def play_notes_from_console(self, notes):
 
-        self.xylophone.play_notes(notes)
+        self.__post_command__(self.COMMAND_NOTES, self.xylophone.play_notes, notes)
 
         return
 
     def play_track(self):
 
-        self.state = self.STATE_PLAYING_TRACK
+        # Play currently selected track(s), in currently selected mode; PLAY_ALL_TRACKS mode starts from 1st track
+        if self.mode == MODE.PLAY_ALL_TRACKS:
+            self.__post_command__(self.COMMAND_PLAY, self.mode, 0)
+        else:
+            self.__post_command__(self.COMMAND_PLAY, self.mode, self.track_index)
 
         return
 
     def play_track_from_console(self, index, use_file_tempo):
 
-        # Force track change to show up on display
-        self.track_button.set_state(index)
-
-        self.__set_track_tempo__(self.midi_reader.get_file_tempo(index))
         if use_file_tempo == True:
-            self.__set_play_tempo__(self.track_tempo)
+            self.__set_tempos__(self.midi_reader.get_file_tempo(index))
         else:
             # Do not change play tempo; use last specific value set on console
-            pass
-        self.__set_tempo_ratio__()
+            self.__set_tempos__(self.midi_reader.get_file_tempo(index), self.play_tempo)
 
-        # Force mode change to just play that file
-        self.mode = MODE.PLAY_ONE_TRACK
-        self.mode_button.set_state(self.mode)
-
-        # Sleep a bit to make sure that buttons reader thread had time to update
-        time.sleep(BUTTONS_READER_THREAD_SLEEP_TIME * 2)
+        # Force tempo change to show up on display
+        self.tempo_button.set_state(self.play_tempo)
 
-        self.play_track()
+        self.__post_command__(self.COMMAND_PLAY, MODE.PLAY_ONE_TRACK, index)
 
         return
 
     def stop_track(self):
 
-        self.state = self.STATE_STOPPING_TRACK
+        self.__post_command__(self.COMMAND_STOP)
 
         return
 
     def set_tempo_from_console(self, tempo):
 
+        self.__set_tempos__(self.track_tempo, tempo)
+
         # Force tempo change to show up on display
-        self.__set_play_tempo__    (tempo)
-        self.__set_tempo_ratio__   ()
         self.tempo_button.set_state(tempo)
 
-        # Sleep a bit to make sure that buttons reader thread had time to update
-        time.sleep(BUTTONS_READER_THREAD_SLEEP_TIME * 2)
+        return
+
+    def read_buttons(self):
+
+        # Deal with all 3 buttons position
+        self.mode        = self.mode_button.get_state ()
+        self.track_index = self.track_button.get_state()
+        preset_tempo     = self.tempo_button.get_state()
+
+        # Possibly update screen with possible new preset mode/track/tempo
+        self.display.preset_mode      (self.mode       )
+        self.display.preset_play_tempo(preset_tempo    )
+        self.display.set_track_tempo  (self.track_index)
+        self.display.set_track_length (self.track_index)
+        self.display.preset_track     (self.track_index)
+
+        # Deal with all 3 buttons click status
+
+        if self.mode_button.was_clicked() == True:
+
+            self.display.set_mode(self.mode)
+
+            # In case of STOP mode, we just stop current track; in case of the following
+            # modes: PLAY_ONE_TRACK, LOOP_ONE_TRACK, PLAY_ALL_TRACKS, we (re)start playing
+            if self.mode == MODE.STOP:
+                self.stop_track()
+            else:
+                self.play_track()
+
+        # File player thread may change mode on its own, e.g. when done with playing
+        if self.auto_mode_change.is_set() == True:
+
+            self.auto_mode_change.clear()
+
+            self.mode = self.mode_button.get_state()
+            self.display.set_mode(self.mode)
+
+        if self.track_button.was_clicked() == True:
+
+            # Force tempo change to play that file at its default pace
+            self.__set_tempos__         (self.midi_reader.get_file_tempo(self.track_index))
+            self.tempo_button.set_state (self.track_tempo)
+            self.display.set_play_tempo (self.track_tempo)
+
+            # Update the requested track on display
+            self.display.set_track(self.track_index)
+
+            # Now start (or restart) selected track reading, just playing that file
+            self.__post_command__(self.COMMAND_PLAY, MODE.PLAY_ONE_TRACK, self.track_index)
+
+        if self.tempo_button.was_clicked() == True:
+
+            self.__set_tempos__        (self.track_tempo, preset_tempo)
+            self.display.set_play_tempo(preset_tempo)
 
         return
 
@@ -191,167 +605,399 @@ class Controller:
 
         while True:
 
-            # Deal with all 3 buttons position
-            self.mode        = self.mode_button.get_state ()
-            self.track_index = self.track_button.get_state()
-            preset_tempo     = self.tempo_button.get_state()
+            self.read_buttons()
 
-            # Possibly update screen with possible new preset mode/track/tempo
-            self.display.preset_mode      (self.mode       )
-            self.display.preset_play_tempo(preset_tempo    )
-            self.display.set_track_tempo  (self.track_index)
-            self.display.set_track_length (self.track_index)
-            self.display.preset_track     (self.track_index)
+            # Now actually refresh display with all possible previous updates
+            self.display.refresh()
 
-            # Deal with all 3 buttons click status
+            time.sleep(BUTTONS_READER_THREAD_SLEEP_TIME)
 
-            if (self.mode_button.was_clicked() == True) or (self.auto_mode_change == True):
+    async def buttons_reader_task(self):
 
-                self.auto_mode_change = False
+        log(INFO, 'Starting Controller\'s buttons reader task')
 
-                self.display.set_mode(self.mode)
+        self.loop            = asyncio.get_running_loop()
+        self.buttons_wake_up = asyncio.Event()
 
-                # Possibly stop current track reading
-                if self.state == self.STATE_PLAYING_TRACK:
-                    self.stop_track()
+        # Rather than being polled, buttons get read on their edges, as told by encoders callbacks
+        for button in [self.mode_button, self.track_button, self.tempo_button]:
+            button.set_listener(lambda: self.__wake_up_task__(self.buttons_wake_up))
 
-                # In case of the following modes: PLAY_ONE_TRACK, LOOP_ONE_TRACK, PLAY_ALL_TRACKS
-                # In case of STOP mode, there is nothing more to do : we just stop current track
-                if self.mode != MODE.STOP:
+        while True:
 
-                    # If we get a request to play all tracks, let's get back to the 1st track
-                    if self.mode == MODE.PLAY_ALL_TRACKS:
-                        self.track_index = 0
+            self.buttons_wake_up.clear()
 
-                    # Now start (or restart) selected track(s) reading
-                    self.play_track()
+            self.read_buttons()
 
-            if self.track_button.was_clicked() == True:
+            # Sending a whole image to display takes a while: do not hold up the event loop meanwhile
+            if self.display.is_refresh_needed == True:
+                await self.loop.run_in_executor(None, self.display.refresh)
 
-                # Possibly stop current track reading
-                if self.state == self.STATE_PLAYING_TRACK:
-                    self.stop_track()
+            # File player may update buttons states on its own, without waking us up: check them once in a while
+            try:
+                await asyncio.wait_for(self.buttons_wake_up.wait(), BUTTONS_READER_TASK_SLEEP_TIME)
+            except asyncio.TimeoutError:
+                pass
 
-                # Force mode change to just play that file
-                self.mode = MODE.PLAY_ONE_TRACK
-                self.mode_button.set_state(self.mode)
-                self.display.set_mode     (self.mode)
+    def __set_mode__(self, mode):
 
-                # Force tempo change to play that file at its default pace
-                self.__set_track_tempo__    (self.midi_reader.get_file_tempo(self.track_index))
-                self.__set_play_tempo__     (self.track_tempo)
-                self.__set_tempo_ratio__    (                )
-                self.tempo_button.set_state (self.track_tempo)
-                self.display.set_play_tempo (self.track_tempo)
+        # Force mode change to show up on buttons & display
+        self.mode_button.set_state(mode)
+        self.auto_mode_change.set ()
 
-                # Update the requested track on display
-                self.display.set_track(self.track_index)
+        self.__wake_up_task__(self.buttons_wake_up)
 
-                # Now start (or restart) selected track reading
-                self.play_track()
+        return
 
-            if self.tempo_button.was_clicked() == True:
+    def __play_file__(self, index, start_time = None, next_index = None, next_tempo_ratio = None):
 
-                self.__set_play_tempo__    (preset_tempo)
-                self.__set_tempo_ratio__   (            )
-                self.display.set_play_tempo(preset_tempo)
+        # Return True if playing was interrupted by a new command, False if done with playing. With a
+        # start time, first notes get struck on that time; with a next track, it gets prepared while
+        # this one plays, and is expected to start on this track end time (see __play_tracks__()).
+        is_continued = next_index is not None
 
-            # Now actually refresh display with all possible previous updates
-            self.display.refresh()
+        track = yield self.STEP_CALL, (self.__load_file__, index)
 
-            time.sleep(BUTTONS_READER_THREAD_SLEEP_TIME)
+        if track is None:
 
-    def file_player_thread(self):
+            # Previous track may have left notes to release to this one
+            self.xylophone.release_all()
+            return False
+
+        events, plan = track
+
+        self.played_plan = plan
+
+        track_name, track_tempo, track_length = self.midi_reader.get_file_info(index)
+
+        self.__start_events__(track_name, plan, start_time)
+
+        # Get next track ready, while this one is playing, for a gapless handover
+        if is_continued == True:
+            self.__prepare_file__(next_index, next_tempo_ratio)
+
+        saved_time     = time.time()
+        elapsed_time   = 0
+        is_done        = False
+        is_interrupted = False
+
+        # File reading gets interrupted by any new command, e.g. pushing MODE button to STOP
+        while is_done == False:
+
+            is_interrupted = self.__is_interrupted__()
+
+            if is_interrupted == True:
+                break
+
+            is_done, event = self.midi_reader.get_playing_event()
+
+            if is_done == False:
+
+                yield from self.__play_event__(events, plan, event)
+
+                current_time = time.time()
+
+                if current_time - saved_time > 1.0:
+
+                    saved_time    = current_time
+                    elapsed_time += 1
+
+                    log(INFO, 'Read progress: {}'.format(turn_seconds_int_to_minutes_and_seconds_string(elapsed_time)))
+
+        yield from self.__end_events__(is_interrupted, is_continued)
+        yield self.STEP_CALL, (self.jitter.dump, )
+
+        self.__report_restrikes__(plan)
+
+        self.midi_reader.stop_playing_file()
+
+        return is_interrupted
+
+    def __load_file__(self, index):
+
+        # Return file events & strike plan, or None if file cannot be played; may take a while. Use file
+        # prepared on background thread, once ready, if that's the one, unless tempo changed meanwhile;
+        # any other preparation is dropped, and left to complete on its own.
+        with self.condition:
+
+            prepare_thread      = self.prepare_thread if self.prepare_index == index else None
+            self.prepare_thread = None
+            self.prepare_index  = None
+
+        if prepare_thread is not None:
+            prepare_thread.join()
+
+        with self.condition:
+
+            prepared_file      = self.prepared_file
+            self.prepared_file = None
+
+        if self.midi_reader.start_playing_file(index) == False:
+            return None
+
+        events = self.midi_reader.get_playing_events()
+
+        if prepared_file is not None and prepared_file[0] == index and prepared_file[1] == self.tempo_ratio and prepared_file[2] is events:
+            return events, prepared_file[3]
+
+        return events, self.xylophone.compile_events(events, self.tempo_ratio)
+
+    def __prepare_file__(self, index, tempo_ratio):
+
+        # Load & compile next file on a background thread, while current one plays, for a gapless handover
+        prepare_thread = threading.Thread(target = self.__prepare_file_thread__, name = 'file_preparer', args = [index, tempo_ratio], daemon = True)
+
+        with self.condition:
+
+            self.prepared_file  = None
+            self.prepare_thread = prepare_thread
+            self.prepare_index  = index
+
+        prepare_thread.start()
+
+        return
+
+    def __prepare_file_thread__(self, index, tempo_ratio):
+
+        log(DEBUG, 'Preparing file #{}'.format(index))
+
+        # Threads inherit real time guarantees of the thread starting them, which only the player needs
+        if control.realtime_mode == True:
+            reset_realtime_mode()
+
+        events = self.midi_reader.get_file_events(index)
+
+        if events is None:
+            return
+
+        prepared_file = (index, tempo_ratio, events, self.xylophone.compile_events(events, tempo_ratio))
+
+        # Preparation may have been dropped meanwhile, e.g. on a new command
+        with self.condition:
+            if self.prepare_thread is threading.current_thread():
+                self.prepared_file = prepared_file
+
+        return
+
+    def __report_restrikes__(self, plan):
+
+        # Restrikes report is kept for the last played track, whether it was affected or not
+        self.restrikes_report = {'dropped'      : plan.restrike_drops_count,
+                                 'delayed'      : plan.restrike_delays_count,
+                                 'octave'       : plan.restrike_octaves_count,
+                                 'dropped_live' : self.xylophone.restrike_drops - self.restrike_drops_start}
+
+        if sum(self.restrikes_report.values()) != 0:
+            log(INFO, 'Re-strikes: {dropped} dropped, {delayed} delayed, {octave} moved to octave at compile time; {dropped_live} dropped at play time'.format(**self.restrikes_report))
+
+        return
+
+    def __report_writer__(self):
+
+        # Report what writer thread missed over the last played track only
+        stats = self.xylophone.writer.get_stats()
+
+        missed_count = stats['missed'] - self.writer_stats_start['missed']
+
+        if missed_count != 0:
+            log(WARNING, 'IO extenders writer missed {} deadlines'.format(missed_count))
+
+        self.writer_stats_start = None
+
+        return
+
+    def __play_tracks__(self, mode, index):
+
+        self.__set_state__(self.STATE_PLAYING_TRACK)
+        self.__set_mode__ (mode                    )
+
+        # Playing all tracks starts with the first one at its default pace, as next ones, whoever asked for it
+        if mode == MODE.PLAY_ALL_TRACKS:
+
+            self.__set_tempos__(self.midi_reader.get_file_tempo(index))
+
+            # Force tempo change to show up
+            self.tempo_button.set_state(self.play_tempo)
+
+        start_time = None
 
         while True:
 
-            if self.state == self.STATE_IDLE:
+            # Force track change to show up
+            self.track_button.set_state(index)
 
-                time.sleep(FILE_PLAYER_THREAD_SLEEP_TIME)
+            # Next track is the same one when looping, the next one in the list when playing all (at its default
+            # pace, that is a tempo ratio of 1), none otherwise, e.g. at the end of the list
+            if mode == MODE.LOOP_ONE_TRACK:
+                next_index, next_tempo_ratio = index, self.tempo_ratio
+            elif (mode == MODE.PLAY_ALL_TRACKS) and (index + 1 < self.tracks_count):
+                next_index, next_tempo_ratio = index + 1, 1.0
+            else:
+                next_index, next_tempo_ratio = None, None
 
-            elif self.state == self.STATE_PLAYING_TRACK:
+            if (yield from self.__play_file__(index, start_time, next_index, next_tempo_ratio)) == True:
 
-                start_status = self.midi_reader.start_playing_file(self.track_index)
+                # Let the new command decide what comes next
+                self.__record_stop_latency__()
+                break
 
-                # If we could not start, we consider playing is done
-                is_done = not start_status
+            if next_index is None:
 
-                saved_time   = time.time()
-                elapsed_time = 0
+                # Case of the following modes: PLAY_ONE_TRACK & PLAY_ALL_TRACKS, at the end of the list
+                self.__set_mode__(MODE.STOP)
+                break
 
-                # File reading can be interrupted by pushing MODE button to STOP
-                while (is_done == False) and (self.state != self.STATE_STOPPING_TRACK):
+            if self.player_engine == PLAYER_ENGINE_DEADLINE:
 
-                    is_done, event = self.midi_reader.get_playing_event()
+                # Continue the timeline: next track first notes are due inter-tracks gap after this track end,
+                # whatever time it takes to get next track started, as long as it's prepared on time
+                start_time = self.scheduler.get_deadline() + control.inter_tracks_gap
 
-                    if is_done == False:
+                log(INFO, 'Next track in {:.3f} s'.format(control.inter_tracks_gap))
 
-                        self.__play_event__(event)
+            else:
 
-                        current_time = time.time()
+                log(INFO, 'Sleeping between tracks')
+                yield self.STEP_SLEEP, control.inter_tracks_gap
 
-                        if current_time - saved_time > 1.0:
+            if next_index != index:
 
-                            saved_time    = current_time
-                            elapsed_time += 1
+                # Get ready to start next track, at its default pace
+                index = next_index
 
-                            log(INFO, 'Read progress: {}'.format(turn_seconds_int_to_minutes_and_seconds_string(elapsed_time)))
+                self.__set_tempos__(self.midi_reader.get_file_tempo(index))
 
-                # Stop file reading only if we actually started reading one
-                if start_status == True:
+            if self.__is_interrupted__() == True:
 
-                    self.midi_reader.stop_playing_file()
+                self.__record_stop_latency__()
+                break
 
-                if self.mode == MODE.LOOP_ONE_TRACK:
+        self.__set_state__(self.STATE_IDLE)
 
-                    # Keep current track index and controller state unchanged
-                    # so that we will just restart and play the same file.
-                    log(INFO, 'Sleeping between tracks')
-                    time.sleep(INTER_TRACKS_SLEEP)
+        return
 
-                elif self.mode == MODE.PLAY_ALL_TRACKS:
+    def play_track_in_place(self, index):
 
-                    # Increment current track index and keep controller state unchanged so that
-                    # we will start and play next file; go to idel at the end of the list
-                    if self.track_index + 1  == self.tracks_count:
+        # Play track with file tempo on calling thread, rather than on file player thread,
+        # and only return once done; used to render a track offline, on a virtual clock.
+        self.__set_tempos__(self.midi_reader.get_file_tempo(index))
+        self.__run_steps__(self.__play_tracks__(MODE.PLAY_ONE_TRACK, index))
 
-                        self.state = self.STATE_IDLE
+        return
 
-                    else:
+    def __process_command__(self, command, arguments):
 
-                        # Get ready to start next track
-                        self.track_index += 1
+        log(DEBUG, 'Processing command {} {}'.format(command, arguments))
 
-                        # Force tempo change to play that file at its default pace
-                        self.__set_track_tempo__(self.midi_reader.get_file_tempo(self.track_index))
-                        self.__set_play_tempo__ (self.track_tempo)
-                        self.__set_tempo_ratio__()
+        if command == self.COMMAND_PLAY:
 
-                        # Force track change to show up
-                        self.track_button.set_state(self.track_index)
+            yield from self.__play_tracks__(*arguments)
 
-                        log(INFO, 'Sleeping between tracks')
-                        time.sleep(INTER_TRACKS_SLEEP)
+        elif command == self.COMMAND_STOP:
 
-                else:
+            # Nothing is playing anymore at that point: just show up that we are now stopped
+            self.__set_mode__(MODE.STOP)
+
+        elif command == self.COMMAND_WELCOME:
+
+            yield from self.__play_welcome_sound__()
 
-                    # Case of the following modes: STOP & PLAY_ONE_TRACK
-                    self.state = self.STATE_STOPPING_TRACK
+        elif command == self.COMMAND_NOTES:
 
-            elif self.state == self.STATE_STOPPING_TRACK:
+            # Xylophone function playing notes (blocking until they get released), then its argument
+            yield self.STEP_CALL, arguments
 
-                # Force mode change to show up that we are now stopped
-                self.mode = MODE.STOP
-                self.mode_button.set_state(self.mode)
-                self.auto_mode_change = True
+        else:
+
+            log(ERROR, 'Got an unsupported command: {}'.format(command))
+
+        return
+
+    def __run_steps__(self, steps):
 
-                self.state = self.STATE_IDLE
+        # Drive playing steps on the calling thread, blocking on each of them; return steps result
+        result = None
 
+        while True:
+
+            try:
+                step, value = steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+
+            if step == self.STEP_WAIT_UNTIL:
+                result = self.scheduler.wait_until(value)
+            elif step == self.STEP_SLEEP:
+                result = self.scheduler.sleep(value)
             else:
+                result = value[0](*value[1:])
 
-                log(ERROR, 'Got to an unsupported state: {}'.format(self.state))
+    async def __run_steps_async__(self, steps):
 
-                self.state = self.STATE_IDLE
+        # Drive playing steps on the event loop, awaiting each of them; blocking calls go to an executor
+        result = None
+
+        while True:
+
+            try:
+                step, value = steps.send(result)
+            except StopIteration as stop:
+                return stop.value
+
+            if step == self.STEP_WAIT_UNTIL:
+                result = await self.scheduler.wait_until_async(value, self.player_wake_up)
+            elif step == self.STEP_SLEEP:
+                result = await self.scheduler.sleep_async(value, self.player_wake_up)
+            else:
+                result = await self.loop.run_in_executor(None, *value)
+
+    def file_player_thread(self):
+
+        log(INFO, 'Starting Controller\'s file player thread')
+
+        # Only file player thread gets real time guarantees: other threads are not timing critical
+        if control.realtime_mode == True:
+            self.realtime_status = set_realtime_mode(control.realtime_priority, control.realtime_cpu, control.realtime_lock_memory)
+
+        while True:
+
+            self.__set_idle__(True)
+
+            command, arguments = self.__get_command__()
+
+            self.__set_idle__(False)
+
+            self.__run_steps__(self.__process_command__(command, arguments))
+
+    async def file_player_task(self):
+
+        log(INFO, 'Starting Controller\'s file player task')
+
+        self.loop           = asyncio.get_running_loop()
+        self.player_wake_up = asyncio.Event()
+
+        if control.player_engine == PLAYER_ENGINE_RELATIVE:
+            log(WARNING, 'Relative player engine not available to file player task; using deadline engine')
+
+        # File player task shares its thread with all other tasks, which thus get real time guarantees too
+        if control.realtime_mode == True:
+            self.realtime_status = set_realtime_mode(control.realtime_priority, control.realtime_cpu, control.realtime_lock_memory)
+
+        while True:
+
+            self.__set_idle__(True)
+
+            command, arguments = await self.__get_command_async__()
+
+            self.__set_idle__(False)
+
+            await self.__run_steps_async__(self.__process_command__(command, arguments))
+
+    def print_jitter(self):
+
+        self.jitter.print_summary()
+
+        return
 
     def print_status(self):
 
@@ -360,5 +1006,25 @@ class Controller:
         print('Track tempo : {}'.format(self.track_tempo ))
         print('Play  tempo : {}'.format(self.play_tempo  ))
         print('Tempo ratio : {}'.format(self.tempo_ratio ))
+        print('State       : {}'.format(self.state       ))
+
+        if self.stop_latency is not None:
+            print('Stop latency: {:.3f} ms (max: {:.3f} ms)'.format(self.stop_latency * 1000, self.stop_latency_max * 1000))
+
+        if self.restrikes_report is not None:
+            print('Re-strikes  : {dropped} dropped, {delayed} delayed, {octave} moved to octave, {dropped_live} dropped at play time'.format(**self.restrikes_report))
+
+        if self.realtime_status is not None:
+            print('Real time   : {} / {} / memory {}'.format(self.realtime_status['scheduler'], self.realtime_status['affinity'], self.realtime_status['memory']))
+
+        if self.player_engine == PLAYER_ENGINE_DEADLINE:
+            print('Player      : deadline engine, sleep overshoot {:.6f} s'.format(self.scheduler.sleep_overshoot))
+        else:
+            print('Player      : relative engine')
+
+        idle_cpu_load, idle_time = self.__get_idle_cpu_load__()
+
+        if idle_cpu_load is not None:
+            print('Idle CPU    : {:.2f} % over {:.1f} s ({} runtime)'.format(idle_cpu_load, idle_time, RUNTIME_NAMES[control.runtime]))
 
         return
\ No newline at end of file
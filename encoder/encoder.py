@@ -1,10 +1,24 @@
-import RPi.GPIO
-import gpiozero
-import pigpio
+import simulation
 
 from globals import *
 from log     import *
 
+# Only the library of the GPIO interface in use is needed
+try:
+    import RPi.GPIO
+except (ImportError, RuntimeError):
+    RPi = None
+
+try:
+    import gpiozero
+except ImportError:
+    gpiozero = None
+
+try:
+    import pigpio
+except ImportError:
+    pigpio = None
+
 """
 Decode a rotary encoder (button or motor), with an optional switch, e.g. a KY-40.
 
@@ -52,6 +66,8 @@ class Encoder:
                 RPi.GPIO.setup(encoder_pin_press, RPi.GPIO.IN, RPi.GPIO.PUD_UP)
 
             RPi.GPIO.add_event_detect(encoder_pin_1, RPi.GPIO.FALLING, callback = self.callback, bouncetime = self.BOUNCE_TIME)
+            if self.encoder_pin_press is not None:
+                RPi.GPIO.add_event_detect(encoder_pin_press, RPi.GPIO.BOTH, callback = self.press_callback, bouncetime = self.BOUNCE_TIME)
 
         elif self.gpio_interface == USE_RPI_ZERO:
 
@@ -61,29 +77,59 @@ class Encoder:
                 self.encoder_pin_press_device = gpiozero.DigitalInputDevice(encoder_pin_press, pull_up = True, bounce_time = self.BOUNCE_TIME / 1000)
 
             self.encoder_pin_1_device.when_deactivated = self.callback
+            if self.encoder_pin_press is not None:
+                self.encoder_pin_press_device.when_activated   = self.press_callback
+                self.encoder_pin_press_device.when_deactivated = self.press_callback
 
-        elif self.gpio_interface == USE_PI_GPIO:
+        elif self.gpio_interface == USE_PI_GPIO or self.gpio_interface == USE_SIMULATION:
 
             self.level_encoder_1 = 0
             self.level_encoder_2 = 0
             self.last_event_gpio = None
 
-            self.pigpio = pigpio.pi()
+            # Simulated GPIOs mimic pigpio
+            gpio_module = pigpio if self.gpio_interface == USE_PI_GPIO else simulation.pigpio
+
+            self.pigpio = gpio_module.pi()
 
-            self.pigpio.set_mode(encoder_pin_1, pigpio.INPUT)
-            self.pigpio.set_mode(encoder_pin_2, pigpio.INPUT)
+            self.pigpio.set_mode(encoder_pin_1, gpio_module.INPUT)
+            self.pigpio.set_mode(encoder_pin_2, gpio_module.INPUT)
             if self.encoder_pin_press is not None:
-                self.pigpio.set_mode(encoder_pin_press, pigpio.INPUT)
+                self.pigpio.set_mode(encoder_pin_press, gpio_module.INPUT)
 
-            self.pigpio.set_pull_up_down(encoder_pin_1, pigpio.PUD_UP)
-            self.pigpio.set_pull_up_down(encoder_pin_2, pigpio.PUD_UP)
+            self.pigpio.set_pull_up_down(encoder_pin_1, gpio_module.PUD_UP)
+            self.pigpio.set_pull_up_down(encoder_pin_2, gpio_module.PUD_UP)
             if self.encoder_pin_press is not None:
-                self.pigpio.set_pull_up_down(encoder_pin_press, pigpio.PUD_UP)
+                self.pigpio.set_pull_up_down(encoder_pin_press, gpio_module.PUD_UP)
 
-            self.pigpio.callback(encoder_pin_1, pigpio.EITHER_EDGE, self.callback2)
-            self.pigpio.callback(encoder_pin_2, pigpio.EITHER_EDGE, self.callback2)
+            self.pigpio.callback(encoder_pin_1, gpio_module.EITHER_EDGE, self.callback2)
+            self.pigpio.callback(encoder_pin_2, gpio_module.EITHER_EDGE, self.callback2)
+            if self.encoder_pin_press is not None:
+                self.pigpio.callback(encoder_pin_press, gpio_module.EITHER_EDGE, self.press_callback)
 
-        self.counter = 0
+        self.counter  = 0
+        self.listener = None
+
+        return
+
+    def set_listener(self, listener):
+
+        # Listener gets called on any encoder move or switch edge, from the GPIO library thread
+        self.listener = listener
+
+        return
+
+    def __notify_listener__(self):
+
+        if self.listener is not None:
+            self.listener()
+
+        return
+
+    def press_callback(self, *arguments):
+
+        # Switch state is read on demand (see is_pressed()): just let the listener know it changed
+        self.__notify_listener__()
 
         return
 
@@ -106,6 +152,8 @@ class Encoder:
 
         log(DEBUG, '{} encoder callback 1: pin_1_state - {} / pin_2_state - {} / counter - {}'.format(self.name, pin_1_state, pin_2_state, self.counter))
 
+        self.__notify_listener__()
+
         return
 
     def callback2(self, gpio, level, tick):
@@ -131,6 +179,8 @@ class Encoder:
 
         log(DEBUG, '{} encoder callback 1: level_encoder_1 - {} / level_encoder_2 - {} / counter - {}'.format(self.name, self.level_encoder_1, self.level_encoder_2, self.counter))
 
+        self.__notify_listener__()
+
         return
 
     def get_counter(self):
@@ -163,7 +213,7 @@ class Encoder:
 
                 pin_press_state = self.encoder_pin_press_device.value
 
-            elif self.gpio_interface == USE_PI_GPIO:
+            elif self.gpio_interface == USE_PI_GPIO or self.gpio_interface == USE_SIMULATION:
 
                 pin_press_state = not self.pigpio.read(self.encoder_pin_press)
 
@@ -2,11 +2,29 @@ from enum import Enum, unique
 
 # High level constants
 
-USE_RPI_GPIO = 0
-USE_RPI_ZERO = 1
-USE_PI_GPIO  = 2
+USE_RPI_GPIO   = 0
+USE_RPI_ZERO   = 1
+USE_PI_GPIO    = 2
+USE_SIMULATION = 3
 
 SETUP_FILE     = 'setup.json'
+RENDER_DIR     = 'render'
+
+PLAYER_ENGINE_RELATIVE = 0
+PLAYER_ENGINE_DEADLINE = 1
+PLAYER_ENGINE_NAMES    = ['relative', 'deadline']
+
+# Deadline engine keeps rhythm & follows tempo changes right away, as shipped in setup.json
+DEFAULT_PLAYER_ENGINE = PLAYER_ENGINE_DEADLINE
+
+RUNTIME_THREADS = 0
+RUNTIME_ASYNCIO = 1
+RUNTIME_NAMES   = ['threads', 'asyncio']
+
+RESTRIKE_POLICY_DROP   = 0
+RESTRIKE_POLICY_DELAY  = 1
+RESTRIKE_POLICY_OCTAVE = 2
+RESTRIKE_POLICY_NAMES  = ['drop', 'delay', 'octave']
 
 # Mode, track select & tempo select buttons definition
 
@@ -46,7 +64,10 @@ class MODE(Enum):
 # Other, general purpose and detailed constants
 
 BUTTONS_READER_THREAD_SLEEP_TIME = 0.005
-FILE_PLAYER_THREAD_SLEEP_TIME    = 0.100
+BUTTONS_READER_TASK_SLEEP_TIME   = 0.100
+ASYNCIO_EXECUTOR_WORKERS         = 4
+ASYNCIO_SWITCH_INTERVAL          = 0.0005
+IO_EXTENDERS_RESYNC_PERIOD       = 0.100
 
 LCD_SCREEN_WIDTH  = 240
 LCD_SCREEN_HEIGHT = 320
@@ -54,4 +75,17 @@ LCD_SCREEN_HEIGHT = 320
 DEFAULT_MODE        = MODE.STOP
 DEFAULT_TRACK       = 0
 DEFAULT_NOTE_LENGTH = 0.020
-INTER_TRACKS_SLEEP  = 5
\ No newline at end of file
+DEFAULT_SPIN_TIME   = 0.0005
+
+DEFAULT_INTER_TRACKS_GAP = 5.0
+
+DEFAULT_I2C_RETRY_BUDGET = 0.002
+DEFAULT_I2C_RETRY_DELAY  = 0.0002
+DEFAULT_I2C_WRITER_LEAD  = 0.005
+DEFAULT_I2C_WRITER_MISS  = 0.001
+DEFAULT_I2C_BUS_CLOCK    = 100000
+
+DEFAULT_SIMULATION_I2C_CLOCK    = 400000
+DEFAULT_SIMULATION_I2C_OVERHEAD = 0.000050
+DEFAULT_SIMULATION_SPI_OVERHEAD = 0.000020
+DEFAULT_SIMULATION_I2C_ERRORS   = 0.0
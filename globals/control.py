@@ -1,5 +1,32 @@
-from globals.const import MODE, USE_RPI_GPIO, USE_RPI_ZERO, USE_PI_GPIO, DEFAULT_NOTE_LENGTH
+from globals.const import MODE, USE_RPI_GPIO, USE_RPI_ZERO, USE_PI_GPIO, USE_SIMULATION, DEFAULT_NOTE_LENGTH, DEFAULT_PLAYER_ENGINE, DEFAULT_SPIN_TIME, RUNTIME_THREADS, DEFAULT_INTER_TRACKS_GAP
+from globals.const import DEFAULT_SIMULATION_I2C_CLOCK, DEFAULT_SIMULATION_I2C_OVERHEAD, DEFAULT_SIMULATION_SPI_OVERHEAD, RESTRIKE_POLICY_DROP
+from globals.const import DEFAULT_I2C_RETRY_BUDGET, DEFAULT_I2C_RETRY_DELAY, DEFAULT_I2C_WRITER_LEAD, DEFAULT_I2C_WRITER_MISS, DEFAULT_SIMULATION_I2C_ERRORS
+from globals.const import DEFAULT_I2C_BUS_CLOCK
 
-gpio_interface = USE_PI_GPIO
-main_mode      = MODE.STOP
-note_length    = DEFAULT_NOTE_LENGTH
+gpio_interface          = USE_PI_GPIO
+main_mode               = MODE.STOP
+note_length             = DEFAULT_NOTE_LENGTH
+player_engine           = DEFAULT_PLAYER_ENGINE
+runtime                 = RUNTIME_THREADS
+spin_time               = DEFAULT_SPIN_TIME
+inter_tracks_gap        = DEFAULT_INTER_TRACKS_GAP
+jitter_dump_dir         = None
+realtime_mode           = False
+realtime_priority       = 50
+realtime_cpu            = -1
+realtime_lock_memory    = False
+stagger_window          = 0.0
+stagger_coils           = 0
+restrike_interval       = 0.0
+restrike_intervals      = {}
+restrike_policy         = RESTRIKE_POLICY_DROP
+i2c_retry_budget        = DEFAULT_I2C_RETRY_BUDGET
+i2c_retry_delay         = DEFAULT_I2C_RETRY_DELAY
+i2c_writer              = False
+i2c_writer_lead         = DEFAULT_I2C_WRITER_LEAD
+i2c_writer_miss         = DEFAULT_I2C_WRITER_MISS
+i2c_bus_clock           = DEFAULT_I2C_BUS_CLOCK
+simulation_i2c_clock    = DEFAULT_SIMULATION_I2C_CLOCK
+simulation_i2c_overhead = DEFAULT_SIMULATION_I2C_OVERHEAD
+simulation_spi_overhead = DEFAULT_SIMULATION_SPI_OVERHEAD
+simulation_i2c_errors   = DEFAULT_SIMULATION_I2C_ERRORS
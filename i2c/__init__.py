@@ -1 +1,2 @@
-from .i2c import I2cDevice
\ No newline at end of file
+from .i2c import I2cDevice
+from .metrics import I2cMetrics, get_metrics, set_metrics
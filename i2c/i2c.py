@@ -1,25 +1,105 @@
-import smbus
+import simulation
 
-from log import *
+from globals  import *
+from log      import *
+from utils    import *
+from .metrics import get_metrics
+
+# Only needed with actual hardware
+try:
+    import smbus
+except ImportError:
+    smbus = None
 
 
 class I2cDevice:
 
-    def __init__(self, bus, address):
+    # Every transaction gets accounted, with the bytes it puts on the bus: address & register ones,
+    # then data ones (a read also repeats the address). Failed transactions get retried, but only as
+    # long as another attempt fits within retry time budget: then OSError is raised to the caller.
+
+    def __init__(self, bus, address, gpio_interface = None):
 
         log(INFO, 'Setting up I2C device #{}:{}'.format(bus, address))
 
-        self.bus     = smbus.SMBus(bus)
-        self.address = address
+        # Unless told otherwise, use the same hardware access as the rest of the application
+        if gpio_interface is None:
+            gpio_interface = control.gpio_interface
+
+        if gpio_interface == USE_SIMULATION:
+            self.bus = simulation.SMBus(bus)
+        else:
+            self.bus = smbus.SMBus(bus)
+
+        self.bus_number     = bus
+        self.address        = address
+        self.retry_end_time = None
+
+        return
+
+    def set_retry_end_time(self, end_time):
+
+        # Share a single retry budget among a sequence of transactions, up to given time; None gets back
+        # to a retry budget per transaction
+        self.retry_end_time = end_time
 
         return
 
+    def __transfer__(self, register, bytes_count, function, *arguments):
+
+        metrics    = get_metrics()
+        clock      = get_clock()
+        start_time = clock.monotonic()
+        end_time   = self.retry_end_time if self.retry_end_time is not None else start_time + control.i2c_retry_budget
+
+        while True:
+
+            attempt_time = clock.monotonic()
+
+            try:
+
+                result = function(self.address, register, *arguments)
+                break
+
+            except OSError as error:
+
+                metrics.record_error(self.bus_number, self.address)
+
+                # Assume next attempt takes as long as this one
+                failure_time = clock.monotonic()
+                retry_time   = failure_time + control.i2c_retry_delay
+
+                if retry_time + (failure_time - attempt_time) > end_time:
+
+                    metrics.record_failure(self.bus_number, self.address)
+                    log(WARNING, 'I2C transaction failed on device #{}:{}, register 0x{:02X}; {}'.format(self.bus_number, self.address, register, error))
+                    raise
+
+                log(DEBUG, 'Retrying I2C transaction on device #{}:{}, register 0x{:02X}; {}'.format(self.bus_number, self.address, register, error))
+
+                metrics.record_retry(self.bus_number, self.address)
+                clock.spin_until(retry_time)
+
+        # Latency is the one the caller sees, retries included
+        metrics.record(self.bus_number, self.address, register, bytes_count, start_time, clock.monotonic())
+
+        return result
+
     def read_byte(self, register):
 
-        return self.bus.read_byte_data(self.address, register)
+        return self.__transfer__(register, 4, self.bus.read_byte_data)
 
     def write_byte(self, register, value):
 
-        self.bus.write_byte_data(self.address, register, value)
+        self.__transfer__(register, 3, self.bus.write_byte_data, value)
+
+        return
+
+    def write_bytes(self, register, values):
+
+        # Single transaction, device auto incrementing register address after each byte
+        values = list(values)
+
+        self.__transfer__(register, 2 + len(values), self.bus.write_i2c_block_data, values)
 
         return
@@ -0,0 +1,280 @@
+import collections
+import threading
+
+from log     import *
+from utils   import *
+from globals import *
+
+
+class I2cMetrics:
+
+    # Accounting of every I2C transaction: count & bytes per device & register, latency distribution,
+    # errors, retries, failures (transactions given up) & resyncs per device, and bits each bus carried
+    # within each second & over playback, from which bus load (utilisation) is derived, at configured bus
+    # clock. Bytes include address & register ones, as on the bus.
+
+    # Latency histogram buckets upper bounds, in seconds; last bucket gets anything above
+    HISTOGRAM_BOUNDS = [0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.010]
+
+    # Every byte takes 8 bits plus acknowledge, and every transaction start & stop conditions
+    BITS_PER_BYTE        = 9
+    BITS_PER_TRANSACTION = 2
+
+    # Per second bus loads are kept for that many seconds
+    LOADS_CAPACITY = 3600
+
+    def __init__(self):
+
+        self.lock      = threading.Lock()
+        self.devices   = {}
+        self.registers = collections.Counter()
+        self.loads     = {}
+
+        # Time spent playing, bits each bus carried meanwhile, and start time of current playback, if any
+        self.playback_time       = 0.0
+        self.playback_bits       = collections.Counter()
+        self.playback_start_time = None
+
+        return
+
+    def __get_device__(self, bus, address):
+
+        device = self.devices.get((bus, address))
+
+        if device is None:
+
+            device = {'count'    : 0,
+                      'bytes'    : 0,
+                      'errors'   : 0,
+                      'retries'  : 0,
+                      'failures' : 0,
+                      'resyncs'  : 0,
+                      'latency'  : 0.0,
+                      'max'      : 0.0,
+                      'histogram': [0] * (len(self.HISTOGRAM_BOUNDS) + 1)}
+
+            self.devices[(bus, address)] = device
+
+        return device
+
+    def __add_bits__(self, bus, start_time, bits_count):
+
+        # Transaction bits are accounted to the second it started in: (second, bits count) entries
+        loads = self.loads.get(bus)
+
+        if loads is None:
+
+            loads           = collections.deque(maxlen = self.LOADS_CAPACITY)
+            self.loads[bus] = loads
+
+        second = int(start_time)
+
+        if len(loads) == 0 or loads[-1][0] != second:
+            loads.append([second, 0])
+
+        loads[-1][1] += bits_count
+
+        if self.playback_start_time is not None:
+            self.playback_bits[bus] += bits_count
+
+        return
+
+    def record(self, bus, address, register, bytes_count, start_time, end_time):
+
+        latency = end_time - start_time
+        bucket  = 0
+
+        while bucket < len(self.HISTOGRAM_BOUNDS) and latency > self.HISTOGRAM_BOUNDS[bucket]:
+            bucket += 1
+
+        with self.lock:
+
+            device = self.__get_device__(bus, address)
+
+            device['count'    ]         += 1
+            device['bytes'    ]         += bytes_count
+            device['latency'  ]         += latency
+            device['max'      ]          = max(device['max'], latency)
+            device['histogram'][bucket] += 1
+
+            self.registers[(bus, address, register)] += 1
+
+            self.__add_bits__(bus, start_time, bytes_count * self.BITS_PER_BYTE + self.BITS_PER_TRANSACTION)
+
+        return
+
+    def record_error(self, bus, address):
+
+        with self.lock:
+
+            self.__get_device__(bus, address)['errors'] += 1
+
+        return
+
+    def record_retry(self, bus, address):
+
+        with self.lock:
+
+            self.__get_device__(bus, address)['retries'] += 1
+
+        return
+
+    def record_failure(self, bus, address):
+
+        with self.lock:
+
+            self.__get_device__(bus, address)['failures'] += 1
+
+        return
+
+    def record_resync(self, bus, address):
+
+        with self.lock:
+
+            self.__get_device__(bus, address)['resyncs'] += 1
+
+        return
+
+    def start_playback(self):
+
+        with self.lock:
+
+            self.playback_start_time = get_clock().monotonic()
+
+        return
+
+    def stop_playback(self):
+
+        with self.lock:
+
+            if self.playback_start_time is not None:
+
+                self.playback_time      += get_clock().monotonic() - self.playback_start_time
+                self.playback_start_time = None
+
+        return
+
+    def get_loads(self, bus):
+
+        # Return (second, bus load) list, load being the share of that second's bus clock cycles used
+        with self.lock:
+
+            return [(second, min(bits_count / control.i2c_bus_clock, 1.0)) for second, bits_count in self.loads.get(bus, [])]
+
+    def get_peak_load(self):
+
+        with self.lock:
+
+            return min(max([bits_count for loads in self.loads.values() for second, bits_count in loads], default = 0) / control.i2c_bus_clock, 1.0)
+
+    def get_playback_load(self, bus = None):
+
+        # Return mean bus load over playback time, current playback included, and that time; with no bus
+        # given, load of the busiest one
+        with self.lock:
+
+            playback_time = self.playback_time
+
+            if self.playback_start_time is not None:
+                playback_time += get_clock().monotonic() - self.playback_start_time
+
+            if bus is None:
+                bits_count = max(self.playback_bits.values(), default = 0)
+            else:
+                bits_count = self.playback_bits[bus]
+
+            if playback_time == 0:
+                return 0.0, 0.0
+
+            return bits_count / (control.i2c_bus_clock * playback_time), playback_time
+
+    def clear(self):
+
+        with self.lock:
+
+            self.devices.clear()
+            self.registers.clear()
+            self.loads.clear()
+            self.playback_bits.clear()
+
+            self.playback_time = 0.0
+
+            if self.playback_start_time is not None:
+                self.playback_start_time = get_clock().monotonic()
+
+        return
+
+    def print_status(self, seconds_count = 10):
+
+        with self.lock:
+
+            devices   = {key: dict(device) for key, device in self.devices.items()}
+            registers = dict(self.registers)
+            buses     = sorted(self.loads.keys())
+
+        if len(devices) == 0:
+
+            print('No I2C transaction recorded')
+            return
+
+        for (bus, address), device in sorted(devices.items()):
+
+            print('I2C device @{}/0x{:02X}: {} transactions, {} bytes'.format(bus, address, device['count'], device['bytes']))
+            print('  Errors : {} errors, {} retries, {} failures, {} resyncs'.format(device['errors'], device['retries'], device['failures'], device['resyncs']))
+
+            if device['count'] != 0:
+                print('  Latency: mean {:.3f} ms / max {:.3f} ms'.format(device['latency'] / device['count'] * 1000, device['max'] * 1000))
+
+            lower_bound = '0'
+
+            for bucket, count in enumerate(device['histogram']):
+
+                if bucket < len(self.HISTOGRAM_BOUNDS):
+                    upper_bound = '{:g}'.format(self.HISTOGRAM_BOUNDS[bucket] * 1000)
+                else:
+                    upper_bound = '+inf'
+
+                if count != 0:
+                    print('  {:>6} .. {:>6} ms : {:6d}'.format(lower_bound, upper_bound, count))
+
+                lower_bound = upper_bound
+
+            for (register_bus, register_address, register), count in sorted(registers.items()):
+
+                if (register_bus, register_address) == (bus, address):
+                    print('  Register 0x{:02X}: {} transactions'.format(register, count))
+
+        for bus in buses:
+
+            loads = self.get_loads(bus)
+
+            if len(loads) == 0:
+                continue
+
+            peak_second, peak_load       = max(loads, key = lambda entry: entry[1])
+            peak_age                     = int(get_clock().monotonic()) - peak_second
+            playback_load, playback_time = self.get_playback_load(bus)
+
+            print('I2C bus #{} load at {} kHz: {:.1f} % over {:.1f} s of playback, peak {:.1f} % ({} s ago)'.format(bus, control.i2c_bus_clock // 1000, playback_load * 100, playback_time, peak_load * 100, peak_age))
+            print('  Last seconds: {}'.format(' '.join('{:.1f}%'.format(load * 100) for second, load in loads[-seconds_count:])))
+
+        return
+
+
+# Single metrics recorder, shared by all I2C devices, unless a thread records to its own one
+metrics       = I2cMetrics()
+metrics_local = threading.local()
+
+
+def get_metrics():
+
+    return getattr(metrics_local, 'metrics', metrics)
+
+
+def set_metrics(thread_metrics):
+
+    # Return previous metrics recorder, to be restored when done
+    previous_metrics      = get_metrics()
+    metrics_local.metrics = thread_metrics
+
+    return previous_metrics
@@ -1 +1,3 @@
 from .ioextender import IoExtender
+from .batch      import IoExtendersBatch
+from .writer     import IoExtendersWriter
\ No newline at end of file
@@ -0,0 +1,164 @@
+from log   import *
+from utils import *
+
+
+class IoExtendersBatch:
+
+    # Commit style access to several IO extenders: output latches values get staged for all of them,
+    # then written in a single burst, in extenders order, all values being computed beforehand and
+    # unchanged extenders skipped. Time between first & last extender write (inter chip skew) is kept.
+    # With a writer (see IoExtendersWriter), commits rather get posted to it, for a given deadline.
+
+    def __init__(self, io_extenders):
+
+        self.io_extenders = io_extenders
+        self.ports_count  = len(io_extenders) * 2
+        self.pending      = bytearray(self.ports_count)
+        self.is_pending   = False
+        self.skew         = 0.0
+        self.writer       = None
+        self.posted       = None
+        self.is_forced    = False
+
+        return
+
+    def __get_outputs__(self):
+
+        outputs = bytearray(self.ports_count)
+
+        for extender_index, extender in enumerate(self.io_extenders):
+
+            outputs[extender_index * 2    ] = extender.port_a_values
+            outputs[extender_index * 2 + 1] = extender.port_b_values
+
+        return outputs
+
+    def set_writer(self, writer):
+
+        # From now on, only writer thread actually writes extenders: outputs are followed as posted
+        self.writer = writer
+        self.posted = self.__get_outputs__()
+
+        return
+
+    def __begin__(self):
+
+        # Start from current outputs, whoever last wrote them, or from last posted ones
+        if self.is_pending == False:
+
+            if self.writer is None:
+                self.pending[:] = self.__get_outputs__()
+            else:
+                self.pending[:] = self.posted
+
+            self.is_pending = True
+
+        return
+
+    def set_ports(self, masks, offset = 0):
+
+        self.pending[:] = masks[offset:offset + self.ports_count]
+        self.is_pending = True
+
+        return
+
+    def set_bits(self, masks, offset = 0):
+
+        self.__begin__()
+
+        for port_index in range(0, self.ports_count):
+            self.pending[port_index] |= masks[offset + port_index]
+
+        return
+
+    def clear_bits(self, masks, offset = 0):
+
+        self.__begin__()
+
+        for port_index in range(0, self.ports_count):
+            self.pending[port_index] &= ~masks[offset + port_index]
+
+        return
+
+    def discard(self):
+
+        # Drop whatever was posted to writer but not written yet, e.g. when interrupted. Writer thread may
+        # be writing older outputs meanwhile, which current ones do not tell yet: next commit gets posted,
+        # whatever it changes, so that it's written last.
+        if self.writer is not None:
+
+            self.writer.clear()
+            self.posted    = self.__get_outputs__()
+            self.is_forced = True
+
+        self.is_pending = False
+
+        return
+
+    def needs_resync(self):
+
+        # With a writer, only writer thread writes extenders, and pushes outputs again itself
+        if self.writer is not None:
+            return False
+
+        return any(extender.is_out_of_sync for extender in self.io_extenders)
+
+    def resync(self):
+
+        # Push current outputs again to extenders out of sync, e.g. after a failed release
+        for extender in self.io_extenders:
+            extender.resync()
+
+        return
+
+    def commit(self, deadline = None, callback = None):
+
+        # Return the time last write returned, that is when all outputs actually changed; with a writer,
+        # post outputs for deadline (or right away) instead, and return that deadline
+        if self.writer is not None:
+
+            if deadline is None:
+                deadline = get_clock().monotonic()
+
+            # No use posting outputs that do not change
+            if self.pending != self.posted or callback is not None or self.is_forced == True:
+                self.writer.post(deadline, self.pending, callback)
+
+            self.posted[:]  = self.pending
+            self.is_pending = False
+            self.is_forced  = False
+
+            return deadline
+
+        clock   = get_clock()
+        pending = self.pending
+        writes  = []
+
+        for extender_index, extender in enumerate(self.io_extenders):
+
+            port_a_values = pending[extender_index * 2    ]
+            port_b_values = pending[extender_index * 2 + 1]
+
+            # Extenders out of sync get written anyway, to push their outputs again
+            if port_a_values != extender.port_a_values or port_b_values != extender.port_b_values or extender.is_out_of_sync == True:
+                writes.append((extender, port_a_values, port_b_values))
+
+        first_write_time = None
+
+        for extender, port_a_values, port_b_values in writes:
+
+            extender.write_ports(port_a_values, port_b_values)
+
+            if first_write_time is None:
+                first_write_time = clock.monotonic()
+
+        commit_time = clock.monotonic()
+
+        if len(writes) > 1:
+            self.skew = commit_time - first_write_time
+        else:
+            self.skew = 0.0
+
+        self.is_pending = False
+
+        return commit_time
@@ -1,6 +1,7 @@
 import i2c
 
 from globals import *
+from utils   import *
 from log     import *
 
 
@@ -16,32 +17,32 @@ class IoExtender:
     MCP_23017_GPIOB  = 0x13
     MCP_23017_GPPUA  = 0x0C
     MCP_23017_GPPUB  = 0x0D
+    MCP_23017_IOCON  = 0x0A
     MCP_23017_OLATA  = 0x14
     MCP_23017_OLATB  = 0x15
 
+    # IOCON bits: BANK set splits ports registers apart, SEQOP set disables address auto increment
+    MCP_23017_IOCON_BANK  = 0x80
+    MCP_23017_IOCON_SEQOP = 0x20
+
     IOS_COUNT = 16
 
-    def __init__(self, bus, address):
+    def __init__(self, bus, address, gpio_interface = None):
 
-        self.bus           = bus
-        self.address       = address
-        self.is_quiet_mode = False
+        self.bus            = bus
+        self.address        = address
+        self.is_quiet_mode  = False
+        self.is_out_of_sync = False
 
-        self.i2c_device = i2c.I2cDevice(bus, address)
+        self.i2c_device = i2c.I2cDevice(bus, address, gpio_interface)
 
         log(INFO, 'Setup IO extender @{}:{}'.format(bus, address))
 
-        # Configure all IOs as output, regular polarity
-        self.i2c_device.write_byte(IoExtender.MCP_23017_IODIRA, 0x00)
-        self.i2c_device.write_byte(IoExtender.MCP_23017_IODIRB, 0x00)
-        self.i2c_device.write_byte(IoExtender.MCP_23017_IPOLA , 0x00)
-        self.i2c_device.write_byte(IoExtender.MCP_23017_IPOLB , 0x00)
+        self.__configure__()
 
         # Clear all outputs
-        self.i2c_device.write_byte(IoExtender.MCP_23017_GPIOA, 0x00)
-        self.i2c_device.write_byte(IoExtender.MCP_23017_GPIOB, 0x00)
-        self.i2c_device.write_byte(IoExtender.MCP_23017_OLATA, 0x00)
-        self.i2c_device.write_byte(IoExtender.MCP_23017_OLATB, 0x00)
+        self.i2c_device.write_bytes(IoExtender.MCP_23017_GPIOA, [0x00, 0x00])
+        self.i2c_device.write_bytes(IoExtender.MCP_23017_OLATA, [0x00, 0x00])
 
         # Store local status of all outputs, to avoid reading registers prior to their update
         self.port_a_values = 0x00
@@ -59,6 +60,77 @@ class IoExtender:
         else:
             return bitmap | (1 << bit)
 
+    def __configure__(self):
+
+        # Keep ports A & B registers side by side (BANK = 0, power on default) & sequential mode on
+        # (SEQOP = 0), so that both output latches get written in a single transaction
+        self.i2c_device.write_byte(IoExtender.MCP_23017_IOCON, 0x00)
+
+        # Configure all IOs as output, regular polarity
+        self.i2c_device.write_byte(IoExtender.MCP_23017_IODIRA, 0x00)
+        self.i2c_device.write_byte(IoExtender.MCP_23017_IODIRB, 0x00)
+        self.i2c_device.write_byte(IoExtender.MCP_23017_IPOLA , 0x00)
+        self.i2c_device.write_byte(IoExtender.MCP_23017_IPOLB , 0x00)
+
+        return
+
+    def __resync__(self, port_a_values, port_b_values):
+
+        # Extender may have gone through a reset, losing its configuration as well: push it all again,
+        # then both output latches, so that no solenoid is left energised; all within one retry budget
+        self.i2c_device.set_retry_end_time(get_clock().monotonic() + control.i2c_retry_budget)
+
+        try:
+
+            self.__configure__()
+            self.i2c_device.write_bytes(IoExtender.MCP_23017_OLATA, [port_a_values, port_b_values])
+
+        finally:
+
+            self.i2c_device.set_retry_end_time(None)
+
+        self.is_out_of_sync = False
+
+        i2c.get_metrics().record_resync(self.bus, self.address)
+
+        log(INFO, 'IO extender @{}/{} back in sync'.format(self.bus, self.address))
+
+        return
+
+    def __write_latches__(self, port_a_values, port_b_values):
+
+        # Only write output latches whose value actually changes; when both do, write them at once,
+        # so that ports A & B outputs change together, in half as many transactions
+        is_port_a_changed = port_a_values != self.port_a_values
+        is_port_b_changed = port_b_values != self.port_b_values
+
+        if not self.is_quiet_mode:
+
+            # Should I2C layer give up, outputs are left as they are, until next write or resync() pushes them
+            # all again
+            try:
+
+                if self.is_out_of_sync == True:
+                    self.__resync__(port_a_values, port_b_values)
+                elif is_port_a_changed and is_port_b_changed:
+                    self.i2c_device.write_bytes(IoExtender.MCP_23017_OLATA, [port_a_values, port_b_values])
+                elif is_port_a_changed:
+                    self.i2c_device.write_byte(IoExtender.MCP_23017_OLATA, port_a_values)
+                elif is_port_b_changed:
+                    self.i2c_device.write_byte(IoExtender.MCP_23017_OLATB, port_b_values)
+
+            except OSError as error:
+
+                if self.is_out_of_sync == False:
+                    log(ERROR, 'IO extender @{}/{} out of sync; {}'.format(self.bus, self.address, error))
+
+                self.is_out_of_sync = True
+
+        self.port_a_values = port_a_values
+        self.port_b_values = port_b_values
+
+        return
+
     def leave_quiet_mode(self):
 
         log(INFO, 'IO extender @{}:{} leaving quiet mode'.format(self.bus, self.address))
@@ -85,18 +157,9 @@ class IoExtender:
             return
 
         if pin < 8:
-
-            new_values = self.__change_bit__(self.port_a_values, pin, value)
-            if not self.is_quiet_mode:
-                self.i2c_device.write_byte(IoExtender.MCP_23017_OLATA, new_values)
-            self.port_a_values = new_values
-
+            self.__write_latches__(self.__change_bit__(self.port_a_values, pin, value), self.port_b_values)
         else:
-
-            new_values = self.__change_bit__(self.port_b_values, pin - 8, value)
-            if not self.is_quiet_mode:
-                self.i2c_device.write_byte(IoExtender.MCP_23017_OLATB, new_values)
-            self.port_b_values = new_values
+            self.__write_latches__(self.port_a_values, self.__change_bit__(self.port_b_values, pin - 8, value))
 
         return
 
@@ -124,17 +187,23 @@ class IoExtender:
 
                 port_b_values = self.__change_bit__(port_b_values, pin_value['pin'] - 8, pin_value['value'])
 
-        if port_a_values != self.port_a_values:
+        self.__write_latches__(port_a_values, port_b_values)
+
+        return
+
+    def write_ports(self, port_a_values, port_b_values):
+
+        # Fast path for precompiled values: no pin check, no bitmap computation,
+        # just write the output latches whose value actually changes.
+        self.__write_latches__(port_a_values, port_b_values)
 
-            if not self.is_quiet_mode:
-                self.i2c_device.write_byte(IoExtender.MCP_23017_OLATA, port_a_values)
-            self.port_a_values = port_a_values
+        return
 
-        if port_b_values != self.port_b_values:
+    def resync(self):
 
-            if not self.is_quiet_mode:
-                self.i2c_device.write_byte(IoExtender.MCP_23017_OLATB, port_b_values)
-            self.port_b_values = port_b_values
+        # Push outputs again after a failed write, e.g. a release, rather than waiting for next write
+        if self.is_out_of_sync == True:
+            self.__write_latches__(self.port_a_values, self.port_b_values)
 
         return
 
@@ -143,7 +212,12 @@ class IoExtender:
         log(INFO, 'Shutting down IO extender @{}/{}'.format(self.bus, self.address))
 
         # Turn off all output
-        self.i2c_device.write_byte(IoExtender.MCP_23017_OLATA, 0x00)
-        self.i2c_device.write_byte(IoExtender.MCP_23017_OLATB, 0x00)
+        try:
+
+            self.i2c_device.write_bytes(IoExtender.MCP_23017_OLATA, [0x00, 0x00])
+
+        except OSError as error:
+
+            log(ERROR, 'Cannot turn off IO extender @{}/{} outputs; {}'.format(self.bus, self.address, error))
 
         return
@@ -0,0 +1,236 @@
+import collections
+import threading
+
+from log     import *
+from utils   import *
+from globals import *
+from .batch  import IoExtendersBatch
+
+
+class IoExtendersWriter:
+
+    # Dedicated thread owning the I2C bus: output latches values of all IO extenders get posted along
+    # with the deadline they are due on, and this thread writes them right on time, so that the player
+    # computes next events while previous ones get written. Entries due together get merged into a single
+    # burst, only the latest values being written, as each entry holds all outputs. Overdue entries still
+    # get written, in order, so that no strike is ever lost: bursts written too late are reported as missed.
+
+    # Entries due within that time of the first queued one get written along with it
+    MERGE_WINDOW = 0.0002
+
+    # Weight of the last measured sleep overshoot, in its running estimate (see Scheduler)
+    OVERSHOOT_WEIGHT = 0.1
+
+    def __init__(self, io_extenders):
+
+        log(INFO, 'Setting up IO extenders writer')
+
+        self.batch      = IoExtendersBatch(io_extenders)
+        self.condition  = threading.Condition()
+        self.entries    = collections.deque()
+        self.thread     = None
+        self.is_stopped = False
+
+        self.sleep_overshoot = 0.0
+
+        # Incremented on each post & clear, so that a wait can tell its first entry may have changed
+        self.changes_count = 0
+
+        self.stats = {'posted'  : 0,
+                      'bursts'  : 0,
+                      'merged'  : 0,
+                      'missed'  : 0,
+                      'lateness': 0.0}
+
+        return
+
+    def start(self):
+
+        self.thread = threading.Thread(target = self.__writer_thread__, name = 'io_extenders_writer', daemon = True)
+        self.thread.start()
+
+        return
+
+    def stop(self):
+
+        # Drop all entries not written yet, & wait for writer thread to be done with its last burst, e.g. for
+        # IO extenders to get shut down
+        with self.condition:
+
+            self.entries.clear()
+
+            self.is_stopped     = True
+            self.changes_count += 1
+
+            self.condition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join()
+
+        return
+
+    def post(self, deadline, values, callback = None):
+
+        # Values are all outputs of all extenders, written on deadline; callback, if any, is given
+        # that deadline, the time outputs got actually written & inter chip skew
+        with self.condition:
+
+            # Entries are written in posting order, each one holding outputs state after all previous ones
+            if len(self.entries) != 0 and deadline < self.entries[-1][0]:
+                deadline = self.entries[-1][0]
+
+            self.entries.append((deadline, bytes(values), callback))
+
+            self.stats['posted'] += 1
+            self.changes_count   += 1
+
+            self.condition.notify_all()
+
+        return
+
+    def clear(self):
+
+        # Drop all entries not written yet, e.g. when interrupted
+        with self.condition:
+
+            self.entries.clear()
+
+            self.changes_count += 1
+
+            self.condition.notify_all()
+
+        return
+
+    def __wait_for_entries__(self):
+
+        # Return entries due together, once their deadline is reached, or None once stopped
+        clock = get_clock()
+
+        with self.condition:
+
+            while True:
+
+                if self.is_stopped == True:
+                    return None
+
+                changes_count = self.changes_count
+
+                if len(self.entries) == 0:
+                    sleep_time = None
+                else:
+                    sleep_time = self.entries[0][0] - clock.monotonic() - control.spin_time - self.sleep_overshoot
+
+                if sleep_time is not None and sleep_time <= 0:
+                    break
+
+                # Extenders which failed a write, e.g. a release, get outputs pushed again on each resync period,
+                # rather than on next entry only: return no entry then, for the caller to do so, out of lock
+                if self.batch.needs_resync() == True and (sleep_time is None or sleep_time > IO_EXTENDERS_RESYNC_PERIOD):
+
+                    if clock.wait_for(self.condition, lambda: self.changes_count != changes_count, IO_EXTENDERS_RESYNC_PERIOD) == False:
+                        return []
+
+                    continue
+
+                if sleep_time is None:
+
+                    self.condition.wait()
+                    continue
+
+                wake_up_time = clock.monotonic() + sleep_time
+
+                # Learn how late the OS usually wakes us up, unless woken up on purpose
+                if clock.wait_for(self.condition, lambda: self.changes_count != changes_count, sleep_time) == False:
+                    self.sleep_overshoot += (clock.monotonic() - wake_up_time - self.sleep_overshoot) * self.OVERSHOOT_WEIGHT
+
+            deadline = self.entries[0][0]
+
+        # Busy wait the very last part, out of lock, so that posting is never held up
+        clock.spin_until(deadline)
+
+        with self.condition:
+
+            entries = [self.entries.popleft()]
+
+            while len(self.entries) != 0 and self.__is_mergeable__(entries[-1], self.entries[0], deadline):
+                entries.append(self.entries.popleft())
+
+        return entries
+
+    def __is_mergeable__(self, entry, next_entry, deadline):
+
+        # Next entry may be written instead of entry, if due together with burst deadline, and provided it
+        # does not clear any output entry sets: a strike would otherwise never show up, e.g. when overdue
+        if next_entry[0] > deadline + self.MERGE_WINDOW:
+            return False
+
+        for values, next_values in zip(entry[1], next_entry[1]):
+            if values & ~next_values != 0:
+                return False
+
+        return True
+
+    def __writer_thread__(self):
+
+        log(INFO, 'Starting IO extenders writer thread')
+
+        # Writer is as timing critical as the player is
+        if control.realtime_mode == True:
+            set_realtime_mode(control.realtime_priority, control.realtime_cpu, control.realtime_lock_memory)
+
+        while True:
+
+            entries = self.__wait_for_entries__()
+
+            if entries is None:
+                break
+
+            if len(entries) == 0:
+
+                self.batch.resync()
+                continue
+
+            # Last entry holds outputs state after all previous ones: only write that one, the burst being due
+            # on first entry deadline
+            values = entries[-1][1]
+
+            self.batch.set_ports(values)
+
+            write_time = self.batch.commit()
+            lateness   = write_time - entries[0][0]
+
+            for deadline, entry_values, entry_callback in entries:
+
+                if entry_callback is not None:
+                    entry_callback(deadline, write_time, self.batch.skew)
+
+            with self.condition:
+
+                self.stats['merged'  ] += len(entries) - 1
+                self.stats['bursts'  ] += 1
+                self.stats['lateness']  = max(self.stats['lateness'], lateness)
+
+                if lateness > control.i2c_writer_miss:
+                    self.stats['missed'] += 1
+
+            if lateness > control.i2c_writer_miss:
+                log(DEBUG, 'IO extenders writer missed deadline by {:.3f} ms'.format(lateness * 1000))
+
+        log(INFO, 'Stopping IO extenders writer thread')
+
+        return
+
+    def get_stats(self):
+
+        with self.condition:
+
+            return dict(self.stats)
+
+    def print_status(self):
+
+        stats = self.get_stats()
+
+        print('IO extenders writer: {} entries posted, {} bursts written'.format(stats['posted'], stats['bursts']))
+        print('  {} merged, {} missed deadlines, max lateness {:.3f} ms'.format(stats['merged'], stats['missed'], stats['lateness'] * 1000))
+
+        return
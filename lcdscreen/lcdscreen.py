@@ -1,16 +1,31 @@
 import threading
+import asyncio
 import time
-import RPi.GPIO
-import gpiozero
-import pigpio
 import spi
 import numpy
+import simulation
 
 from PIL import Image
 
 from log     import *
 from globals import *
 
+# Only the library of the GPIO interface in use is needed
+try:
+    import RPi.GPIO
+except (ImportError, RuntimeError):
+    RPi = None
+
+try:
+    import gpiozero
+except ImportError:
+    gpiozero = None
+
+try:
+    import pigpio
+except ImportError:
+    pigpio = None
+
 
 class LcdScreen:
 
@@ -23,6 +38,7 @@ class LcdScreen:
         self.gpio_interface      = gpio_interface
         self.spi_device          = spi.SpiDevice(bus, address, self.SPI_MAX_SPEED_IN_HZ)
         self.is_init_in_progress = False
+        self.init_task           = None
 
         return
 
@@ -43,7 +59,7 @@ class LcdScreen:
             elif gpio == LCD_SCREEN_BL_PIN:
                 self.pin_bl.value = value
 
-        elif self.gpio_interface == USE_PI_GPIO:
+        elif self.gpio_interface == USE_PI_GPIO or self.gpio_interface == USE_SIMULATION:
 
             self.pigpio.write(gpio, value)
 
@@ -171,14 +187,17 @@ class LcdScreen:
             self.pin_cs    = gpiozero.DigitalOutputDevice(LCD_SCREEN_CS_PIN   )
             self.pin_bl    = gpiozero.DigitalOutputDevice(LCD_SCREEN_BL_PIN   )
 
-        elif self.gpio_interface == USE_PI_GPIO:
+        elif self.gpio_interface == USE_PI_GPIO or self.gpio_interface == USE_SIMULATION:
 
-            self.pigpio = pigpio.pi()
+            # Simulated GPIOs mimic pigpio
+            gpio_module = pigpio if self.gpio_interface == USE_PI_GPIO else simulation.pigpio
 
-            self.pigpio.set_mode(LCD_SCREEN_RESET_PIN, pigpio.OUTPUT)
-            self.pigpio.set_mode(LCD_SCREEN_DC_PIN   , pigpio.OUTPUT)
-            self.pigpio.set_mode(LCD_SCREEN_CS_PIN   , pigpio.OUTPUT)
-            self.pigpio.set_mode(LCD_SCREEN_BL_PIN   , pigpio.OUTPUT)
+            self.pigpio = gpio_module.pi()
+
+            self.pigpio.set_mode(LCD_SCREEN_RESET_PIN, gpio_module.OUTPUT)
+            self.pigpio.set_mode(LCD_SCREEN_DC_PIN   , gpio_module.OUTPUT)
+            self.pigpio.set_mode(LCD_SCREEN_CS_PIN   , gpio_module.OUTPUT)
+            self.pigpio.set_mode(LCD_SCREEN_BL_PIN   , gpio_module.OUTPUT)
 
         # Turn backlight ON by default
         self.__output_gpio__(LCD_SCREEN_BL_PIN, 1)
@@ -329,20 +348,52 @@ class LcdScreen:
 
         return
 
-    def start_init_animation(self):
+    async def __init_animation_task__(self):
+
+        loop    = asyncio.get_running_loop()
+        images  = [Image.open('display/init_{}.png'.format(index)) for index in range(1, 8)]
+        counter = 0
+
+        while self.is_init_in_progress == True:
+
+            # Sending a whole image takes a while: do not hold up the event loop meanwhile
+            await loop.run_in_executor(None, self.display, images[counter % 7])
+
+            counter += 1
 
-        log(INFO, 'LCD screen starting initialization animation thread')
+            await asyncio.sleep(3)
+
+        return
+
+    def start_init_animation(self):
 
         self.is_init_in_progress = True
 
-        init_thread = threading.Thread(target = self.__init_animation_thread__, name = 'init_animation', args = [])
-        init_thread.start()
+        # When started from an event loop (asyncio runtime), animate from a task, rather than from a thread
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is None:
+
+            log(INFO, 'LCD screen starting initialization animation thread')
+
+            init_thread = threading.Thread(target = self.__init_animation_thread__, name = 'init_animation', args = [])
+            init_thread.start()
+
+        else:
+
+            log(INFO, 'LCD screen starting initialization animation task')
+
+            # Keep a reference to that task, as the event loop only keeps weak ones
+            self.init_task = loop.create_task(self.__init_animation_task__())
 
         return
 
     def stop_init_animation(self):
 
-        log(INFO, 'LCD screen stopping initialization animation thread')
+        log(INFO, 'LCD screen stopping initialization animation')
 
         self.is_init_in_progress = False
 
@@ -8,6 +8,9 @@ DEBUG   = 4
 
 logger = None
 
+# Level logs were last set to, e.g. to set them up the same in another process
+logger_level = DEBUG
+
 
 def log_init(level):
 
@@ -32,6 +35,10 @@ def log_init(level):
 
 def log_set_level(level):
 
+    global logger_level
+
+    logger_level = level
+
     if level == NO_LOG:
         logger.debug('Logs disabled')
         logger.setLevel(logging.CRITICAL)
@@ -49,6 +56,11 @@ def log_set_level(level):
         logger.debug('Log level set to DEBUG')
 
 
+def log_get_level():
+
+    return logger_level
+
+
 def log(level, message):
 
     global logger
@@ -1,8 +1,12 @@
 import json
 import os
+import sys
+import argparse
 import threading
-import RPi.GPIO
+import asyncio
+import concurrent.futures
 
+import i2c
 import rotarybutton
 import midireader
 import ioextender
@@ -10,15 +14,23 @@ import xylophone
 import lcdscreen
 import display
 import controller
+import simulation
+import renderer
 
 from globals import *
 from utils   import *
 from log     import *
 
-setup_data       = None
-io_extender_low  = None
-io_extender_high = None
-lcd_screen       = None
+# Only needed when using RPi.GPIO interface
+try:
+    import RPi.GPIO
+except (ImportError, RuntimeError):
+    RPi = None
+
+setup_data          = None
+io_extenders        = []
+io_extenders_writer = None
+lcd_screen          = None
 
 
 def print_help():
@@ -26,13 +38,20 @@ def print_help():
     print('')
     print('Print tempo list values          : v')
     print('Print controller  status         : e')
+    print('Print last track strikes jitter  : j')
     print('Print MIDI reader status         : m')
     print('Print MIDI file info    by index : i=2')
     print('Print MIDI file details by index : d=3')
+    print('Print MIDI files parse times     : u')
+    print('Invalidate MIDI files cache      : k')
+    print('Print simulated hardware status  : z')
+    print('Print I2C transactions & bus load: ib')
     print('')
     print('Play welcome sound              : w')
     print('Play a single note              : n=60')
     print('Play a chord, i.e. several notes: c=[60, 62]')
+    print('Render a file offline, by index : b=4')
+    print('Dry run a file, all files if -1 : r=4 or r=[4, 10] (x10 speed)')
     print('')
     print('Change file playing tempo            : t=90')
     print('Start playing file, use file tempo   : o=2')
@@ -44,6 +63,8 @@ def print_help():
     print('Enter full  mode (trigger notes)       : f')
     print('')
     print('Change note length, in ms : g=15 (current: {})'.format(int(control.note_length * 1000)))
+    print('Change player engine      : y=1  (current: {})'.format(control.player_engine))
+    print('                            0 > relative, 1 > deadline')
     print('')
     print('Set log level: l=0 > NO_LOG , 1 > ERROR,')
     print('                 2 > WARNING, 3 > INFO , 4 > DEBUG')
@@ -56,7 +77,138 @@ def print_help():
     return
 
 
-def console_thread(midi_reader, main_controller, io_extender_low, io_extender_high):
+def process_console_input(user_input, midi_reader, main_controller, io_extenders, track_renderer):
+
+    # Return False when leaving console, True otherwise
+    is_console_on = True
+
+    if len(user_input) == 1:
+
+        command = user_input[0]
+
+        if command == 'v':
+            for tempo in TEMPO_LIST:
+                print('{} '.format(tempo), end = '', flush = True)
+            print('')
+        elif command == 'e':
+            main_controller.print_status()
+        elif command == 'j':
+            main_controller.print_jitter()
+        elif command == 'm':
+            midi_reader.print_status()
+        elif command == 'u':
+            midi_reader.print_parse_times()
+        elif command == 'k':
+            midi_reader.invalidate_cache()
+        elif command == 's':
+            main_controller.stop_track()
+        elif command == 'a':
+            main_controller.play_all_from_console()
+        elif command == 'w':
+            main_controller.play_welcome_sound()
+        elif command == 'f':
+            for io_extender in io_extenders:
+                io_extender.leave_quiet_mode()
+        elif command == 'q':
+            for io_extender in io_extenders:
+                io_extender.enter_quiet_mode()
+        elif command == 'r':
+            print('')
+            print('***** GOING TO OPERATIONAL MODE *****')
+            is_console_on = False
+        elif command == 'x':
+            print('***** EXITING GRACEFULLY *****')
+
+            graceful_exit(0)
+        elif command == 'z':
+            if control.gpio_interface == USE_SIMULATION:
+                simulation.get_trace().print_status()
+            else:
+                print('Not running on simulated hardware')
+        elif command == 'h':
+            print_help()
+
+    elif len(user_input) == 2:
+
+        command = user_input[0:2]
+
+        if command == 'sf':
+            pass
+        elif command == 'ib':
+            i2c.get_metrics().print_status()
+            if main_controller.xylophone.writer is not None:
+                main_controller.xylophone.writer.print_status()
+
+    elif len(user_input) > 2 and user_input[1] == '=':
+
+        command = user_input[0]
+
+        if command != 'c' and command != 'r':
+            value = int(user_input[2:])
+        else:
+            value = json.loads(user_input[2:])
+
+        if command == 'l':
+            if value == 0:
+                log_set_level(NO_LOG )
+            elif value == 1:
+                log_set_level(ERROR  )
+            elif value == 2:
+                log_set_level(WARNING)
+            elif value == 3:
+                log_set_level(INFO   )
+            elif value == 4:
+                log_set_level(DEBUG  )
+            else:
+                print('Invalid log level')
+        elif command == 'i':
+            midi_reader.print_file_info(value)
+        elif command == 'd':
+            midi_reader.print_file_details(value)
+        elif command == 'n':
+            main_controller.play_note_from_console(value)
+        elif command == 'c':
+            main_controller.play_notes_from_console(value)
+        elif command == 'b':
+            # MIDI reader plays one file at once, be it actually or offline
+            if main_controller.state == main_controller.STATE_IDLE:
+                summary = track_renderer.render(value)
+                if summary is not None:
+                    track_renderer.print_summary(summary)
+            else:
+                print('Cannot render file while playing; stop playing first')
+        elif command == 'r':
+            # Either a track index, or [track index, speed]; -1 dry runs all tracks
+            if isinstance(value, list):
+                index, speed = value
+            else:
+                index, speed = value, 0
+            if main_controller.state == main_controller.STATE_IDLE:
+                report = track_renderer.dry_run(None if index == -1 else index, speed)
+                if report is not None:
+                    track_renderer.print_dry_run_report(report)
+            else:
+                print('Cannot dry run file while playing; stop playing first')
+        elif command == 't':
+            main_controller.set_tempo_from_console(value)
+        elif command == 'o':
+            main_controller.play_track_from_console(value, True)
+        elif command == 'p':
+            main_controller.play_track_from_console(value, False)
+        elif command == 'g':
+            control.note_length = float(value) / 1000.0
+            print('Changing note length to {} ms'.format(int(value)))
+        elif command == 'y':
+            if value == PLAYER_ENGINE_RELATIVE or value == PLAYER_ENGINE_DEADLINE:
+                control.player_engine = value
+                print('Changing player engine to {}, from next track on'.format(value))
+            else:
+                print('Invalid player engine')
+
+    return is_console_on
+
+
+def console_thread(midi_reader, main_controller, io_extenders, track_renderer):
 
     print_help()
 
@@ -68,87 +220,26 @@ def console_thread(midi_reader, main_controller, io_extender_low, io_extender_hi
 
         user_input = input()
 
-        if len(user_input) == 1:
-
-            command = user_input[0]
-
-            if command == 'v':
-                for tempo in TEMPO_LIST:
-                    print('{} '.format(tempo), end = '', flush = True)
-                print('')
-            elif command == 'e':
-                main_controller.print_status()
-            elif command == 'm':
-                midi_reader.print_status()
-            elif command == 's':
-                main_controller.stop_track()
-            elif command == 'a':
-                main_controller.play_all_from_console()
-            elif command == 'w':
-                main_controller.play_welcome_sound()
-            elif command == 'f':
-                io_extender_low.leave_quiet_mode ()
-                io_extender_high.leave_quiet_mode()
-            elif command == 'q':
-                io_extender_low.enter_quiet_mode ()
-                io_extender_high.enter_quiet_mode()
-            elif command == 'r':
-                print('')
-                print('***** GOING TO OPERATIONAL MODE *****')
-                is_console_on = False
-            elif command == 'x':
-                print('***** EXITING GRACEFULLY *****')
-
-                graceful_exit(0)
-            elif command == 'h':
-                print_help()
-
-        elif len(user_input) == 2:
-
-            command = user_input[0:2]
-
-            if command == 'sf':
-                pass
-
-        elif len(user_input) > 2 and user_input[1] == '=':
-
-            command = user_input[0]
-
-            if command != 'c':
-                value = int(user_input[2:])
-            else:
-                value = json.loads(user_input[2:])
-
-            if command == 'l':
-                if value == 0:
-                    log_set_level(NO_LOG )
-                elif value == 1:
-                    log_set_level(ERROR  )
-                elif value == 2:
-                    log_set_level(WARNING)
-                elif value == 3:
-                    log_set_level(INFO   )
-                elif value == 4:
-                    log_set_level(DEBUG  )
-                else:
-                    print('Invalid log level')
-            elif command == 'i':
-                midi_reader.print_file_info(value)
-            elif command == 'd':
-                midi_reader.print_file_details(value)
-            elif command == 'n':
-                main_controller.play_note_from_console(value)
-            elif command == 'c':
-                main_controller.play_notes_from_console(value)
-            elif command == 't':
-                main_controller.set_tempo_from_console(value)
-            elif command == 'o':
-                main_controller.play_track_from_console(value, True)
-            elif command == 'p':
-                main_controller.play_track_from_console(value, False)
-            elif command == 'g':
-                control.note_length = float(value) / 1000.0
-                print('Changing note length to {} ms'.format(int(value)))
+        is_console_on = process_console_input(user_input, midi_reader, main_controller, io_extenders, track_renderer)
+
+    return
+
+
+async def console_task(midi_reader, main_controller, io_extenders, track_renderer):
+
+    loop = asyncio.get_running_loop()
+
+    print_help()
+
+    is_console_on = True
+
+    while is_console_on == True:
+
+        print('> ', end = '', flush = True)
+
+        # Waiting for input blocks, as do most commands, e.g. playing notes: leave them to executor threads
+        user_input    = await loop.run_in_executor(None, input)
+        is_console_on = await loop.run_in_executor(None, process_console_input, user_input, midi_reader, main_controller, io_extenders, track_renderer)
 
     return
 
@@ -156,11 +247,18 @@ def console_thread(midi_reader, main_controller, io_extender_low, io_extender_hi
 def main():
 
     global setup_data
-    global io_extender_low
-    global io_extender_high
+    global io_extenders
     global lcd_screen
 
-    with open(SETUP_FILE, 'r') as json_file:
+    parser = argparse.ArgumentParser(description = 'My self playing xylophone')
+    parser.add_argument('setup_file', nargs = '?', default = SETUP_FILE, help = 'setup file, e.g. to run on simulated hardware (default: {})'.format(SETUP_FILE))
+    parser.add_argument('--render'  , type = int, metavar = 'INDEX'    , help = 'render a file offline, to an I2C writes log, then exit')
+    parser.add_argument('--output'  , metavar = 'FILE'                 , help = 'rendered I2C writes log file')
+    parser.add_argument('--dry-run' , type = int, metavar = 'INDEX'    , help = 'dry run a file, or all files if -1, on quiet extenders, then exit')
+    parser.add_argument('--speed'   , type = int, default = 0          , help = 'dry run speed, versus actual time (default: 0, as fast as possible)')
+    arguments = parser.parse_args()
+
+    with open(arguments.setup_file, 'r') as json_file:
         setup_data = json.load(json_file)
 
     log_init(setup_data['LOG_LEVEL'])
@@ -169,7 +267,82 @@ def main():
     pil_logger = logging.getLogger('PIL')
     pil_logger.setLevel(logging.INFO)
 
-    control.note_length = setup_data['XYLOPHONE_NOTE_LENGTH'] / 1000.0
+    control.gpio_interface   = setup_data.get('GPIO_INTERFACE', USE_PI_GPIO)
+    control.note_length      = setup_data['XYLOPHONE_NOTE_LENGTH'] / 1000.0
+    control.player_engine    = setup_data.get('PLAYER_ENGINE', DEFAULT_PLAYER_ENGINE )
+    control.runtime          = setup_data.get('RUNTIME'      , RUNTIME_THREADS       )
+    control.spin_time        = setup_data.get('PLAYER_SPIN_TIME_US', DEFAULT_SPIN_TIME * 1000000) / 1000000.0
+    control.inter_tracks_gap = setup_data.get('PLAYER_INTER_TRACKS_GAP_MS', DEFAULT_INTER_TRACKS_GAP * 1000) / 1000.0
+    control.jitter_dump_dir  = setup_data.get('JITTER_DUMP_DIR')
+    control.stagger_window   = setup_data.get('XYLOPHONE_STAGGER_WINDOW_US', 0) / 1000000.0
+    control.stagger_coils    = setup_data.get('XYLOPHONE_STAGGER_COILS'    , 0)
+
+    # Minimum re-strike interval applies to all bars, but for the ones given their own, by MIDI note number
+    control.restrike_interval  = setup_data.get('XYLOPHONE_RESTRIKE_INTERVAL_MS', 0) / 1000.0
+    control.restrike_intervals = {int(note): interval / 1000.0 for note, interval in setup_data.get('XYLOPHONE_RESTRIKE_INTERVALS_MS', {}).items()}
+    control.restrike_policy    = setup_data.get('XYLOPHONE_RESTRIKE_POLICY', RESTRIKE_POLICY_DROP)
+
+    # I2C transactions get retried as long as it fits in budget, not to hold up playback any longer
+    control.i2c_retry_budget = setup_data.get('I2C_RETRY_BUDGET_US', DEFAULT_I2C_RETRY_BUDGET * 1000000) / 1000000.0
+    control.i2c_retry_delay  = setup_data.get('I2C_RETRY_DELAY_US' , DEFAULT_I2C_RETRY_DELAY  * 1000000) / 1000000.0
+
+    # Bus load is the share of bus clock cycles transactions use (see I2cMetrics)
+    control.i2c_bus_clock = setup_data.get('I2C_BUS_CLOCK_HZ', DEFAULT_I2C_BUS_CLOCK)
+
+    # Writer thread gets output latches values that much ahead of their deadline, and reports writing them later than allowed
+    control.i2c_writer      = setup_data.get('I2C_WRITER'        , 0) == 1
+
+    # On a single event loop, no smbus write nor busy wait may hold up all other tasks: writer thread does them
+    if control.runtime == RUNTIME_ASYNCIO and control.i2c_writer == False:
+
+        log(INFO, 'Asyncio runtime writes output latches from writer thread; using I2C writer')
+        control.i2c_writer = True
+
+    control.i2c_writer_lead = setup_data.get('I2C_WRITER_LEAD_US', DEFAULT_I2C_WRITER_LEAD * 1000000) / 1000000.0
+    control.i2c_writer_miss = setup_data.get('I2C_WRITER_MISS_US', DEFAULT_I2C_WRITER_MISS * 1000000) / 1000000.0
+
+    control.realtime_mode        = setup_data.get('REALTIME_MODE'       , 0 ) == 1
+    control.realtime_priority    = setup_data.get('REALTIME_PRIORITY'   , 50)
+    control.realtime_cpu         = setup_data.get('REALTIME_CPU'        , -1)
+    control.realtime_lock_memory = setup_data.get('REALTIME_LOCK_MEMORY', 0 ) == 1
+
+    if control.gpio_interface == USE_SIMULATION:
+
+        control.simulation_i2c_clock    = setup_data.get('SIMULATION_I2C_CLOCK_HZ'   , DEFAULT_SIMULATION_I2C_CLOCK                  )
+        control.simulation_i2c_overhead = setup_data.get('SIMULATION_I2C_OVERHEAD_US', DEFAULT_SIMULATION_I2C_OVERHEAD * 1000000) / 1000000.0
+        control.simulation_spi_overhead = setup_data.get('SIMULATION_SPI_OVERHEAD_US', DEFAULT_SIMULATION_SPI_OVERHEAD * 1000000) / 1000000.0
+        control.simulation_i2c_errors   = setup_data.get('SIMULATION_I2C_ERRORS'     , DEFAULT_SIMULATION_I2C_ERRORS                  )
+
+        # Simulated bus runs at its own clock
+        control.i2c_bus_clock = control.simulation_i2c_clock
+
+        simulation.get_trace().set_capacity(setup_data.get('SIMULATION_TRACE_SIZE', simulation.Trace.DEFAULT_CAPACITY))
+
+    # Offline rendering & dry runs need no hardware at all: just MIDI files
+    if arguments.render is not None or arguments.dry_run is not None:
+
+        midi_reader    = midireader.MidiReader(setup_data['MIDI_MUSIC_DIR'], setup_data.get('MIDI_CACHE_DIR'), setup_data.get('MIDI_SCAN_WORKERS', 1), setup_data.get('MIDI_EVENTS_CACHE_SIZE', 0))
+        track_renderer = renderer.Renderer(setup_data, midi_reader, setup_data.get('RENDER_DIR', RENDER_DIR))
+
+        if arguments.render is not None:
+
+            summary = track_renderer.render(arguments.render, arguments.output)
+
+            if summary is None:
+                graceful_exit(1)
+
+            track_renderer.print_summary(summary)
+
+        else:
+
+            report = track_renderer.dry_run(None if arguments.dry_run == -1 else arguments.dry_run, arguments.speed)
+
+            if report is None:
+                graceful_exit(1)
+
+            track_renderer.print_dry_run_report(report)
+
+        graceful_exit(0)
 
     if setup_data['START_CONSOLE'] == 1:
         os.system('clear')
@@ -200,6 +373,18 @@ def main():
         graceful_exit(3)
 
 
+    if control.runtime == RUNTIME_ASYNCIO:
+        asyncio.run(run_tasks())
+    else:
+        run_threads()
+
+    return
+
+
+def setup_display():
+
+    global lcd_screen
+
     log(INFO, 'Main >>>>>> setting up display')
     log(INFO, '')
 
@@ -207,14 +392,24 @@ def main():
     display_interface = display.Display(lcd_screen)
     display_interface.draw_init()
 
+    return display_interface
+
+
+def setup_controller(display_interface):
+
+    global io_extenders
+    global io_extenders_writer
+
     log(INFO, '')
     log(INFO, 'Main >>>>>> setting up MIDI files')
     log(INFO, '')
 
     # Setup MIDI files
-    midi_reader  = midireader.MidiReader(setup_data['MIDI_MUSIC_DIR'])
+    midi_reader  = midireader.MidiReader(setup_data['MIDI_MUSIC_DIR'], setup_data.get('MIDI_CACHE_DIR'), setup_data.get('MIDI_SCAN_WORKERS', 1), setup_data.get('MIDI_EVENTS_CACHE_SIZE', 0))
     tracks_count = midi_reader.get_files_count()
 
+    track_renderer = renderer.Renderer(setup_data, midi_reader, setup_data.get('RENDER_DIR', RENDER_DIR))
+
     # Provide MIDI reader reference to display (used to show up tracks)
     display_interface.register_midi_reader(midi_reader)
 
@@ -223,11 +418,13 @@ def main():
     log(INFO, '')
 
     # Setup control buttons
-    mode_button      = rotarybutton.RotaryStatesButton('MODE' , control.gpio_interface, MODE_BUTTON_PIN_1 , MODE_BUTTON_PIN_2 , MODE_BUTTON_PIN_PRESS , [MODE.LOOP_ONE_TRACK, MODE.PLAY_ALL_TRACKS, MODE.PLAY_ONE_TRACK, MODE.STOP], True)
-    track_button     = rotarybutton.RotaryStatesButton('TRACK', control.gpio_interface, TRACK_BUTTON_PIN_1, TRACK_BUTTON_PIN_2, TRACK_BUTTON_PIN_PRESS, [i for i in range(0, tracks_count)], False)
-    tempo_button     = rotarybutton.RotaryStatesButton('TEMPO', control.gpio_interface, TEMPO_BUTTON_PIN_1, TEMPO_BUTTON_PIN_2, TEMPO_BUTTON_PIN_PRESS, TEMPO_LIST, False)
-    io_extender_low  = ioextender.IoExtender          (setup_data['I2C_BUS_NUMBER'], setup_data['MCP_23017_I2C_ADDRESS_1'])
-    io_extender_high = ioextender.IoExtender          (setup_data['I2C_BUS_NUMBER'], setup_data['MCP_23017_I2C_ADDRESS_2'])
+    mode_button  = rotarybutton.RotaryStatesButton('MODE' , control.gpio_interface, MODE_BUTTON_PIN_1 , MODE_BUTTON_PIN_2 , MODE_BUTTON_PIN_PRESS , [MODE.LOOP_ONE_TRACK, MODE.PLAY_ALL_TRACKS, MODE.PLAY_ONE_TRACK, MODE.STOP], True)
+    track_button = rotarybutton.RotaryStatesButton('TRACK', control.gpio_interface, TRACK_BUTTON_PIN_1, TRACK_BUTTON_PIN_2, TRACK_BUTTON_PIN_PRESS, [i for i in range(0, tracks_count)], False)
+    tempo_button = rotarybutton.RotaryStatesButton('TEMPO', control.gpio_interface, TEMPO_BUTTON_PIN_1, TEMPO_BUTTON_PIN_2, TEMPO_BUTTON_PIN_PRESS, TEMPO_LIST, False)
+
+    # Setup IO extenders, as many as bars are wired to
+    notes_map    = xylophone.NotesMap.from_setup(setup_data)
+    io_extenders = [ioextender.IoExtender(bus, address) for bus, address in notes_map.extenders]
 
     log(INFO, '')
     log(INFO, 'Main >>>>>> setting up xylophone')
@@ -237,9 +434,45 @@ def main():
     display_interface.draw_oper()
 
     # Setup actual xylophone and highest level controllers
-    xylophone_device  = xylophone.Xylophone  (setup_data['XYLOPHONE_LOWEST_NOTE'], setup_data['XYLOPHONE_NOTES_COUNT'], setup_data['XYLOPHONE_MAX_SIM_NOTES'], io_extender_low, io_extender_high)
+    xylophone_device  = xylophone.Xylophone  (notes_map, setup_data['XYLOPHONE_MAX_SIM_NOTES'], io_extenders)
+
+    # From now on, writer thread is the only one to write output latches, on each write deadline
+    if control.i2c_writer == True:
+
+        io_extenders_writer = ioextender.IoExtendersWriter(xylophone_device.io_extenders)
+        xylophone_device.set_writer(io_extenders_writer)
+        io_extenders_writer.start()
+
     main_controller   = controller.Controller(mode_button, track_button, tempo_button, midi_reader, xylophone_device, display_interface)
 
+    return midi_reader, track_renderer, main_controller
+
+
+def print_runtime_report(main_controller):
+
+    main_controller.print_status()
+    main_controller.print_jitter()
+
+    return
+
+
+def start_input_script(main_controller):
+
+    # With simulated hardware, buttons can only be operated from a script
+    if control.gpio_interface == USE_SIMULATION and setup_data.get('SIMULATION_INPUT_SCRIPT') is not None:
+
+        input_script = simulation.InputScript(setup_data['SIMULATION_INPUT_SCRIPT'], graceful_exit, lambda: print_runtime_report(main_controller))
+        input_script.start()
+
+    return
+
+
+def run_threads():
+
+    display_interface = setup_display()
+
+    midi_reader, track_renderer, main_controller = setup_controller(display_interface)
+
     controller_buttons_reader = threading.Thread(target = main_controller.buttons_reader_thread, name='controller_buttons_reader', args = [])
     controller_buttons_reader.start()
 
@@ -253,11 +486,13 @@ def main():
     # Play hidden/embedded welcome sound
     main_controller.play_welcome_sound()
 
+    start_input_script(main_controller)
+
     log(INFO, '')
     log(INFO, 'Main >>>>>> starting console')
 
     if setup_data['START_CONSOLE'] == 1:
-        console = threading.Thread(target = console_thread, name = 'console', args = [midi_reader, main_controller, io_extender_low, io_extender_high])
+        console = threading.Thread(target = console_thread, name = 'console', args = [midi_reader, main_controller, io_extenders, track_renderer])
         console.start()
 
     controller_buttons_reader.join()
@@ -269,17 +504,61 @@ def main():
     return
 
 
+async def run_tasks():
+
+    # Same as run_threads(), but with a single thread running all activities as tasks of an event loop;
+    # only blocking calls, e.g. sending images to display or loading MIDI files, go to executor threads.
+    loop = asyncio.get_running_loop()
+
+    # Executor threads get started from event loop thread, and would inherit its real time guarantees
+    initializer = reset_realtime_mode if control.realtime_mode == True else None
+    loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(max_workers = ASYNCIO_EXECUTOR_WORKERS, thread_name_prefix = 'executor', initializer = initializer))
+
+    # Only the event loop thread is timing critical: have executor threads hand the interpreter lock back sooner
+    sys.setswitchinterval(ASYNCIO_SWITCH_INTERVAL)
+
+    # Setting up display sends it a first image over SPI: not to be done on the event loop either
+    display_interface = await loop.run_in_executor(None, setup_display)
+
+    # Let display animate while MIDI files get scanned, which may take a while
+    midi_reader, track_renderer, main_controller = await loop.run_in_executor(None, setup_controller, display_interface)
+
+    tasks = [loop.create_task(main_controller.buttons_reader_task()),
+             loop.create_task(main_controller.file_player_task   ())]
+
+    log(INFO, '')
+    log(INFO, 'Main >>>>>> playing welcome sound')
+    log(INFO, '')
+
+    # Play hidden/embedded welcome sound
+    main_controller.play_welcome_sound()
+
+    start_input_script(main_controller)
+
+    log(INFO, '')
+    log(INFO, 'Main >>>>>> starting console')
+
+    if setup_data['START_CONSOLE'] == 1:
+        tasks.append(loop.create_task(console_task(midi_reader, main_controller, io_extenders, track_renderer)))
+
+    await asyncio.gather(*tasks)
+
+    return
+
+
 def graceful_exit(return_code):
 
-    global io_extender_low
-    global io_extender_high
+    global setup_data
+    global io_extenders
+    global io_extenders_writer
     global lcd_screen
 
-    if io_extender_low is not None:
-        io_extender_low.shutdown()
+    # Writer thread would otherwise keep on writing outputs, whatever shutdown turns off
+    if io_extenders_writer is not None:
+        io_extenders_writer.stop()
 
-    if io_extender_high is not None:
-        io_extender_high.shutdown()
+    for io_extender in io_extenders:
+        io_extender.shutdown()
 
     if lcd_screen is not None:
         lcd_screen.module_exit()
@@ -288,6 +567,9 @@ def graceful_exit(return_code):
         log(INFO, 'Cleaning up GPIOs')
         RPi.GPIO.cleanup()
 
+    if control.gpio_interface == USE_SIMULATION and setup_data is not None and setup_data.get('SIMULATION_TRACE_FILE') is not None:
+        simulation.get_trace().dump(setup_data['SIMULATION_TRACE_FILE'])
+
     os._exit(return_code)
 
     return
@@ -0,0 +1,223 @@
+import os
+import hashlib
+import pickle
+
+from log import *
+
+
+class MidiCache:
+
+    """
+    On-disk cache of parsed MIDI files, so that only new or modified files get parsed at startup.
+
+    The cache directory holds an index file, mapping each MIDI file path to its size, modification
+    time, content hash & parsed metadata, plus one entry file per MIDI file holding parsed events,
+    which are only read when a file is about to be played.
+    All cache files start with a magic string, a format version & a SHA-256 digest of their payload:
+    any mismatch discards the file, which will just get rebuilt.
+    """
+
+    CACHE_MAGIC   = b'XYLOCACHE'
+    CACHE_VERSION = 3
+    DIGEST_SIZE   = 32
+
+    INDEX_FILENAME = 'index.pickle'
+    ENTRY_SUFFIX   = '.pickle'
+
+    def __init__(self, cache_dir):
+
+        log(INFO, 'Setting up MIDI cache in {} directory'.format(cache_dir))
+
+        self.cache_dir  = cache_dir
+        self.index      = {}
+        self.is_dirty   = False
+        self.hits_count = 0
+
+        os.makedirs(self.cache_dir, exist_ok = True)
+
+        index = self.__read_file__(os.path.join(self.cache_dir, self.INDEX_FILENAME))
+
+        if isinstance(index, dict):
+
+            self.index = index
+
+        log(INFO, 'MIDI cache holds {} entries'.format(len(self.index)))
+
+        return
+
+    @staticmethod
+    def __get_file_hash__(fullname):
+
+        hasher = hashlib.sha1()
+
+        with open(fullname, 'rb') as midi_file:
+            hasher.update(midi_file.read())
+
+        return hasher.hexdigest()
+
+    def __read_file__(self, filename):
+
+        if not os.path.isfile(filename):
+            return None
+
+        try:
+
+            with open(filename, 'rb') as cache_file:
+                content = cache_file.read()
+
+            header_size = len(self.CACHE_MAGIC) + 1
+            magic       = content[:len(self.CACHE_MAGIC)]
+            version     = content[len(self.CACHE_MAGIC)]
+            digest      = content[header_size:header_size + self.DIGEST_SIZE]
+            payload     = content[header_size + self.DIGEST_SIZE:]
+
+            if magic != self.CACHE_MAGIC or version != self.CACHE_VERSION:
+
+                log(WARNING, 'Discarding MIDI cache file {}; unknown format or version'.format(filename))
+                return None
+
+            if hashlib.sha256(payload).digest() != digest:
+
+                log(WARNING, 'Discarding MIDI cache file {}; integrity check failed'.format(filename))
+                return None
+
+            return pickle.loads(payload)
+
+        except Exception as error:
+
+            log(WARNING, 'Discarding MIDI cache file {}; {}'.format(filename, error))
+            return None
+
+    def __write_file__(self, filename, data):
+
+        payload   = pickle.dumps(data, protocol = pickle.HIGHEST_PROTOCOL)
+        temp_name = filename + '.tmp'
+
+        # Write to a temporary file first, so that a power cut never leaves a half written cache file
+        with open(temp_name, 'wb') as cache_file:
+            cache_file.write(self.CACHE_MAGIC)
+            cache_file.write(bytes([self.CACHE_VERSION]))
+            cache_file.write(hashlib.sha256(payload).digest())
+            cache_file.write(payload)
+
+        os.replace(temp_name, filename)
+
+        return
+
+    def __get_entry_filename__(self, file_hash):
+
+        return os.path.join(self.cache_dir, file_hash + self.ENTRY_SUFFIX)
+
+    def get_file_key(self, fullname):
+
+        file_stat = os.stat(fullname)
+
+        return file_stat.st_size, file_stat.st_mtime_ns, self.__get_file_hash__(fullname)
+
+    def lookup(self, fullname, file_key):
+
+        entry = self.index.get(fullname)
+
+        if entry is None or entry['key'] != file_key:
+            return None
+
+        if not os.path.isfile(self.__get_entry_filename__(file_key[2])):
+
+            # Entry file went missing: forget about that file, it will be parsed again
+            del self.index[fullname]
+            self.is_dirty = True
+            return None
+
+        self.hits_count += 1
+
+        # Only metadata is returned here: events are loaded on demand, with load_events()
+        return dict(entry['data'])
+
+    def load_events(self, fullname):
+
+        entry = self.index.get(fullname)
+
+        if entry is None:
+            return None
+
+        return self.__read_file__(self.__get_entry_filename__(entry['key'][2]))
+
+    def store(self, fullname, file_key, file_data):
+
+        entry_data = dict(file_data)
+        events     = entry_data.pop('events')
+
+        try:
+
+            self.__write_file__(self.__get_entry_filename__(file_key[2]), events)
+
+        except OSError as error:
+
+            log(WARNING, 'Cannot store {} in MIDI cache; {}'.format(fullname, error))
+            return
+
+        self.index[fullname] = {'key': file_key, 'data': entry_data}
+        self.is_dirty        = True
+
+        return
+
+    def prune(self, fullnames):
+
+        # Forget about files that were removed from music directory since last scan
+        for fullname in list(self.index.keys()):
+
+            if fullname not in fullnames:
+
+                del self.index[fullname]
+                self.is_dirty = True
+
+        used_entries = set(entry['key'][2] + self.ENTRY_SUFFIX for entry in self.index.values())
+
+        for filename in os.listdir(self.cache_dir):
+
+            if filename.endswith(self.ENTRY_SUFFIX) and filename != self.INDEX_FILENAME and filename not in used_entries:
+
+                os.remove(os.path.join(self.cache_dir, filename))
+
+        return
+
+    def save(self):
+
+        if self.is_dirty == False:
+            return
+
+        try:
+
+            self.__write_file__(os.path.join(self.cache_dir, self.INDEX_FILENAME), self.index)
+            self.is_dirty = False
+
+            log(INFO, 'Saved MIDI cache with {} entries'.format(len(self.index)))
+
+        except OSError as error:
+
+            log(WARNING, 'Cannot save MIDI cache; {}'.format(error))
+
+        return
+
+    def invalidate(self):
+
+        log(INFO, 'Invalidating MIDI cache in {} directory'.format(self.cache_dir))
+
+        self.index    = {}
+        self.is_dirty = False
+
+        for filename in os.listdir(self.cache_dir):
+
+            if filename.endswith(self.ENTRY_SUFFIX):
+
+                os.remove(os.path.join(self.cache_dir, filename))
+
+        return
+
+    def print_status(self):
+
+        print('MIDI cache directory: {}'.format(self.cache_dir ))
+        print('MIDI cache entries  : {}'.format(len(self.index)))
+        print('MIDI cache hits     : {}'.format(self.hits_count))
+
+        return
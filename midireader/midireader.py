@@ -1,62 +1,277 @@
 import os
+import time
+import threading
+import collections
+import multiprocessing
 
-from mido  import MidiFile
-from log   import *
-from utils import *
+from mido       import MidiFile
+from log        import *
+from utils      import *
+from .midicache import MidiCache
 
 
 class MidiReader:
 
-    def __init__(self, music_dir):
+    SLOWEST_FILES_COUNT = 5
+
+    def __init__(self, music_dir, cache_dir = None, scan_workers = 1, events_cache_size = 0):
 
         log(INFO, 'Setting up MIDI reader')
 
-        self.files            = []
-        self.files_count      = 0
-        self.play_in_progress = False
-        self.play_file_index  = -1
-        self.play_event_index = -1
+        self.files             = []
+        self.files_count       = 0
+        self.parse_times       = {}
+        self.events_cache      = collections.OrderedDict()
+        self.events_cache_size = events_cache_size * 1024
+        self.events_cache_used = 0
+        self.events_cache_lock = threading.RLock()
+        self.play_in_progress  = False
+        self.play_file_index   = -1
+        self.play_event_index  = -1
+        self.play_events       = None
+
+        if cache_dir:
+            self.cache = MidiCache(cache_dir)
+        else:
+            self.cache = None
 
         log(INFO, 'Scanning {} directory for MIDI files'.format(music_dir))
 
+        fullnames  = []
+        files_data = {}
+        files_keys = {}
+        start_time = time.monotonic()
+
         for dirname, dirnames, filenames in sorted(os.walk(music_dir)):
 
             for filename in sorted(filenames):
 
                 fullname = os.path.join(dirname, filename)
-                data     = MidiFile(fullname, clip = True)
-                tempo    = midi.get_midi_file_tempo (data)
-                events   = midi.get_midi_file_events(data)
-                length   = int(data.length)
 
-                if data.type == 2:
+                fullnames.append(fullname)
 
-                    log(WARNING, 'Dropping {}, as of unsupported MIDI type 2'.format(filename))
+                if self.cache is not None:
 
-                elif tempo == 0:
+                    files_keys[fullname] = self.cache.get_file_key(fullname)
+                    file_data            = self.cache.lookup(fullname, files_keys[fullname])
 
-                    log(WARNING, 'Dropping {}, as no valid tempo was found'.format(filename))
+                    if file_data is not None:
+                        files_data[fullname] = file_data
 
-                elif len(events) == 0:
+        parsed_names = [fullname for fullname in fullnames if fullname not in files_data]
 
-                    log(WARNING, 'Dropping {}, as no events were found'.format(filename))
+        for fullname, (file_data, parse_time) in zip(parsed_names, self.__parse_files__(parsed_names, scan_workers)):
 
-                else:
+            log(DEBUG, 'Parsed {} in {:.3f} s'.format(fullname, parse_time))
+
+            files_data      [fullname] = file_data
+            self.parse_times[fullname] = parse_time
+
+            if self.cache is not None:
+                self.cache.store(fullname, files_keys[fullname], file_data)
+
+        # Register files in sorted order, whatever the way they were parsed, so that indexes never change
+        for fullname in fullnames:
+
+            self.__register_file__(fullname, files_data[fullname])
+
+        if self.cache is not None:
+
+            self.cache.prune(fullnames)
+            self.cache.save ()
+
+        log(INFO, 'Found {} MIDI files, parsed {}, registered {} in {:.3f} s'.format(len(fullnames), len(parsed_names), self.files_count, time.monotonic() - start_time))
+
+        self.__log_slowest_files__()
+
+        return
+
+    @staticmethod
+    def __parse_files__(fullnames, scan_workers):
+
+        if scan_workers == 0:
+            scan_workers = os.cpu_count() or 1
+
+        scan_workers = min(scan_workers, len(fullnames))
+
+        if scan_workers <= 1:
+
+            return [MidiReader.__parse_timed_file__(fullname) for fullname in fullnames]
+
+        log(INFO, 'Parsing {} MIDI files with {} processes'.format(len(fullnames), scan_workers))
+
+        # Processes get spawned rather than forked, as other threads (e.g. display animation) may run already,
+        # and a forked process only gets the calling one, whatever locks the others hold. Results come back
+        # in the same order as input names, whatever the order processes complete in.
+        context = multiprocessing.get_context('spawn')
+
+        with context.Pool(processes = scan_workers, initializer = log_init, initargs = (log_get_level(),)) as pool:
+
+            return pool.map(MidiReader.__parse_timed_file__, fullnames, chunksize = 1)
+
+    @staticmethod
+    def __parse_timed_file__(fullname):
+
+        start_time = time.monotonic()
+        file_data  = MidiReader.__parse_file__(fullname)
+
+        return file_data, time.monotonic() - start_time
+
+    def __log_slowest_files__(self):
 
-                    file_data = {}
+        slowest_files = sorted(self.parse_times.items(), key = lambda item: item[1], reverse = True)
 
-                    file_data['name'       ]  = filename
-                    file_data['tempo'      ]  = tempo
-                    file_data['length'     ]  = length
-                    file_data['events'     ]  = events
-                    file_data['events_count'] = len(events)
+        for fullname, parse_time in slowest_files[:self.SLOWEST_FILES_COUNT]:
 
-                    log(INFO, 'Registered file #{}: {}'.format(self.files_count, filename))
+            log(INFO, 'Slow parsing: {:.3f} s for {}'.format(parse_time, fullname))
 
-                    self.files.append(file_data)
-                    self.files_count += 1
+        return
+
+    @staticmethod
+    def __parse_file__(fullname):
+
+        log(DEBUG, 'Parsing MIDI file {}'.format(fullname))
+
+        data = MidiFile(fullname, clip = True)
+
+        # Type 2 files cannot be merged into a single stream of events; they get dropped anyway
+        if data.type == 2:
+            events = midi.MidiEvents()
+        else:
+            events = midi.get_midi_file_events(data)
+
+        file_data = {}
+
+        file_data['name'  ] = os.path.basename(fullname)
+        file_data['type'  ] = data.type
+        file_data['tempo' ] = midi.get_midi_file_tempo(data)
+        file_data['length'] = int(events.get_length())
+        file_data['events'] = events
+
+        file_data['events_count'] = len(events)
+
+        return file_data
+
+    def __register_file__(self, fullname, file_data):
+
+        filename = file_data['name']
+
+        if file_data['type'] == 2:
+
+            log(WARNING, 'Dropping {}, as of unsupported MIDI type 2'.format(filename))
 
-        log(INFO, 'Found & parsed {} MIDI files'.format(self.files_count))
+        elif file_data['tempo'] == 0:
+
+            log(WARNING, 'Dropping {}, as no valid tempo was found'.format(filename))
+
+        elif file_data['events_count'] == 0:
+
+            log(WARNING, 'Dropping {}, as no events were found'.format(filename))
+
+        else:
+
+            # Only keep metadata: events are loaded on demand, when the file is about to be played
+            file_info = {}
+
+            file_info['name'        ] = filename
+            file_info['fullname'    ] = fullname
+            file_info['tempo'       ] = file_data['tempo']
+            file_info['length'      ] = file_data['length']
+            file_info['events_count'] = file_data['events_count']
+
+            log(INFO, 'Registered file #{}: {}'.format(self.files_count, filename))
+
+            self.files.append(file_info)
+            self.files_count += 1
+
+        return
+
+    def __load_events__(self, index):
+
+        fullname = self.files[index]['fullname']
+        events   = None
+
+        if self.cache is not None:
+            events = self.cache.load_events(fullname)
+
+        if events is None:
+
+            log(INFO, 'Parsing again file #{}: {}'.format(index, self.files[index]['name']))
+
+            file_data = self.__parse_file__(fullname)
+            events    = file_data['events']
+
+            if self.cache is not None:
+
+                self.cache.store(fullname, self.cache.get_file_key(fullname), file_data)
+                self.cache.save ()
+
+        return events
+
+    def __get_file_events__(self, index):
+
+        with self.events_cache_lock:
+
+            if index in self.events_cache:
+
+                self.events_cache.move_to_end(index)
+
+                return self.events_cache[index]
+
+            log(DEBUG, 'Loading events of file #{}'.format(index))
+
+            events      = self.__load_events__(index)
+            events_size = events.get_size()
+
+            self.events_cache[index] = events
+            self.events_cache_used  += events_size
+
+            # Evict least recently used files until memory budget is met, always keeping the newest one
+            while self.events_cache_used > self.events_cache_size and len(self.events_cache) > 1:
+
+                evicted_index, evicted_events = self.events_cache.popitem(last = False)
+                self.events_cache_used       -= evicted_events.get_size()
+
+                log(DEBUG, 'Evicted events of file #{} from memory'.format(evicted_index))
+
+        return events
+
+    def get_file_events(self, index):
+
+        # Load file events if not in memory yet, which may take a while: not to be called while playing
+        # on the file player thread, but e.g. on a background thread preparing next file to play
+        if not 0 <= index < self.files_count:
+
+            log(ERROR, 'Cannot get MIDI file events; out of range index: {}'.format(index))
+            return None
+
+        return self.__get_file_events__(index)
+
+    def prefetch_file(self, index):
+
+        if not 0 <= index < self.files_count:
+
+            log(ERROR, 'Cannot prefetch file; out of range index: {}'.format(index))
+
+        else:
+
+            log(DEBUG, 'Prefetching file #{}'.format(index))
+
+            prefetch_thread = threading.Thread(target = self.__get_file_events__, name = 'midi_prefetch', args = [index], daemon = True)
+            prefetch_thread.start()
+
+        return
+
+    def invalidate_cache(self):
+
+        if self.cache is None:
+
+            log(WARNING, 'Cannot invalidate MIDI cache; no cache in use')
+
+        else:
+
+            # Files will be parsed again on next startup
+            self.cache.invalidate()
 
         return
 
@@ -100,6 +315,7 @@ class MidiReader:
 
             log(INFO, 'Starting playing file #{}: {}'.format(index, file_data['name']))
 
+            self.play_events      = self.__get_file_events__(index)
             self.play_in_progress = True
             self.play_file_index  = index
             self.play_event_index  = 0
@@ -107,8 +323,13 @@ class MidiReader:
 
         return return_status
 
+    def get_playing_events(self):
+
+        return self.play_events
+
     def get_playing_event(self):
 
+        # Returned event is an index in playing events, as returned by get_playing_events()
         return_status = True
         return_event  = None
 
@@ -124,7 +345,7 @@ class MidiReader:
 
                 log(DEBUG, 'Do step #{} on file #{}'.format(self.play_event_index, self.play_file_index))
 
-                return_event           = file_data['events'][self.play_event_index]
+                return_event           = self.play_event_index
                 self.play_event_index += 1
                 return_status          = False
 
@@ -152,13 +373,18 @@ class MidiReader:
             self.play_in_progress = False
             self.play_file_index  = -1
             self.play_event_index = -1
+            self.play_events      = None
             return_status         = True
 
         return return_status
 
     def print_status(self):
 
+        if self.cache is not None:
+            self.cache.print_status()
+
         print('Total files count: {}'.format(self.files_count     ))
+        print('Events in memory : {} files, {} / {} KB'.format(len(self.events_cache), int(self.events_cache_used / 1024), int(self.events_cache_size / 1024)))
         print('Play file index  : {}'.format(self.play_file_index ))
         print('Play event index : {}'.format(self.play_event_index))
 
@@ -178,6 +404,20 @@ class MidiReader:
 
         return
 
+    def print_parse_times(self):
+
+        if len(self.parse_times) == 0:
+
+            print('No MIDI file parsed at startup; all files were found in cache')
+
+        else:
+
+            for fullname, parse_time in sorted(self.parse_times.items(), key = lambda item: item[1], reverse = True):
+
+                print('{:7.3f} s : {}'.format(parse_time, fullname))
+
+        return
+
     def print_file_info(self, index):
 
         if not 0 <= index < self.files_count:
@@ -210,18 +450,20 @@ class MidiReader:
 
             print('File #{}: {}'.format(index, file_data['name']))
 
-            for event in file_data['events']:
+            events = self.__get_file_events__(index)
+
+            for event_index in range(0, len(events)):
 
-                if event['type'] ==  IS_PAUSE:
+                if events.get_kind(event_index) ==  IS_PAUSE:
 
-                    print('\tPause: {}'.format(event['value']))
+                    print('\tPause: {}'.format(events.get_pause(event_index)))
 
                 # Event is a single note, or several notes
                 else:
 
                     print('\tNotes: ', end='', flush=True)
 
-                    for note in event['value']:
+                    for note in events.get_notes(event_index):
                         print('{} '.format(get_note_name_from_midi_number(note)), end='', flush=True)
 
                     print('')
@@ -0,0 +1,294 @@
+import os
+import time
+import collections
+
+import i2c
+import ioextender
+import xylophone
+import controller
+import simulation
+
+from globals import *
+from utils   import *
+from log     import *
+
+
+class RenderButton:
+
+    # Inert button, only holding the state controller gives it: never read while rendering, it must not
+    # register encoder callbacks on simulated GPIOs, as these would never be cancelled & share input script.
+
+    def __init__(self, state = None):
+
+        self.state = state
+
+        return
+
+    def set_state(self, state):
+
+        self.state = state
+
+        return
+
+    def get_state(self):
+
+        return self.state
+
+    def was_clicked(self):
+
+        return False
+
+    def set_listener(self, listener):
+
+        return
+
+
+class Renderer:
+
+    """
+    Render a track offline: play it through actual Controller, Xylophone & IoExtender code, but on
+    simulated extenders & a virtual clock, so that it takes no longer than computing it, and log
+    every I2C register write, as (time, extender address, register, value), time starting at 0.
+
+    Also dry run tracks: play them the same way, on quiet extenders, either N times faster than
+    actual time or as fast as possible, and only report events counts & compute time per event.
+    """
+
+    def __init__(self, setup_data, midi_reader, output_dir):
+
+        log(INFO, 'Setting up track renderer')
+
+        self.setup_data  = setup_data
+        self.midi_reader = midi_reader
+        self.output_dir  = output_dir
+
+        return
+
+    def __build_controller__(self):
+
+        setup_data = self.setup_data
+
+        notes_map    = xylophone.NotesMap.from_setup(setup_data)
+        io_extenders = [ioextender.IoExtender(bus, address, USE_SIMULATION) for bus, address in notes_map.extenders]
+
+        xylophone_device = xylophone.Xylophone(notes_map, setup_data['XYLOPHONE_MAX_SIM_NOTES'], io_extenders)
+
+        # Buttons are never read, but controller keeps them up to date
+        render_controller = controller.Controller(RenderButton(), RenderButton(), RenderButton(), self.midi_reader, xylophone_device, None)
+
+        # Strikes always land right on time on a virtual clock: no use dumping that
+        render_controller.jitter.dump_dir = None
+
+        return render_controller
+
+    @staticmethod
+    def __get_summary__(writes):
+
+        summary = {'writes_count': len(writes), 'duration': 0.0, 'mean_rate': 0.0, 'peak_rate': 0}
+
+        if len(writes) == 0:
+            return summary
+
+        # Count writes within each second of the track
+        per_second = collections.Counter(int(write[0]) for write in writes)
+
+        summary['duration' ] = writes[-1][0]
+        summary['mean_rate'] = len(writes) / max(writes[-1][0], 1.0)
+        summary['peak_rate'] = max(per_second.values())
+
+        return summary
+
+    def render(self, index, filename = None):
+
+        # Return rendering summary, or None if track could not be rendered
+        if not 0 <= index < self.midi_reader.get_files_count():
+
+            log(ERROR, 'Cannot render track; out of range index: {}'.format(index))
+            return None
+
+        track_name, track_tempo, track_length = self.midi_reader.get_file_info(index)
+
+        if filename is None:
+            filename = os.path.join(self.output_dir, '{}.txt'.format(os.path.splitext(track_name)[0]))
+
+        log(INFO, 'Rendering track #{}: {} to {}'.format(index, track_name, filename))
+
+        clock            = VirtualClock()
+        trace            = simulation.Trace(None)
+        metrics          = i2c.I2cMetrics()
+        previous_clock   = set_clock(clock)
+        previous_trace   = simulation.set_trace(trace)
+        previous_metrics = i2c.set_metrics(metrics)
+
+        try:
+
+            render_controller = self.__build_controller__()
+
+            # Only log track writes, from track start, not extenders setup
+            trace.clear()
+            metrics.clear()
+            clock.current_time = 0.0
+
+            # Rendering time is measured on actual time, of course
+            render_start_time = time.monotonic()
+            render_controller.play_track_in_place(index)
+            render_time       = time.monotonic() - render_start_time
+
+        finally:
+
+            set_clock(previous_clock)
+            simulation.set_trace(previous_trace)
+            i2c.set_metrics(previous_metrics)
+
+        writes = [(entry[0], entry[3], entry[4], entry[5]) for entry in trace.get_entries(simulation.Trace.INTERFACE_I2C)]
+
+        try:
+
+            directory = os.path.dirname(filename)
+
+            if directory != '':
+                os.makedirs(directory, exist_ok = True)
+
+            with open(filename, 'w') as render_file:
+
+                for write_time, address, register, value in writes:
+                    render_file.write('{:.6f} 0x{:02X} 0x{:02X} 0x{:02X}\n'.format(write_time, address, register, value))
+
+        except OSError as error:
+
+            log(ERROR, 'Cannot write rendered track; {}'.format(error))
+            return None
+
+        summary                  = self.__get_summary__(writes)
+        summary['render_time'  ] = render_time
+        summary['peak_bus_load'] = metrics.get_peak_load()
+        summary['mean_bus_load'] = metrics.get_playback_load()[0]
+
+        log(INFO, 'Rendered {} I2C writes over {:.3f} s in {:.3f} s'.format(summary['writes_count'], summary['duration'], render_time))
+
+        return summary
+
+    @staticmethod
+    def print_summary(summary):
+
+        print('I2C writes count : {}'      .format(summary['writes_count']))
+        print('Track duration   : {:.3f} s'.format(summary['duration'    ]))
+        print('Mean writes rate : {:.1f}/s'.format(summary['mean_rate'   ]))
+        print('Peak writes rate : {}/s'    .format(summary['peak_rate'   ]))
+        print('Mean I2C bus load: {:.1f} %'.format(summary['mean_bus_load'] * 100))
+        print('Peak I2C bus load: {:.1f} %'.format(summary['peak_bus_load'] * 100))
+        print('Render time      : {:.3f} s'.format(summary['render_time' ]))
+
+        return
+
+    def dry_run(self, index = None, speed = 0):
+
+        # Dry run a track, or all tracks if no index is given, speed times faster than actual time, or
+        # on a virtual clock if speed is 0; return dry run report, or None if index is out of range
+        tracks_count = self.midi_reader.get_files_count()
+
+        if index is None:
+
+            indexes = range(0, tracks_count)
+
+        elif 0 <= index < tracks_count:
+
+            indexes = [index]
+
+        else:
+
+            log(ERROR, 'Cannot dry run track; out of range index: {}'.format(index))
+            return None
+
+        if speed > 0:
+            clock = ScaledClock(speed)
+        else:
+            clock = VirtualClock()
+
+        log(INFO, 'Dry running {} track(s) at {}'.format(len(indexes), 'x{}'.format(speed) if speed > 0 else 'full speed'))
+
+        report = {'tracks_count'      : 0,
+                  'failures_count'    : 0,
+                  'events_count'      : 0,
+                  'strikes_count'     : 0,
+                  'truncations_count' : 0,
+                  'out_of_range_count': 0,
+                  'staggered_count'   : 0,
+                  'restrikes_count'   : 0,
+                  'track_time'        : 0.0,
+                  'compute_time'      : 0.0,
+                  'run_time'          : 0.0}
+
+        previous_clock   = set_clock(clock)
+        previous_trace   = simulation.set_trace(simulation.Trace(0))
+        previous_metrics = i2c.set_metrics(i2c.I2cMetrics())
+
+        try:
+
+            dry_run_controller = self.__build_controller__()
+
+            # Quiet extenders only update their shadow registers: no bus traffic at all
+            for io_extender in dry_run_controller.xylophone.io_extenders:
+                io_extender.enter_quiet_mode()
+
+            for track_index in indexes:
+
+                dry_run_controller.played_plan = None
+
+                # Busy waiting is no computing: only a scaled clock ever busy waits
+                track_start_time = clock.monotonic()
+                run_start_time   = time.monotonic()
+                cpu_start_time   = time.thread_time()
+                spin_start_time  = getattr(clock, 'spin_time', 0.0)
+
+                dry_run_controller.play_track_in_place(track_index)
+
+                compute_time = time.thread_time() - cpu_start_time - (getattr(clock, 'spin_time', 0.0) - spin_start_time)
+                run_time     = time.monotonic() - run_start_time
+                track_time   = clock.monotonic() - track_start_time
+                plan         = dry_run_controller.played_plan
+
+                if plan is None:
+
+                    report['failures_count'] += 1
+                    continue
+
+                report['tracks_count'      ] += 1
+                report['events_count'      ] += len(plan)
+                report['strikes_count'     ] += plan.strikes_count
+                report['truncations_count' ] += plan.truncations_count
+                report['out_of_range_count'] += plan.out_of_range_count
+                report['staggered_count'   ] += plan.staggered_count
+                report['restrikes_count'   ] += sum(dry_run_controller.restrikes_report.values())
+                report['track_time'        ] += track_time
+                report['compute_time'      ] += compute_time
+                report['run_time'          ] += run_time
+
+                log(INFO, 'Dry ran track #{}: {} events, {} truncated chords, {} out of range notes, {:.1f} us per event'.format(track_index, len(plan), plan.truncations_count, plan.out_of_range_count, compute_time * 1000000 / max(len(plan), 1)))
+
+        finally:
+
+            set_clock(previous_clock)
+            simulation.set_trace(previous_trace)
+            i2c.set_metrics(previous_metrics)
+
+        return report
+
+    @staticmethod
+    def print_dry_run_report(report):
+
+        event_time = report['compute_time'] * 1000000 / max(report['events_count'], 1)
+
+        print('Tracks count     : {} ({} failed)'.format(report['tracks_count'], report['failures_count']))
+        print('Events count     : {}'            .format(report['events_count'      ]))
+        print('Strikes count    : {}'            .format(report['strikes_count'     ]))
+        print('Truncated chords : {}'            .format(report['truncations_count' ]))
+        print('Out of range     : {}'            .format(report['out_of_range_count']))
+        print('Staggered chords : {}'            .format(report['staggered_count'   ]))
+        print('Re-strikes       : {}'            .format(report['restrikes_count'   ]))
+        print('Tracks duration  : {:.3f} s'      .format(report['track_time'        ]))
+        print('Run time         : {:.3f} s'      .format(report['run_time'          ]))
+        print('Compute time     : {:.3f} s'      .format(report['compute_time'      ]))
+        print('Time per event   : {:.1f} us'     .format(event_time                   ))
+
+        return
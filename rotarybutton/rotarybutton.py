@@ -37,6 +37,10 @@ class RotaryButton:
 
         return return_value
 
+    def set_listener(self, listener):
+
+        self.encoder.set_listener(listener)
+
     def is_pressed(self):
 
         return self.encoder.is_pressed()
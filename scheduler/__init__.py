@@ -0,0 +1,2 @@
+from .scheduler import Scheduler
+from .jitter    import JitterRecorder
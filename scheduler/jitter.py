@@ -0,0 +1,182 @@
+import os
+import array
+import time
+
+from log import *
+
+
+class JitterRecorder:
+
+    # Record, for every strike, how late the output latches write returned compared to its scheduled
+    # time, and how long after the first IO extender the last one got written (inter chip skew).
+    # Storage is allocated once per track, so that recording is just a subtraction & a store.
+
+    PERCENTILES = [50, 95, 99]
+
+    # Histogram buckets upper bounds, in seconds; last bucket gets anything above
+    HISTOGRAM_BOUNDS = [0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.010, 0.020, 0.050]
+
+    def __init__(self, dump_dir = None):
+
+        log(INFO, 'Setting up jitter recorder')
+
+        self.dump_dir = dump_dir
+        self.name     = None
+        self.engine   = None
+        self.lateness = array.array('d')
+        self.skews    = array.array('d')
+        self.count    = 0
+        self.summary  = None
+
+        return
+
+    def start(self, name, engine, capacity):
+
+        self.name     = name
+        self.engine   = engine
+        self.lateness = array.array('d', bytes(8 * capacity))
+        self.skews    = array.array('d', bytes(8 * capacity))
+        self.count    = 0
+        self.summary  = None
+
+        return
+
+    def record(self, scheduled_time, actual_time, skew = 0.0):
+
+        if self.count < len(self.lateness):
+
+            self.lateness[self.count] = actual_time - scheduled_time
+            self.skews   [self.count] = skew
+            self.count               += 1
+
+        return
+
+    def stop(self):
+
+        values = sorted(self.lateness[:self.count])
+
+        if len(values) == 0:
+
+            self.summary = None
+            return
+
+        summary = {}
+
+        summary['count'] = len(values)
+        summary['mean' ] = sum(values) / len(values)
+        summary['max'  ] = values[-1]
+
+        for percentile in self.PERCENTILES:
+            summary['p{}'.format(percentile)] = values[min(len(values) - 1, (len(values) * percentile) // 100)]
+
+        histogram = [0] * (len(self.HISTOGRAM_BOUNDS) + 1)
+
+        for value in values:
+
+            bucket = 0
+
+            while bucket < len(self.HISTOGRAM_BOUNDS) and value > self.HISTOGRAM_BOUNDS[bucket]:
+                bucket += 1
+
+            histogram[bucket] += 1
+
+        summary['histogram'] = histogram
+
+        # Skew only makes sense for chords spanning several IO extenders
+        skews = [skew for skew in self.skews[:self.count] if skew > 0]
+
+        summary['skewed_count'] = len(skews)
+        summary['skew_mean'   ] = sum(skews) / len(skews) if len(skews) != 0 else 0.0
+        summary['skew_max'    ] = max(skews, default = 0.0)
+
+        self.summary = summary
+
+        log(INFO, 'Strikes lateness: mean {:.3f} ms / p99 {:.3f} ms / max {:.3f} ms'.format(summary['mean'] * 1000, summary['p99'] * 1000, summary['max'] * 1000))
+
+        if summary['skewed_count'] != 0:
+            log(INFO, 'Inter chip skew: mean {:.3f} ms / max {:.3f} ms over {} chords'.format(summary['skew_mean'] * 1000, summary['skew_max'] * 1000, summary['skewed_count']))
+
+        return
+
+    def __get_summary_lines__(self):
+
+        lines = []
+
+        lines.append('Track   : {}'.format(self.name  ))
+        lines.append('Engine  : {}'.format(self.engine))
+
+        if self.summary is None:
+
+            lines.append('No strike recorded')
+
+            return lines
+
+        lines.append('Strikes : {}'.format(self.summary['count']))
+        lines.append('Mean    : {:8.3f} ms'.format(self.summary['mean'] * 1000))
+
+        for percentile in self.PERCENTILES:
+            lines.append('p{:<7}: {:8.3f} ms'.format(percentile, self.summary['p{}'.format(percentile)] * 1000))
+
+        lines.append('Max     : {:8.3f} ms'.format(self.summary['max'] * 1000))
+        lines.append('Histogram:')
+
+        lower_bound = '-inf'
+
+        for bucket, count in enumerate(self.summary['histogram']):
+
+            if bucket < len(self.HISTOGRAM_BOUNDS):
+                upper_bound = '{:g}'.format(self.HISTOGRAM_BOUNDS[bucket] * 1000)
+            else:
+                upper_bound = '+inf'
+
+            lines.append('  {:>6} .. {:>6} ms : {:6d}'.format(lower_bound, upper_bound, count))
+
+            lower_bound = upper_bound
+
+        lines.append('Skewed  : {}'.format(self.summary['skewed_count']))
+        lines.append('Skew    : {:8.3f} ms mean, {:8.3f} ms max'.format(self.summary['skew_mean'] * 1000, self.summary['skew_max'] * 1000))
+
+        return lines
+
+    def print_summary(self):
+
+        for line in self.__get_summary_lines__():
+            print(line)
+
+        return
+
+    def dump(self):
+
+        if not self.dump_dir:
+            return
+
+        os.makedirs(self.dump_dir, exist_ok = True)
+
+        filename = '{} - {}.txt'.format(time.strftime('%Y%m%d-%H%M%S'), os.path.splitext(self.name)[0])
+        fullname = os.path.join(self.dump_dir, filename)
+
+        try:
+
+            with open(fullname, 'w') as dump_file:
+
+                for line in self.__get_summary_lines__():
+                    dump_file.write(line + '\n')
+
+                # Then raw values, one per strike, in microseconds
+                dump_file.write('Lateness (us):\n')
+
+                for value in self.lateness[:self.count]:
+                    dump_file.write('{}\n'.format(int(value * 1000000)))
+
+                dump_file.write('Inter chip skew (us):\n')
+
+                for value in self.skews[:self.count]:
+                    dump_file.write('{}\n'.format(int(value * 1000000)))
+
+            log(INFO, 'Dumped strikes jitter to {}'.format(fullname))
+
+        except OSError as error:
+
+            log(WARNING, 'Cannot dump strikes jitter; {}'.format(error))
+
+        return
@@ -0,0 +1,266 @@
+import asyncio
+import threading
+
+from log     import *
+from utils   import *
+from globals import *
+
+
+class Scheduler:
+
+    # Absolute deadline scheduler: each notes event deadline is computed from the track start,
+    # scaled by the tempo ratio, rather than by adding up pauses after the previous strike. Time
+    # spent writing notes, logging or just being late to wake up is thus absorbed, not accumulated.
+
+    # Weight of the last measured sleep overshoot, in its running estimate
+    OVERSHOOT_WEIGHT = 0.1
+
+    # Lateness above which a notes event is reported
+    LATENESS_WARNING = 0.010
+
+    def __init__(self, condition = None, is_interrupted = None):
+
+        log(INFO, 'Setting up Scheduler')
+
+        # Waits are done on that condition, so that they can be interrupted as soon as it gets notified
+        # & is_interrupted() returns True; schedule changes are also done holding that condition's lock
+        if condition is None:
+            condition = threading.Condition()
+
+        if is_interrupted is None:
+            is_interrupted = lambda: False
+
+        self.condition      = condition
+        self.is_interrupted = is_interrupted
+
+        # Incremented on each tempo change, so that a wait can tell its deadline moved
+        self.rebases_count = 0
+
+        self.origin_time       = 0.0
+        self.origin_track_time = 0.0
+        self.track_time        = 0.0
+        self.tempo_ratio       = 1.0
+        self.sleep_overshoot   = 0.0
+
+        # Waits end busy waiting, unless someone else (e.g. a writer thread) takes care of accuracy
+        self.spin_time = control.spin_time
+
+        return
+
+    def set_busy_waiting(self, is_busy_waiting):
+
+        if is_busy_waiting == True:
+            self.spin_time = control.spin_time
+        else:
+            self.spin_time = 0.0
+
+        return
+
+    def start(self, tempo_ratio, origin_time = None):
+
+        # Track may start on a given time, e.g. to continue the timeline of the previous track, but never
+        # in the past: notes would otherwise rush to catch up
+        current_time = get_clock().monotonic()
+
+        if origin_time is None or origin_time < current_time:
+            origin_time = current_time
+
+        self.origin_time       = origin_time
+        self.origin_track_time = 0.0
+        self.track_time        = 0.0
+        self.tempo_ratio       = tempo_ratio
+
+        return
+
+    def advance(self, duration):
+
+        # Duration is in track time, that is before applying tempo ratio
+        self.track_time += duration
+
+        return
+
+    def get_track_position(self, current_time):
+
+        return self.origin_track_time + (current_time - self.origin_time) / self.tempo_ratio
+
+    def get_position_time(self, track_position):
+
+        # Time a track position gets played at, at current tempo ratio
+        with self.condition:
+
+            return self.origin_time + (track_position - self.origin_track_time) * self.tempo_ratio
+
+    def set_tempo_ratio(self, tempo_ratio):
+
+        with self.condition:
+
+            if tempo_ratio == self.tempo_ratio:
+                return
+
+            # Rebase schedule on current position, so that tempo change only applies to what is still to be
+            # played: the elapsed part of the current pause is kept, its remaining part & later ones rescaled.
+            current_time = get_clock().monotonic()
+
+            self.origin_track_time = self.get_track_position(current_time)
+            self.origin_time       = current_time
+            self.tempo_ratio       = tempo_ratio
+            self.rebases_count    += 1
+
+            # Wake up any wait, so that it computes its deadline again
+            self.condition.notify_all()
+
+        return
+
+    def get_deadline(self):
+
+        with self.condition:
+
+            return self.origin_time + (self.track_time - self.origin_track_time) * self.tempo_ratio
+
+    def __sleep__(self, duration, rebases_count = None):
+
+        # Return True if sleep was interrupted or schedule got rebased (since given rebases count, if any),
+        # False if full duration elapsed
+        with self.condition:
+
+            if rebases_count is None:
+                rebases_count = self.rebases_count
+
+            return get_clock().wait_for(self.condition, lambda: self.is_interrupted() or self.rebases_count != rebases_count, duration)
+
+    def sleep(self, duration):
+
+        # Return True if sleep was interrupted, False if full duration elapsed, whatever tempo changes
+        wake_up_time = get_clock().monotonic() + duration
+
+        while duration > 0:
+
+            if self.__sleep__(duration) == True and self.is_interrupted() == True:
+                return True
+
+            duration = wake_up_time - get_clock().monotonic()
+
+        return False
+
+    def sleep_until_position(self, track_position):
+
+        # Return True if sleep was interrupted, False once given track position got played: a tempo change
+        # meanwhile rescales what remains of the sleep, as it does deadlines
+        while True:
+
+            with self.condition:
+
+                rebases_count = self.rebases_count
+                duration      = self.get_position_time(track_position) - get_clock().monotonic()
+
+            if duration <= 0:
+                return False
+
+            if self.__sleep__(duration, rebases_count) == True and self.is_interrupted() == True:
+                return True
+
+    def wait(self):
+
+        # Wait for current notes event deadline, computed again each time a tempo change moves it
+        while True:
+
+            lateness = self.wait_until(self.get_deadline())
+
+            if lateness is not None or self.is_interrupted() == True:
+                return lateness
+
+    def __finish_wait__(self, deadline):
+
+        # Busy wait the very last part, as no sleep is that accurate, and return lateness on deadline
+        clock = get_clock()
+
+        if self.spin_time > 0:
+            clock.spin_until(deadline)
+
+        lateness = clock.monotonic() - deadline
+
+        if lateness > self.LATENESS_WARNING:
+            log(DEBUG, 'Scheduler late on deadline by {:.3f} s'.format(lateness))
+
+        return lateness
+
+    def __learn_overshoot__(self, wake_up_time):
+
+        # Learn how late the OS usually wakes us up, to go to sleep that much earlier next time
+        overshoot             = get_clock().monotonic() - wake_up_time
+        self.sleep_overshoot += (overshoot - self.sleep_overshoot) * self.OVERSHOOT_WEIGHT
+
+        return
+
+    def wait_until(self, deadline):
+
+        # Return lateness on deadline, or None if wait was interrupted or schedule got rebased meanwhile
+        clock          = get_clock()
+        remaining_time = deadline - clock.monotonic()
+        sleep_time     = remaining_time - self.spin_time - self.sleep_overshoot
+
+        if sleep_time > 0:
+
+            wake_up_time = clock.monotonic() + sleep_time
+
+            if self.__sleep__(sleep_time) == True:
+                return None
+
+            self.__learn_overshoot__(wake_up_time)
+
+        return self.__finish_wait__(deadline)
+
+    async def __sleep_async__(self, duration, wake_up):
+
+        # Same as __sleep__(), from an asyncio task: wake_up event is set on new commands & tempo changes
+        clock         = get_clock()
+        rebases_count = self.rebases_count
+        wake_up_time  = clock.monotonic() + duration
+
+        while self.is_interrupted() == False and self.rebases_count == rebases_count:
+
+            if duration <= 0:
+                return False
+
+            wake_up.clear()
+
+            try:
+                await asyncio.wait_for(wake_up.wait(), duration)
+            except asyncio.TimeoutError:
+                return False
+
+            duration = wake_up_time - clock.monotonic()
+
+        return True
+
+    async def sleep_async(self, duration, wake_up):
+
+        # Same as sleep(), from an asyncio task
+        wake_up_time = get_clock().monotonic() + duration
+
+        while duration > 0:
+
+            if await self.__sleep_async__(duration, wake_up) == True and self.is_interrupted() == True:
+                return True
+
+            duration = wake_up_time - get_clock().monotonic()
+
+        return False
+
+    async def wait_until_async(self, deadline, wake_up):
+
+        # Same as wait_until(), from an asyncio task: only the very last part busy waits, holding up the event loop
+        clock          = get_clock()
+        remaining_time = deadline - clock.monotonic()
+        sleep_time     = remaining_time - self.spin_time - self.sleep_overshoot
+
+        if sleep_time > 0:
+
+            wake_up_time = clock.monotonic() + sleep_time
+
+            if await self.__sleep_async__(sleep_time, wake_up) == True:
+                return None
+
+            self.__learn_overshoot__(wake_up_time)
+
+        return self.__finish_wait__(deadline)
@@ -0,0 +1,4 @@
+from .trace       import Trace, get_trace, set_trace
+from .bus         import SMBus, SpiDev
+from .inputscript import InputScript
+from .            import pigpio
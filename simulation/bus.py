@@ -0,0 +1,137 @@
+import errno
+import random
+import threading
+
+from globals import *
+from utils   import *
+from .trace  import Trace, get_trace
+
+# One lock per simulated bus, as transfers on a same bus can only occur one after another
+bus_locks      = {}
+bus_locks_lock = threading.Lock()
+
+
+def get_bus_lock(interface, bus):
+
+    with bus_locks_lock:
+
+        return bus_locks.setdefault((interface, bus), threading.Lock())
+
+
+# Transfers longer than that sleep, letting other threads run as actual drivers do; shorter ones
+# busy wait, as sleeping is way too coarse for them
+SLEEP_THRESHOLD = 0.001
+
+
+def spend_time(duration):
+
+    clock = get_clock()
+
+    if duration >= SLEEP_THRESHOLD:
+        clock.sleep(duration)
+    else:
+        clock.spin_until(clock.monotonic() + duration)
+
+    return
+
+
+class SMBus:
+
+    # Stand in for smbus.SMBus: registers are kept in memory, and each transfer takes as long as it
+    # would at configured bus clock, on top of a fixed overhead (driver, system call, etc.). Transfers
+    # may fail, at configured rate, as they do on actual hardware (e.g. loose connector, solenoids EMI).
+
+    # Every byte takes 8 bits plus acknowledge; add start, repeated start & stop conditions
+    BITS_PER_BYTE = 9
+    START_BITS    = 1
+    STOP_BITS     = 1
+
+    def __init__(self, bus):
+
+        self.bus       = bus
+        self.lock      = get_bus_lock(Trace.INTERFACE_I2C, bus)
+        self.registers = {}
+
+        return
+
+    def __transfer__(self, bytes_count, start_conditions_count):
+
+        bits_count = bytes_count * self.BITS_PER_BYTE + start_conditions_count * self.START_BITS + self.STOP_BITS
+
+        spend_time(control.simulation_i2c_overhead + bits_count / control.simulation_i2c_clock)
+
+        # Failed transfers take as long, but leave registers untouched
+        if control.simulation_i2c_errors > 0 and random.random() < control.simulation_i2c_errors:
+            raise OSError(errno.EREMOTEIO, 'Remote I/O error (simulated)')
+
+        return
+
+    def read_byte_data(self, address, register):
+
+        with self.lock:
+
+            # Address & register write, then repeated start, address & data read
+            self.__transfer__(4, 2)
+
+            return self.registers.get((address, register), 0x00)
+
+    def write_byte_data(self, address, register, value):
+
+        with self.lock:
+
+            self.__transfer__(3, 1)
+
+            self.registers[(address, register)] = value
+
+            get_trace().record(Trace.INTERFACE_I2C, self.bus, address, register, value)
+
+        return
+
+    def write_i2c_block_data(self, address, register, values):
+
+        with self.lock:
+
+            self.__transfer__(2 + len(values), 1)
+
+            # Registers address auto increments, as in MCP 23017 sequential mode
+            for offset, value in enumerate(values):
+
+                self.registers[(address, register + offset)] = value
+
+                get_trace().record(Trace.INTERFACE_I2C, self.bus, address, register + offset, value)
+
+        return
+
+    def close(self):
+
+        return
+
+
+class SpiDev:
+
+    # Stand in for spidev.SpiDev: frames are just recorded, each one taking as long as it would at
+    # configured maximum speed, on top of a fixed overhead.
+
+    def __init__(self, bus, device):
+
+        self.bus          = bus
+        self.device       = device
+        self.lock         = get_bus_lock(Trace.INTERFACE_SPI, bus)
+        self.mode         = 0
+        self.max_speed_hz = 500000
+
+        return
+
+    def writebytes(self, data):
+
+        with self.lock:
+
+            spend_time(control.simulation_spi_overhead + len(data) * 8 / self.max_speed_hz)
+
+            get_trace().record(Trace.INTERFACE_SPI, self.bus, self.device, None, len(data))
+
+        return
+
+    def close(self):
+
+        return
@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+
+from globals import *
+from log     import *
+from .       import pigpio
+
+
+class InputScript:
+
+    """
+    Play scripted user input on simulated buttons, e.g. to select & play tracks on a headless box.
+
+    Script is a JSON list of steps, each waiting for DELAY seconds, then applying ACTION to BUTTON:
+
+        [{"DELAY": 1.0, "BUTTON": "TRACK", "ACTION": "TURN", "STEPS": 2},
+         {"DELAY": 0.5, "BUTTON": "MODE" , "ACTION": "CLICK"},
+         {"DELAY": 60 , "ACTION": "REPORT"},
+         {"DELAY": 1.0, "ACTION": "EXIT"}]
+
+    REPORT prints player status & last track strikes jitter, e.g. to compare runtimes on a given script.
+    """
+
+    # Pin 1, pin 2 & press pin of each button
+    BUTTONS_PINS = {
+        'MODE' : (MODE_BUTTON_PIN_1 , MODE_BUTTON_PIN_2 , MODE_BUTTON_PIN_PRESS ),
+        'TRACK': (TRACK_BUTTON_PIN_1, TRACK_BUTTON_PIN_2, TRACK_BUTTON_PIN_PRESS),
+        'TEMPO': (TEMPO_BUTTON_PIN_1, TEMPO_BUTTON_PIN_2, TEMPO_BUTTON_PIN_PRESS),
+    }
+
+    # Buttons get polled, so let each step last long enough to be seen on its own
+    EDGE_TIME  = 0.001
+    STEP_TIME  = 0.020
+    PRESS_TIME = 0.050
+
+    def __init__(self, filename, exit_function = None, report_function = None):
+
+        log(INFO, 'Setting up input script from {}'.format(filename))
+
+        with open(filename, 'r') as json_file:
+            self.steps = json.load(json_file)
+
+        self.exit_function   = exit_function
+        self.report_function = report_function
+
+        return
+
+    def __set_levels__(self, pins, levels):
+
+        for pin, level in zip(pins, levels):
+
+            pigpio.set_input(pin, level)
+            time.sleep(self.EDGE_TIME)
+
+        return
+
+    def turn(self, button, steps):
+
+        pin_1, pin_2, pin_press = self.BUTTONS_PINS[button]
+
+        # Go through a full quadrature cycle per step, starting & ending at rest, with both pins high
+        for step in range(0, abs(steps)):
+
+            if steps > 0:
+                self.__set_levels__([pin_1, pin_2, pin_1, pin_2], [0, 0, 1, 1])
+            else:
+                self.__set_levels__([pin_2, pin_1, pin_2, pin_1], [0, 0, 1, 1])
+
+            time.sleep(self.STEP_TIME)
+
+        return
+
+    def click(self, button):
+
+        pin_1, pin_2, pin_press = self.BUTTONS_PINS[button]
+
+        # Press pin is pulled up, and goes low while button is pressed
+        pigpio.set_input(pin_press, 0)
+        time.sleep(self.PRESS_TIME)
+        pigpio.set_input(pin_press, 1)
+
+        return
+
+    def __script_thread__(self):
+
+        for step in self.steps:
+
+            time.sleep(step.get('DELAY', 0))
+
+            action = step.get('ACTION')
+
+            log(INFO, 'Input script: {}'.format(step))
+
+            if action == 'TURN':
+                self.turn(step['BUTTON'], step.get('STEPS', 1))
+            elif action == 'CLICK':
+                self.click(step['BUTTON'])
+            elif action == 'REPORT':
+                if self.report_function is not None:
+                    self.report_function()
+            elif action == 'EXIT':
+                if self.exit_function is not None:
+                    self.exit_function(0)
+            elif action is not None:
+                log(ERROR, 'Input script: unknown action {}'.format(action))
+
+        log(INFO, 'Input script done')
+
+        return
+
+    def start(self):
+
+        script_thread = threading.Thread(target = self.__script_thread__, name = 'input_script', args = [], daemon = True)
+        script_thread.start()
+
+        return
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from .trace import Trace, get_trace
+
+"""
+Stand in for pigpio module, for the few functions used here. As with the actual pigpio daemon,
+GPIO levels are shared by all pi instances. Inputs levels are driven by set_input(), e.g. from an
+input script, and trigger registered callbacks, as actual edges would.
+"""
+
+INPUT  = 0
+OUTPUT = 1
+
+PUD_OFF  = 0
+PUD_DOWN = 1
+PUD_UP   = 2
+
+RISING_EDGE  = 0
+FALLING_EDGE = 1
+EITHER_EDGE  = 2
+
+levels     = {}
+callbacks  = []
+lock       = threading.RLock()
+start_time = time.monotonic()
+
+
+def __get_tick__():
+
+    # Microseconds since start, wrapping as pigpio's 32 bits ticks do
+    return int((time.monotonic() - start_time) * 1000000) & 0xFFFFFFFF
+
+
+def set_input(gpio, level):
+
+    with lock:
+
+        if levels.get(gpio) == level:
+            return
+
+        levels[gpio] = level
+        tick         = __get_tick__()
+
+        for callback_gpio, edge, function in list(callbacks):
+
+            if callback_gpio == gpio and (edge == EITHER_EDGE or (edge == RISING_EDGE) == (level == 1)):
+                function(gpio, level, tick)
+
+    return
+
+
+class _callback:
+
+    def __init__(self, gpio, edge, function):
+
+        self.entry = (gpio, edge, function)
+
+        with lock:
+            callbacks.append(self.entry)
+
+        return
+
+    def cancel(self):
+
+        with lock:
+            callbacks.remove(self.entry)
+
+        return
+
+
+class pi:
+
+    def __init__(self):
+
+        self.connected = True
+
+        return
+
+    def set_mode(self, gpio, mode):
+
+        return 0
+
+    def set_pull_up_down(self, gpio, pud):
+
+        # Unconnected inputs just follow their pull resistor
+        with lock:
+
+            if pud != PUD_OFF and gpio not in levels:
+                levels[gpio] = 1 if pud == PUD_UP else 0
+
+        return 0
+
+    def read(self, gpio):
+
+        with lock:
+
+            return levels.get(gpio, 0)
+
+    def write(self, gpio, level):
+
+        set_input(gpio, level)
+
+        get_trace().record(Trace.INTERFACE_GPIO, 0, gpio, None, level)
+
+        return 0
+
+    def callback(self, gpio, edge = RISING_EDGE, function = None):
+
+        return _callback(gpio, edge, function)
+
+    def stop(self):
+
+        self.connected = False
+
+        return
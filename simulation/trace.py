@@ -0,0 +1,109 @@
+import collections
+import threading
+
+from log   import *
+from utils import *
+
+
+class Trace:
+
+    # Timestamped record of every simulated hardware access: I2C register writes, SPI frames & GPIO
+    # outputs. Timestamps are taken when an access returns, that is when it's actually done on the bus.
+
+    INTERFACE_I2C  = 'I2C'
+    INTERFACE_SPI  = 'SPI'
+    INTERFACE_GPIO = 'GPIO'
+
+    DEFAULT_CAPACITY = 100000
+
+    def __init__(self, capacity = DEFAULT_CAPACITY):
+
+        self.lock    = threading.Lock()
+        self.entries = collections.deque(maxlen = capacity)
+        self.counts  = collections.Counter()
+
+        return
+
+    def set_capacity(self, capacity):
+
+        with self.lock:
+
+            self.entries = collections.deque(self.entries, maxlen = capacity)
+
+        return
+
+    def record(self, interface, bus, address, register, value):
+
+        entry_time = get_clock().monotonic()
+
+        with self.lock:
+
+            self.entries.append((entry_time, interface, bus, address, register, value))
+            self.counts[interface] += 1
+
+        return
+
+    def get_entries(self, interface = None):
+
+        with self.lock:
+
+            return [entry for entry in self.entries if interface is None or entry[1] == interface]
+
+    def clear(self):
+
+        with self.lock:
+
+            self.entries.clear()
+            self.counts.clear()
+
+        return
+
+    def dump(self, filename):
+
+        log(INFO, 'Dumping simulated hardware trace to {}'.format(filename))
+
+        try:
+
+            with open(filename, 'w') as trace_file:
+
+                for entry_time, interface, bus, address, register, value in self.get_entries():
+
+                    register_text = '-' if register is None else '0x{:02X}'.format(register)
+
+                    trace_file.write('{:.6f} {:<4} {} 0x{:02X} {} 0x{:02X}\n'.format(entry_time, interface, bus, address, register_text, value))
+
+        except OSError as error:
+
+            log(ERROR, 'Cannot dump simulated hardware trace; {}'.format(error))
+
+        return
+
+    def print_status(self):
+
+        with self.lock:
+
+            print('Trace entries: {} (capacity: {})'.format(len(self.entries), self.entries.maxlen))
+
+            for interface in [self.INTERFACE_I2C, self.INTERFACE_SPI, self.INTERFACE_GPIO]:
+                print('{:<4} accesses : {}'.format(interface, self.counts[interface]))
+
+        return
+
+
+# Single trace, shared by all simulated devices, unless a thread records to its own trace
+trace       = Trace()
+trace_local = threading.local()
+
+
+def get_trace():
+
+    return getattr(trace_local, 'trace', trace)
+
+
+def set_trace(thread_trace):
+
+    # Return previous trace, to be restored when done
+    previous_trace    = get_trace()
+    trace_local.trace = thread_trace
+
+    return previous_trace
@@ -1,6 +1,13 @@
-import spidev
+import simulation
 
-from log import *
+from globals import *
+from log     import *
+
+# Only needed with actual hardware
+try:
+    import spidev
+except ImportError:
+    spidev = None
 
 
 class SpiDevice:
@@ -9,9 +16,14 @@ class SpiDevice:
 
         log(INFO, 'Setting up SPI device #{}:{}@{}Hz'.format(bus, address, max_speed))
 
-        self.bus                 = bus
-        self.address             = address
-        self.device              = spidev.SpiDev(bus, address)
+        self.bus     = bus
+        self.address = address
+
+        if control.gpio_interface == USE_SIMULATION:
+            self.device = simulation.SpiDev(bus, address)
+        else:
+            self.device = spidev.SpiDev(bus, address)
+
         self.device.mode         = 0
         self.device.max_speed_hz = max_speed
 
@@ -1,2 +1,4 @@
-from .utils import *
-from .midi  import *
\ No newline at end of file
+from .utils    import *
+from .midi     import *
+from .realtime import *
+from .clock    import *
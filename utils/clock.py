@@ -0,0 +1,136 @@
+import time
+import threading
+
+
+class Clock:
+
+    # Time source of playback code: monotonic time, sleeps, condition waits & busy waits all go
+    # through a clock, so that the very same code can run against a virtual clock, see below.
+
+    def monotonic(self):
+
+        return time.monotonic()
+
+    def sleep(self, duration):
+
+        time.sleep(duration)
+
+        return
+
+    def spin_until(self, end_time):
+
+        while time.monotonic() < end_time:
+            pass
+
+        return
+
+    def wait_for(self, condition, predicate, timeout):
+
+        # Condition's lock must be held by the caller, as for condition.wait_for()
+        return condition.wait_for(predicate, timeout)
+
+
+class VirtualClock(Clock):
+
+    # Clock which time only moves when waited for: sleeping & waiting return at once, just moving
+    # time forward, so that playback runs as fast as possible, while seeing the same timeline.
+
+    def __init__(self, start_time = 0.0):
+
+        self.current_time = start_time
+
+        return
+
+    def monotonic(self):
+
+        return self.current_time
+
+    def sleep(self, duration):
+
+        if duration > 0:
+            self.current_time += duration
+
+        return
+
+    def spin_until(self, end_time):
+
+        self.current_time = max(self.current_time, end_time)
+
+        return
+
+    def wait_for(self, condition, predicate, timeout):
+
+        # Nothing else can happen on a virtual timeline: either predicate holds already, or it's a timeout
+        result = predicate()
+
+        if not result and timeout is not None:
+
+            self.sleep(timeout)
+            result = predicate()
+
+        return result
+
+
+class ScaledClock(Clock):
+
+    # Clock running speed times faster than actual time: sleeps & waits last speed times shorter, so
+    # that playback runs that much faster, while seeing the same timeline, e.g. for a dry run.
+
+    def __init__(self, speed, start_time = 0.0):
+
+        self.speed       = speed
+        self.start_time  = start_time
+        self.origin_time = time.monotonic()
+
+        # Actual time spent busy waiting, which is not computing anything
+        self.spin_time = 0.0
+
+        return
+
+    def monotonic(self):
+
+        return self.start_time + (time.monotonic() - self.origin_time) * self.speed
+
+    def sleep(self, duration):
+
+        if duration > 0:
+            time.sleep(duration / self.speed)
+
+        return
+
+    def spin_until(self, end_time):
+
+        spin_start_time = time.monotonic()
+
+        while self.monotonic() < end_time:
+            pass
+
+        self.spin_time += time.monotonic() - spin_start_time
+
+        return
+
+    def wait_for(self, condition, predicate, timeout):
+
+        if timeout is not None:
+            timeout /= self.speed
+
+        return condition.wait_for(predicate, timeout)
+
+
+# Clock is per thread, so that a thread can run on a virtual clock while others keep real time
+real_clock  = Clock()
+clock_local = threading.local()
+
+
+def get_clock():
+
+    return getattr(clock_local, 'clock', real_clock)
+
+
+def set_clock(clock):
+
+    # Return previous clock, to be restored when done
+    previous_clock    = get_clock()
+    clock_local.clock = clock
+
+    return previous_clock
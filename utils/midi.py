@@ -1,3 +1,6 @@
+import sys
+import array
+
 from mido import tempo2bpm
 
 IS_PAUSE   = 0
@@ -61,39 +64,137 @@ def get_midi_file_tempo(midi_file_data):
     return tempo
 
 
+class MidiEvents:
+
+    # Compact, column based, storage of a MIDI file events: for each event, its type, its pause duration
+    # (in seconds, null for notes) & a bitmap of its notes (MIDI notes 0 to 63, then 64 to 127). This is
+    # way lighter than a list of dictionaries & lists, and fast to walk through while playing.
+
+    def __init__(self):
+
+        self.kinds      = array.array('B')
+        self.pauses     = array.array('d')
+        self.notes_low  = array.array('Q')
+        self.notes_high = array.array('Q')
+
+        return
+
+    @classmethod
+    def from_list(cls, events_list):
+
+        events = cls()
+
+        for event in events_list:
+
+            if event['type'] == IS_PAUSE:
+
+                events.append_pause(event['value'])
+
+            else:
+
+                events.append_notes_event()
+
+                for note in event['value']:
+                    events.append_note(note)
+
+        return events
+
+    def __len__(self):
+
+        return len(self.kinds)
+
+    def append_pause(self, pause):
+
+        # Consecutive pauses are merged together
+        if len(self.kinds) != 0 and self.kinds[-1] == IS_PAUSE:
+
+            self.pauses[-1] += pause
+
+        else:
+
+            self.kinds.append     (IS_PAUSE)
+            self.pauses.append    (pause   )
+            self.notes_low.append (0       )
+            self.notes_high.append(0       )
+
+        return
+
+    def append_notes_event(self):
+
+        self.kinds.append     (IS_NOTES)
+        self.pauses.append    (0.0     )
+        self.notes_low.append (0       )
+        self.notes_high.append(0       )
+
+        return
+
+    def append_note(self, note):
+
+        # Notes played together are merged in a single event; being a bitmap,
+        # duplicate notes (e.g. several instruments playing the same note) vanish
+        if len(self.kinds) == 0 or self.kinds[-1] != IS_NOTES:
+            self.append_notes_event()
+
+        if note < 64:
+            self.notes_low[-1]  |= 1 << note
+        else:
+            self.notes_high[-1] |= 1 << (note - 64)
+
+        return
+
+    def get_kind(self, index):
+
+        return self.kinds[index]
+
+    def get_pause(self, index):
+
+        return self.pauses[index]
+
+    def get_notes(self, index):
+
+        # Return notes in ascending order (for debug readability & possible truncation)
+        notes = []
+        bits  = self.notes_low[index] | (self.notes_high[index] << 64)
+
+        while bits != 0:
+
+            lowest_bit = bits & -bits
+            notes.append(lowest_bit.bit_length() - 1)
+            bits ^= lowest_bit
+
+        return notes
+
+    def get_length(self):
+
+        # As every non null message delta time ends up in a pause event, summing up
+        # pauses gives the whole file length, without walking through the file again.
+        return sum(self.pauses)
+
+    def get_size(self):
+
+        # Memory used by events, in bytes
+        size = sys.getsizeof(self)
+
+        for column in (self.kinds, self.pauses, self.notes_low, self.notes_high):
+            size += sys.getsizeof(column)
+
+        return size
+
+
 def get_midi_file_events(midi_file_data):
 
-    events = []
+    events = MidiEvents()
 
     for msg in midi_file_data:
 
         if msg.time != 0:
 
-            if len(events) != 0 and events[-1]['type'] == IS_PAUSE:
-                events[-1]['value'] += msg.time
-            else:
-                events.append({'type' : IS_PAUSE,
-                               'value': msg.time})
+            events.append_pause(msg.time)
 
         if msg.type == 'note_on' or msg.type == 'note_off':
 
             if msg.velocity != 0:
 
-                if len(events) != 0 and events[-1]['type'] == IS_NOTES:
-                    events[-1]['value'].append(msg.note)
-                else:
-                    events.append({'type' : IS_NOTES,
-                                   'value': [msg.note]})
-
-    # Post process events
-    for event in events:
-
-        if event['type'] == IS_NOTES:
-            # Remove duplicate notes, if any (consider the case of
-            # several instruments playing the note at the same time)
-            event['value'] = list(set(event['value']))
-
-            # Order notes ascending (for debug readability & possible truncation)
-            event['value'].sort()
+                events.append_note(msg.note)
 
     return events
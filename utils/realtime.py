@@ -0,0 +1,86 @@
+import os
+import ctypes
+import ctypes.util
+import threading
+
+from log import *
+
+MCL_CURRENT = 1
+MCL_FUTURE  = 2
+
+REALTIME_FALLBACK_NICE = -10
+
+
+def set_realtime_mode(priority, cpu, lock_memory):
+
+    # Try to get real time guarantees for the calling thread, falling back to whatever can be
+    # obtained; returns a dictionary describing what was actually obtained, for reporting.
+    obtained = {'scheduler': 'default', 'affinity': 'any CPU', 'memory': 'not locked'}
+
+    try:
+
+        # On Linux, a null PID applies to the calling thread only
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        obtained['scheduler'] = 'SCHED_FIFO, priority {}'.format(priority)
+
+    except (AttributeError, OSError) as error:
+
+        log(WARNING, 'Cannot set SCHED_FIFO scheduling ({}); trying nice level instead'.format(error))
+
+        try:
+
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), REALTIME_FALLBACK_NICE)
+            obtained['scheduler'] = 'nice {}'.format(REALTIME_FALLBACK_NICE)
+
+        except (AttributeError, OSError) as error:
+
+            log(WARNING, 'Cannot set nice level either ({})'.format(error))
+
+    if cpu is not None and cpu >= 0:
+
+        try:
+
+            os.sched_setaffinity(0, {cpu})
+            obtained['affinity'] = 'CPU {}'.format(cpu)
+
+        except (AttributeError, OSError) as error:
+
+            log(WARNING, 'Cannot pin thread to CPU {} ({})'.format(cpu, error))
+
+    if lock_memory == True:
+
+        try:
+
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno = True)
+
+            if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+            obtained['memory'] = 'locked'
+
+        except (AttributeError, OSError) as error:
+
+            log(WARNING, 'Cannot lock memory ({})'.format(error))
+
+    for guarantee, status in obtained.items():
+
+        log(INFO, 'Real time mode - {:9}: {}'.format(guarantee, status))
+
+    return obtained
+
+
+def reset_realtime_mode():
+
+    # Give the calling thread back default scheduling, e.g. a worker thread started by a real time
+    # thread, which inherits its scheduling policy & CPU affinity, while it's not timing critical.
+    try:
+
+        os.sched_setscheduler(0, os.SCHED_OTHER, os.sched_param(0))
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 0)
+        os.sched_setaffinity(0, range(0, os.cpu_count()))
+
+    except (AttributeError, OSError) as error:
+
+        log(WARNING, 'Cannot reset real time mode ({})'.format(error))
+
+    return
@@ -1 +1,3 @@
-from .xylophone import Xylophone
+from .xylophone  import Xylophone
+from .strikeplan import StrikePlan
+from .notesmap   import NotesMap
@@ -0,0 +1,89 @@
+import ioextender
+
+from log import *
+
+
+class NotesMap:
+
+    # Where each bar is wired: (I2C bus, IO extender address, extender pin) per MIDI note, from setup
+    # XYLOPHONE_NOTES_MAP entry, or else contiguous notes from XYLOPHONE_LOWEST_NOTE, IOS_COUNT per
+    # extender, on MCP_23017_I2C_ADDRESS_1 then MCP_23017_I2C_ADDRESS_2. Extenders get ordered by the
+    # lowest note they drive, & each note gets its output, i.e. extender index * IOS_COUNT + pin, that
+    # is port index * 8 + bit, once for all: notes then compile to per port masks, whatever the wiring.
+
+    def __init__(self, wiring):
+
+        # Wiring is a dict of (bus, address, pin) tuples, by MIDI note number
+        self.extenders    = []
+        self.note_outputs = []
+        self.lowest_note  = None
+        self.highest_note = None
+
+        outputs = {}
+
+        for note in sorted(wiring.keys()):
+
+            bus, address, pin = wiring[note]
+
+            if not 0 <= pin <= ioextender.IoExtender.IOS_COUNT - 1:
+
+                log(ERROR, 'Cannot map note {}; out of range pin: {}'.format(note, pin))
+                continue
+
+            if (bus, address) not in self.extenders:
+                self.extenders.append((bus, address))
+
+            output = self.extenders.index((bus, address)) * ioextender.IoExtender.IOS_COUNT + pin
+
+            if output in outputs.values():
+
+                log(ERROR, 'Cannot map note {}; pin @{}/{}/{} already mapped'.format(note, bus, address, pin))
+                continue
+
+            outputs[note] = output
+
+        if len(outputs) != 0:
+
+            self.lowest_note  = min(outputs.keys())
+            self.highest_note = max(outputs.keys())
+
+            # Notes in range but not wired get no output
+            self.note_outputs = [outputs.get(note) for note in range(self.lowest_note, self.highest_note + 1)]
+
+        self.notes_count = len(outputs)
+        self.ports_count = len(self.extenders) * 2
+
+        return
+
+    @staticmethod
+    def from_setup(setup_data):
+
+        # JSON keys are strings: "60": [1, 32, 7] maps note 60 to pin 7 of extender 32 on bus 1
+        if setup_data.get('XYLOPHONE_NOTES_MAP') is not None:
+
+            notes_map = NotesMap({int(note): tuple(entry) for note, entry in setup_data['XYLOPHONE_NOTES_MAP'].items()})
+
+        else:
+
+            addresses = [setup_data['MCP_23017_I2C_ADDRESS_1'], setup_data['MCP_23017_I2C_ADDRESS_2']]
+            wiring    = {}
+
+            for note_pin in range(0, setup_data['XYLOPHONE_NOTES_COUNT']):
+
+                note           = setup_data['XYLOPHONE_LOWEST_NOTE'] + note_pin
+                extender_index = note_pin // ioextender.IoExtender.IOS_COUNT
+
+                if extender_index >= len(addresses):
+
+                    log(ERROR, 'Cannot map note {}; no IO extender left (see XYLOPHONE_NOTES_MAP)'.format(note))
+                    break
+
+                wiring[note] = (setup_data['I2C_BUS_NUMBER'], addresses[extender_index], note_pin % ioextender.IoExtender.IOS_COUNT)
+
+            notes_map = NotesMap(wiring)
+
+        # A xylophone with no bar to strike has no lowest & highest notes either: no use going any further
+        if notes_map.notes_count == 0:
+            raise ValueError('No note mapped to any IO extender pin; check XYLOPHONE_NOTES_MAP, or XYLOPHONE_LOWEST_NOTE & XYLOPHONE_NOTES_COUNT')
+
+        return notes_map
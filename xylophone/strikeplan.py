@@ -0,0 +1,76 @@
+import array
+
+
+class StrikePlan:
+
+    # Events compiled into ready to write output latches values: for each event, one byte per IO
+    # extender port (OLATA then OLATB, for each extender in turn), plus the number of notes that
+    # are actually struck. Pause events & fully dropped notes events get no note at all.
+    #
+    # Chords too large to be struck at once are staggered, and notes which bar is not ready to be
+    # struck again may be delayed: such events are split into groups, each one with its own masks &
+    # time offset from the event deadline. Groups of all events are stored one after another; for
+    # each event, index of its first group & groups count (0 when struck at once, with event masks).
+
+    def __init__(self, ports_count):
+
+        self.ports_count        = ports_count
+        self.masks              = array.array('B')
+        self.notes_counts       = array.array('B')
+        self.groups_starts      = array.array('I')
+        self.groups_counts      = array.array('B')
+        self.groups_masks       = array.array('B')
+        self.groups_offsets     = array.array('d')
+        self.strikes_count      = 0
+        self.truncations_count  = 0
+        self.out_of_range_count = 0
+        self.staggered_count    = 0
+
+        # Strikes affected by minimum re-strike interval, per policy
+        self.restrike_drops_count   = 0
+        self.restrike_delays_count  = 0
+        self.restrike_octaves_count = 0
+
+        return
+
+    def __len__(self):
+
+        return len(self.notes_counts)
+
+    def append(self, masks, notes_count, groups = None):
+
+        # Groups, if any, are (time offset, masks) tuples, in strike order
+        self.masks.extend        (masks                  )
+        self.notes_counts.append (notes_count            )
+        self.groups_starts.append(len(self.groups_offsets))
+
+        if notes_count != 0:
+            self.strikes_count += 1
+
+        if groups is None:
+
+            self.groups_counts.append(0)
+
+        else:
+
+            self.groups_counts.append(len(groups))
+
+            for offset, group_masks in groups:
+
+                self.groups_offsets.append(offset     )
+                self.groups_masks.extend  (group_masks)
+
+        return
+
+    def get_masks(self, index):
+
+        offset = index * self.ports_count
+
+        return self.masks[offset:offset + self.ports_count]
+
+    def get_group(self, index, group):
+
+        # Return group time offset, and offset of its masks in groups masks
+        group_index = self.groups_starts[index] + group
+
+        return self.groups_offsets[group_index], group_index * self.ports_count
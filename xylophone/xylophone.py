@@ -1,127 +1,539 @@
-import time
+import collections
 import ioextender
 
-from log     import *
-from utils   import *
-from globals import *
+from log         import *
+from utils       import *
+from globals     import *
+from .strikeplan import StrikePlan
 
 
 class Xylophone:
 
-    def __init__(self, lowest_note, notes_count, max_simultaneous_notes, io_extender_low, io_extender_high):
+    # Margin on minimum re-strike intervals at play time, as strikes never land exactly on time
+    RESTRIKE_TOLERANCE = 0.002
 
-        log(INFO, 'Setup Xylophone with {} notes'.format(notes_count))
+    def __init__(self, notes_map, max_simultaneous_notes, io_extenders):
 
-        highest_note = lowest_note + notes_count - 1
+        # IO extenders are expected in notes map order (see NotesMap)
+        log(INFO, 'Setup Xylophone with {} notes, on {} IO extenders'.format(notes_map.notes_count, len(io_extenders)))
 
-        log(DEBUG, 'Lowest  note: {} ({})'.format(get_note_name_from_midi_number(lowest_note ), lowest_note ))
-        log(DEBUG, 'Highest note: {} ({})'.format(get_note_name_from_midi_number(highest_note), highest_note))
+        log(DEBUG, 'Lowest  note: {} ({})'.format(get_note_name_from_midi_number(notes_map.lowest_note ), notes_map.lowest_note ))
+        log(DEBUG, 'Highest note: {} ({})'.format(get_note_name_from_midi_number(notes_map.highest_note), notes_map.highest_note))
 
-        self.lowest_note            = lowest_note
-        self.highest_note           = highest_note
+        self.lowest_note            = notes_map.lowest_note
+        self.highest_note           = notes_map.highest_note
         self.max_simultaneous_notes = max_simultaneous_notes
-        self.io_extender_low        = io_extender_low
-        self.io_extender_high       = io_extender_high
+        self.io_extenders           = io_extenders
+        self.ports_count            = len(self.io_extenders) * 2
+        self.note_outputs           = notes_map.note_outputs
+        self.note_ports             = []
+
+        # All output latches writes go through a single batch, so that each chord is written at once,
+        # and inter chip skew of the last strike is known
+        self.batch       = ioextender.IoExtendersBatch(self.io_extenders)
+        self.strike_skew = 0.0
+
+        # How long the last strike waited for its staggered or delayed groups, on top of its notes length,
+        # which next pause gets shortened by (see pause())
+        self.strike_overrun = 0.0
+
+        # Optional writer thread, which then writes all outputs on given deadlines, and function called
+        # with strike deadline, time notes actually got struck & inter chip skew, once they did
+        self.writer          = None
+        self.strike_callback = None
+
+        # For each note, get once for all the extender port (OLATA/OLATB) & bit it's wired to, if any
+        for output in self.note_outputs:
+
+            if output is None:
+                self.note_ports.append(None)
+            else:
+                self.note_ports.append((output // 8, 1 << (output % 8)))
+
+        self.off_masks = bytes(self.ports_count)
+
+        # Minimum re-strike interval of each bar, indexed by output, i.e. port index * 8 + bit, and time
+        # each bar was last struck at, to drop strikes still too close at play time
+        self.restrike_intervals = [control.restrike_interval] * (self.ports_count * 8)
+
+        for note_pin, note_port in enumerate(self.note_ports):
+            if note_port is not None:
+                self.restrike_intervals[self.__get_output__(self.lowest_note + note_pin)] = control.restrike_intervals.get(self.lowest_note + note_pin, control.restrike_interval)
+
+        self.last_strike_times   = [float('-inf')] * len(self.restrike_intervals)
+        self.is_restrike_checked = max(self.restrike_intervals) > 0
+        self.restrike_drops      = 0
+
+        # Notes struck but not released yet: (release time, masks) entries, in release order
+        self.releases = collections.deque()
 
         return
 
-    def play_note(self, note):
+    def __is_wired__(self, note):
 
-        log(DEBUG, 'Xylophone playing note #{}'.format(note))
+        return self.lowest_note <= note <= self.highest_note and self.note_ports[note - self.lowest_note] is not None
 
-        if not self.lowest_note <= note <= self.highest_note:
+    def __get_output__(self, note):
 
-            log(ERROR, 'Cannot play note; out of range value: {}'.format(note))
-            return
+        # Output a wired note gets struck on, as indexed at play time, i.e. port index * 8 + bit
+        port_index, bit_mask = self.note_ports[note - self.lowest_note]
 
-        note_pin = note - self.lowest_note
+        return port_index * 8 + bit_mask.bit_length() - 1
 
-        if note_pin < ioextender.IoExtender.IOS_COUNT:
+    def __is_budgeted__(self):
 
-            self.io_extender_low.write_io(note_pin, 1)
-            time.sleep(control.note_length)
-            self.io_extender_low.write_io(note_pin, 0)
+        return control.stagger_window > 0 and control.stagger_coils > 0
 
-        else:
+    def __get_masks__(self, notes):
 
-            self.io_extender_high.write_io(note_pin - ioextender.IoExtender.IOS_COUNT, 1)
-            time.sleep(control.note_length)
-            self.io_extender_high.write_io(note_pin - ioextender.IoExtender.IOS_COUNT, 0)
+        masks = bytearray(self.ports_count)
 
-        return
+        for note in notes:
 
-    def play_notes(self, notes):
+            port_index, bit_mask = self.note_ports[note - self.lowest_note]
 
-        log(DEBUG, 'Xylophone playing note(s) {}'.format(notes))
+            masks[port_index] |= bit_mask
+
+        return masks
+
+    def __get_restrike_delay__(self, note, strike_time, last_strike_times):
+
+        # Return how long to wait for note's bar to be ready to be struck again, 0 if it's ready, that
+        # is also when it's ready within play time margin (and timeline rounding errors)
+        output = self.__get_output__(note)
+        delay  = last_strike_times[output] + self.restrike_intervals[output] - strike_time
+
+        if delay < self.RESTRIKE_TOLERANCE:
+            return 0.0
+
+        return delay
+
+    def __get_octave_note__(self, note, notes, resolved, strike_time, last_strike_times):
+
+        # Return the octave of note to strike instead, if any is wired, not already struck & ready; octave
+        # below first, as lower notes are the most expressive ones
+        for candidate in [note - 12, note + 12]:
+
+            if self.__is_wired__(candidate) and (candidate not in notes) and (candidate not in [resolved_note for resolved_note, resolved_delay in resolved]) and (self.__get_restrike_delay__(candidate, strike_time, last_strike_times) == 0):
+                return candidate
+
+        return None
+
+    def __resolve_restrikes__(self, notes, strike_time, next_time, last_strike_times, plan):
+
+        # Return (note, delay) tuples for notes to strike, applying re-strike policy to notes which
+        # bar was struck less than its minimum re-strike interval ago; update bars last strike times.
+        # Delayed notes must be struck (staggering included) before next notes event time: when they
+        # cannot, they are moved to octave, or dropped, so that rhythm never gets pushed back.
+        resolved  = []
+        max_delay = next_time - strike_time
+
+        if self.__is_budgeted__():
+            max_delay -= control.stagger_window
+
+        for note in notes:
+
+            delay = self.__get_restrike_delay__(note, strike_time, last_strike_times)
+
+            if delay > 0 and control.restrike_policy == RESTRIKE_POLICY_DELAY and delay < max_delay:
+
+                plan.restrike_delays_count += 1
+
+            elif delay > 0 and control.restrike_policy in [RESTRIKE_POLICY_DELAY, RESTRIKE_POLICY_OCTAVE]:
+
+                octave_note = self.__get_octave_note__(note, notes, resolved, strike_time, last_strike_times)
+
+                if octave_note is None:
+
+                    plan.restrike_drops_count += 1
+                    continue
+
+                note  = octave_note
+                delay = 0.0
+
+                plan.restrike_octaves_count += 1
+
+            elif delay > 0:
+
+                plan.restrike_drops_count += 1
+                continue
+
+            resolved.append((note, delay))
+
+            last_strike_times[self.__get_output__(note)] = strike_time + delay
+
+        return resolved
 
-        if len(notes) > self.max_simultaneous_notes:
+    def __compile_notes__(self, notes, plan, strike_time, last_strike_times, next_time = float('inf')):
 
-            log(WARNING, 'Maximum allowed simultaneous notes passed; dropping notes: {}'.format(notes[self.max_simultaneous_notes:]))
+        # Under a coils budget, chords get staggered rather than truncated: budget replaces maximum simultaneous notes
+        is_budgeted = self.__is_budgeted__()
+
+        if (not is_budgeted) and len(notes) > self.max_simultaneous_notes:
+
+            log(DEBUG, 'Maximum allowed simultaneous notes passed; dropping notes: {}'.format(notes[self.max_simultaneous_notes:]))
 
             # Drop the last notes in the list, that is the highest ones,
             # the ones with the least expressive sound on a xylophone.
             notes = notes[:self.max_simultaneous_notes]
 
+            plan.truncations_count += 1
+
         for note in notes:
 
-            if not self.lowest_note <= note <= self.highest_note:
+            if not self.__is_wired__(note):
+
+                log(DEBUG, 'Cannot play note(s); out of range value: {}'.format(note))
+
+                plan.out_of_range_count += 1
+                plan.append(self.off_masks, 0)
 
-                log(ERROR, 'Cannot play note(s); out of range value: {}'.format(note))
                 return
 
-        low_notes_0  = []
-        low_notes_1  = []
-        high_notes_0 = []
-        high_notes_1 = []
+        if self.is_restrike_checked == True:
+            resolved = self.__resolve_restrikes__(notes, strike_time, next_time, last_strike_times, plan)
+        else:
+            resolved = [(note, 0.0) for note in notes]
 
-        for note in notes:
+        # Notes to strike on each time offset: on time ones, and delayed ones, once their bar is ready again
+        delays = sorted(set(delay for note, delay in resolved))
+        groups = [(delay, [note for note, note_delay in resolved if note_delay == delay]) for delay in delays]
 
-            note_pin = note - self.lowest_note
+        if is_budgeted:
 
-            pin_value_0 = {}
-            pin_value_1 = {}
+            budgeted_groups = self.__budget_notes__(groups)
 
-            pin_value_0['value'] = 0
-            pin_value_1['value'] = 1
+            if len(budgeted_groups) != len(groups):
+                plan.staggered_count += 1
 
-            if note_pin < ioextender.IoExtender.IOS_COUNT:
+            groups = budgeted_groups
 
-                pin_value_0['pin'] = note_pin
-                pin_value_1['pin'] = note_pin
+            # Staggered notes get struck a little later than their bar was found ready for
+            if self.is_restrike_checked == True:
+                for offset, group_notes in groups:
+                    for note in group_notes:
+                        last_strike_times[self.__get_output__(note)] = strike_time + offset
 
-                low_notes_0.append(pin_value_0)
-                low_notes_1.append(pin_value_1)
+        notes = [note for offset, group_notes in groups for note in group_notes]
 
-            else:
+        if len(notes) == 0:
+
+            plan.append(self.off_masks, 0)
+            return
+
+        # Notes all struck at once, on time, need no group
+        if len(groups) == 1 and groups[0][0] == 0:
+            plan.append(self.__get_masks__(notes), len(notes))
+        else:
+            plan.append(self.__get_masks__(notes), len(notes), [(offset, self.__get_masks__(group_notes)) for offset, group_notes in groups])
+
+        return
+
+    def __budget_notes__(self, groups):
+
+        # Return (time offset, notes) groups, so that power supply never has to energise more coils at once
+        # than coils budget: groups larger than that are split in groups of at most that many notes, lowest
+        # notes first, evenly spread over stagger window from their offset. Coils energising edges are what
+        # the budget is about, not coils held afterwards: no note is ever dropped.
+        budgeted_groups = []
+
+        for offset, notes in groups:
 
-                pin_value_0['pin'] = note_pin - ioextender.IoExtender.IOS_COUNT
-                pin_value_1['pin'] = note_pin - ioextender.IoExtender.IOS_COUNT
+            edges_count = (len(notes) + control.stagger_coils - 1) // control.stagger_coils
 
-                high_notes_0.append(pin_value_0)
-                high_notes_1.append(pin_value_1)
+            for edge in range(0, edges_count):
 
-        if len(low_notes_1) != 0:
+                if edges_count > 1:
+                    edge_offset = offset + edge * control.stagger_window / (edges_count - 1)
+                else:
+                    edge_offset = offset
 
-            self.io_extender_low.write_ios(low_notes_1)
+                budgeted_groups.append((edge_offset, notes[edge * control.stagger_coils:(edge + 1) * control.stagger_coils]))
 
-        if len(high_notes_1) != 0:
+        return sorted(budgeted_groups, key = lambda group: group[0])
 
-            self.io_extender_high.write_ios(high_notes_1)
+    def compile_events(self, events, tempo_ratio = 1.0):
 
-        time.sleep(control.note_length)
+        # Re-strike intervals are checked on the timeline at given tempo ratio, that is current one
+        plan              = StrikePlan(self.ports_count)
+        strike_time       = 0.0
+        last_strike_times = [float('-inf')] * len(self.restrike_intervals)
+
+        for index in range(0, len(events)):
+
+            if events.kinds[index] == IS_PAUSE:
+
+                plan.append(self.off_masks, 0)
+                strike_time += events.pauses[index] * tempo_ratio
+
+            else:
 
-        if len(low_notes_0) != 0:
+                # Next notes event comes after the following pause, if any; none after track end
+                if index + 1 < len(events) and events.kinds[index + 1] == IS_PAUSE:
+                    next_time = strike_time + events.pauses[index + 1] * tempo_ratio
+                else:
+                    next_time = strike_time
 
-            self.io_extender_low.write_ios(low_notes_0)
+                self.__compile_notes__(events.get_notes(index), plan, strike_time, last_strike_times, next_time)
 
-        if len(high_notes_0) != 0:
+        log(DEBUG, 'Compiled {} strikes; {} truncated, {} staggered, {} dropped as out of range'.format(plan.strikes_count, plan.truncations_count, plan.staggered_count, plan.out_of_range_count))
 
-            self.io_extender_high.write_ios(high_notes_0)
+        if plan.truncations_count != 0:
+            log(WARNING, 'Maximum allowed simultaneous notes passed; {} chords truncated'.format(plan.truncations_count))
+
+        if plan.out_of_range_count != 0:
+            log(ERROR, 'Out of range notes; {} notes events dropped'.format(plan.out_of_range_count))
+
+        if plan.restrike_drops_count + plan.restrike_delays_count + plan.restrike_octaves_count != 0:
+            log(WARNING, 'Minimum re-strike interval not met; {} strikes dropped, {} delayed, {} moved to octave'.format(plan.restrike_drops_count, plan.restrike_delays_count, plan.restrike_octaves_count))
+
+        return plan
+
+    def set_writer(self, writer):
+
+        self.writer = writer
+        self.batch.set_writer(writer)
 
         return
 
+    def __write_masks__(self, masks, offset, deadline = None):
+
+        self.batch.set_ports(masks, offset)
+
+        return self.batch.commit(deadline)
+
+    def __get_group_masks__(self, plan, index, group):
+
+        # Return group time offset & masks; events which are not staggered are a single group
+        if plan.groups_counts[index] == 0:
+            return 0.0, plan.get_masks(index)
+
+        group_offset, masks_offset = plan.get_group(index, group)
+
+        return group_offset, plan.groups_masks[masks_offset:masks_offset + plan.ports_count]
+
+    def __filter_restrikes__(self, masks, current_time):
+
+        # Play time safety net, e.g. when playing tempo got raised after compilation: drop notes which
+        # bar was struck less than its minimum re-strike interval ago (give or take some jitter).
+        filtered_masks = bytearray(masks)
+
+        for port_index in range(0, self.ports_count):
+
+            port_mask = filtered_masks[port_index]
+
+            if port_mask == 0:
+                continue
+
+            for bit in range(0, 8):
+
+                if port_mask & (1 << bit):
+
+                    output = port_index * 8 + bit
+
+                    if current_time - self.last_strike_times[output] < self.restrike_intervals[output] - self.RESTRIKE_TOLERANCE:
+
+                        filtered_masks[port_index] &= ~(1 << bit)
+                        self.restrike_drops        += 1
+
+                    else:
+
+                        self.last_strike_times[output] = current_time
+
+        return filtered_masks
+
     @staticmethod
-    def pause(pause_duration):
+    def __wait_until__(clock, wait_time):
+
+        # Sleep for the bulk of the wait, and only busy wait for its very last part, as Scheduler does
+        sleep_time = wait_time - clock.monotonic() - control.spin_time
+
+        if sleep_time > 0:
+            clock.sleep(sleep_time)
+
+        clock.spin_until(wait_time)
+
+        return
+
+    def strike(self, plan, index, deadline = None):
+
+        # Return the time output latches write returned, that is when notes actually got struck; with
+        # a writer, notes get posted right away instead, & strike callback is given notes deadline,
+        # if any, once they actually got struck
+        if plan.notes_counts[index] == 0:
+
+            self.strike_overrun = 0.0
+            return None
+
+        clock               = get_clock()
+        start_time          = clock.monotonic()
+        strike_time         = None
+        self.strike_skew    = 0.0
+        self.strike_overrun = 0.0
+
+        # Add each group of a staggered chord to the ones already struck, on its own time offset
+        for group in range(0, max(1, plan.groups_counts[index])):
+
+            group_offset, masks = self.__get_group_masks__(plan, index, group)
+
+            self.__wait_until__(clock, start_time + group_offset)
+
+            if self.is_restrike_checked == True:
+                masks = self.__filter_restrikes__(masks, clock.monotonic())
+
+            # Writer thread only knows about posting time: first group strike gets reported against deadline
+            if self.writer is not None and self.strike_callback is not None and strike_time is None and deadline is not None:
+                callback = lambda post_time, write_time, skew, group_offset = group_offset: self.strike_callback(deadline, write_time - group_offset, skew)
+            else:
+                callback = None
+
+            commit_time      = self.__or_masks__(masks, 0, None, callback)
+            self.strike_skew = max(self.strike_skew, self.batch.skew)
+
+            if strike_time is None:
+                strike_time = commit_time - group_offset
+
+            self.strike_overrun = group_offset
+
+        clock.sleep(control.note_length)
+        self.__write_masks__(self.off_masks, 0)
+
+        return strike_time
+
+    def __or_masks__(self, masks, offset, deadline = None, callback = None):
+
+        self.batch.set_bits(masks, offset)
+
+        return self.batch.commit(deadline, callback)
+
+    def press(self, plan, index, group = 0, deadline = None):
+
+        # Strike notes, but do not wait to release them: release is scheduled note length later,
+        # and left to the caller (see release()), that may strike other notes in the meantime.
+        # Staggered chords get pressed one group at once, on the caller's time (see get_group()).
+        # Return the time output latches write returned, that is when notes actually got struck;
+        # with a writer, notes get struck on given deadline, which is returned instead.
+        if plan.notes_counts[index] == 0:
+            return None
+
+        group_offset, new_masks = self.__get_group_masks__(plan, index, group)
+
+        if self.is_restrike_checked == True:
+            new_masks = self.__filter_restrikes__(new_masks, deadline if deadline is not None else get_clock().monotonic())
+
+        # Notes struck again while still held get released with that new strike, not before
+        for release_time, masks in self.releases:
+            for port_index in range(0, self.ports_count):
+                masks[port_index] &= ~new_masks[port_index]
+
+        strike_time = self.__or_masks__(new_masks, 0, deadline, self.strike_callback if group == 0 else None)
+
+        # Staggered chords skew is the worst of their groups
+        if group == 0:
+            self.strike_skew = self.batch.skew
+        else:
+            self.strike_skew = max(self.strike_skew, self.batch.skew)
+
+        # Note length is constant (but for a console change), so that releases just queue up in order
+        self.releases.append((strike_time + control.note_length, bytearray(new_masks)))
+
+        return strike_time
+
+    def get_next_release_time(self):
+
+        if len(self.releases) == 0:
+            return None
+
+        return self.releases[0][0]
+
+    def get_last_release_time(self):
+
+        if len(self.releases) == 0:
+            return None
+
+        return self.releases[-1][0]
+
+    def release(self, current_time):
+
+        # Release all notes which release time is reached, in a single write per port; with a writer,
+        # notes get released on that time, rather than right away
+        release_masks = bytearray(self.ports_count)
+
+        while len(self.releases) != 0 and self.releases[0][0] <= current_time:
+
+            release_time, masks = self.releases.popleft()
+
+            for port_index in range(0, self.ports_count):
+                release_masks[port_index] |= masks[port_index]
+
+        self.batch.clear_bits(release_masks, 0)
+        self.batch.commit(current_time)
+
+        return
+
+    def release_all(self, deadline = None):
+
+        # With a writer, release all notes after whatever was posted up to deadline; with no deadline,
+        # drop whatever was not written yet & release all notes right away
+        if deadline is None:
+            self.batch.discard()
+
+        self.releases.clear()
+        self.__write_masks__(self.off_masks, 0, deadline)
+
+        return
+
+    def needs_resync(self):
+
+        return self.batch.needs_resync()
+
+    def resync(self):
+
+        # Push outputs again to IO extenders which failed a write, so that no solenoid is left energised
+        # until next write: to be called again, until they are back in sync (see needs_resync())
+        if self.needs_resync() == True:
+            self.batch.resync()
+
+        return
+
+    def play_note(self, note):
+
+        log(DEBUG, 'Xylophone playing note #{}'.format(note))
+
+        if not self.__is_wired__(note):
+
+            log(ERROR, 'Cannot play note; out of range value: {}'.format(note))
+            return
+
+        # Through batch, as all other writes, so that a writer, if any, remains the only one to write outputs
+        masks = self.__get_masks__([note])
+
+        self.__or_masks__(masks, 0)
+        get_clock().sleep(control.note_length)
+        self.batch.clear_bits(masks, 0)
+        self.batch.commit()
+
+        return
+
+    def play_notes(self, notes):
+
+        log(DEBUG, 'Xylophone playing note(s) {}'.format(notes))
+
+        plan = StrikePlan(self.ports_count)
+
+        self.__compile_notes__(sorted(notes), plan, 0.0, [float('-inf')] * len(self.restrike_intervals))
+
+        if plan.truncations_count != 0:
+            log(WARNING, 'Maximum allowed simultaneous notes passed; dropping notes: {}'.format(sorted(notes)[self.max_simultaneous_notes:]))
+
+        if plan.out_of_range_count != 0:
+            log(ERROR, 'Cannot play note(s); out of range value in: {}'.format(notes))
+
+        self.strike(plan, 0)
+
+        return
+
+    def pause(self, pause_duration, sleep = None):
 
         log(DEBUG, 'Xylophone pausing for: {} s'.format(pause_duration))
 
@@ -129,13 +541,16 @@ class Xylophone:
         # and pause events are systematically stored one after another (we never get notes
         # after notes of pause after pause). As notes events executes with a fixed duration,
         # we have to remove that duration, - as that already elapsed, - to the upcoming pause.
-        actual_pause_duration = pause_duration - control.note_length
+        # Same goes for the time spent striking staggered or delayed groups, if any.
+        actual_pause_duration = pause_duration - control.note_length - self.strike_overrun
 
         # This should not occur that much, - as note length is very short, - but just in case
         # pause duration gets negative, it's not time to sleep: let's go straight to next notes!
         if actual_pause_duration <= 0:
             log(WARNING, 'Got a very short pause ({}): bypassing sleep'.format(pause_duration))
+        elif sleep is None:
+            get_clock().sleep(actual_pause_duration)
         else:
-            time.sleep(actual_pause_duration)
+            sleep(actual_pause_duration)
 
         return